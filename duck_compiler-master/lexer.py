@@ -9,7 +9,7 @@ but modified to read from a file.
 Author: Michal Young (michal@cs.uoregon.edu), March 2018
 """
 import typing
-from typing import Sequence, Type, TextIO
+from typing import Iterator, Sequence, Type, TextIO
 import re
 import syntax
 import expr
@@ -30,7 +30,7 @@ class LexicalError(Exception):
 class Token(object):
     """One token from the input stream"""
 
-    def __init__(self, value: any, kind: str, clazz: Type(expr.Expr)):
+    def __init__(self, value: any, kind: str, clazz: Type[expr.Expr]):
         self.value = value
         self.kind = kind
         self.clazz = clazz
@@ -44,61 +44,47 @@ class Token(object):
     
 class Token_Stream(object):
     """
-    Provides the tokens within a string one-by-one.
+    Provides the tokens within a file one-by-one.
+    The file is read in one piece and lexed lazily,
+    with one token of lookahead; peek and take return
+    None at end of input.
     """
 
     def __init__(self, f: TextIO):
         self.file = f
-        self.tokens = [ ]
-        self._check_fill()
-        log.debug("Tokens: {}".format(self.tokens))
+        self._tokens = tokens(f.read())
+        self._next = next(self._tokens, None)
 
     def __str__(self) -> str: 
-        return "[{}]".format("|".join(self.tokens))
-
-    def _check_fill(self):
-        if len(self.tokens) == 0:
-            line = self.file.readline()
-            while line == "\n":
-                # Skip blank lines
-                line = self.file.readline()
-            if len(line) > 0:
-                # Zero-length line means EOF
-                self.tokens = lex(line.strip())
-                log.debug("Refilled, tokens: {}".format(self.tokens))
-
+        return "Token_Stream(next={})".format(self._next)
 
     def has_more(self) -> bool:
         """True if there are more tokens in the stream"""
-        self._check_fill()
-        return len(self.tokens) > 0
+        return self._next is not None
 
     def peek(self) -> Token:
         """Examine next token without consuming it. """
-        self._check_fill()
-        if len(self.tokens) > 0:
-            token = self.tokens[0]
-        else:
-            token = END
-        return token
+        return self._next
 
     def take(self) -> Token:
         """Consume next token"""
-        self._check_fill()
-        if len(self.tokens) > 0:
-            token = self.tokens.pop(0)
-        else:
-            token = END
+        token = self._next
+        if token is not None:
+            self._next = next(self._tokens, None)
         return token
 
 
+# Tokens are delimited by white space
+WORDS = re.compile(r"\S+")
+
+def tokens(s: str) -> Iterator[Token]:
+    """Generate the Token objects in s"""
+    for match in WORDS.finditer(s):
+        yield classify(match.group())
+
 def lex(s: str) -> Sequence[Token]:
     """Break string into a list of Token objects"""
-    words = s.split()
-    tokens = [ ]
-    for word in words:
-        tokens.append(classify(word))
-    return tokens
+    return list(tokens(s))
 
 def classify(word: str) -> Token:
     """Convert a textual token into a Token object
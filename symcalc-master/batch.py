@@ -0,0 +1,102 @@
+"""
+Batch evaluation of symbolic calculator expressions over columns
+of a CSV file.  The first line of the file names the columns, and
+each expression is evaluated once, over all rows together, with
+each variable bound to the NumPy array for its column.  Every
+variable must name a column.  Expressions are evaluated in order,
+so an assignment adds a column that later expressions can use.
+The output is the input columns followed by one column for each
+expression.
+
+Example:
+    python3 batch.py "price qty *" "total price qty * =" < orders.csv
+
+Requires NumPy.  Division by zero gives inf or nan rather than
+an error, as in NumPy.
+"""
+
+from rpn_parse import parse, InputError
+from lexer import LexicalError
+import expr
+
+from typing import Dict, List, TextIO
+
+import argparse
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Evaluate expressions over CSV columns")
+    parser.add_argument("expressions", nargs="+", help="Expressions in RPN, as for calc.py")
+    parser.add_argument("-i", "--input", type=argparse.FileType("r"), default=sys.stdin,
+                        help="CSV file with a header line (default standard input)")
+    parser.add_argument("-o", "--output", type=argparse.FileType("w"), default=sys.stdout,
+                        help="CSV file for the results (default standard output)")
+    args = parser.parse_args()
+    return args
+
+
+def read_columns(infile: TextIO) -> List[tuple]:
+    """(name, array) for each column of a CSV file"""
+    names = [name.strip() for name in infile.readline().split(",")]
+    # NumPy warns about a file with no rows, so it is not asked to read one
+    lines = [line for line in infile if line.strip()]
+    if not lines:
+        return [(name, numpy.zeros(0)) for name in names]
+    data = numpy.loadtxt(lines, delimiter=",", ndmin=2)
+    if data.shape[1] != len(names):
+        raise InputError("Header names {} columns, but rows have {}".format(len(names), data.shape[1]))
+    return [(name, data[:, i]) for i, name in enumerate(names)]
+
+
+def evaluate(sources: List[str], columns: Dict[str, object], rows: int) -> List[tuple]:
+    """(heading, column) for each expression, in order"""
+    results = [ ]
+    for source in sources:
+        exp = parse(source)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            column = numpy.broadcast_to(exp.eval_batch(columns), (rows,))
+        heading = exp.var.name if isinstance(exp, expr.Assign) else str(exp)
+        results.append((heading, column))
+    return results
+
+
+def write_columns(outfile: TextIO, columns: List[tuple]):
+    """CSV with a header line"""
+    outfile.write(",".join(heading for heading, column in columns) + "\n")
+    if columns:
+        numpy.savetxt(outfile, numpy.column_stack([column for heading, column in columns]),
+                      delimiter=",", fmt="%.15g")
+
+
+def main():
+    args = cli()
+    if numpy is None:
+        print("batch.py requires NumPy", file=sys.stderr)
+        sys.exit(1)
+    try:
+        inputs = read_columns(args.input)
+        rows = len(inputs[0][1]) if inputs else 0
+        results = evaluate(args.expressions, dict(inputs), rows)
+    except (InputError, LexicalError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        sys.exit(1)
+    write_columns(args.output, inputs + results)
+
+
+if __name__ == "__main__":
+    main()
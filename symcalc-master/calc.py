@@ -5,6 +5,9 @@ Driver (main program) for symbolic calculator.
 from rpn_parse import parse, InputError
 from lexer import LexicalError
 import expr
+import simplify
+
+import argparse
 
 help = """Type 'quit' to quit.
 Assignment: 'var expression ='
@@ -17,8 +20,20 @@ Identifiers can be any_valid_P7thon_identifier
 """
 
 
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Symbolic calculator")
+    parser.add_argument("--simplify", action="store_true",
+                        help="Simplify symbolic results, e.g. ((x + 3) + 4) -> (x + 7)")
+    args = parser.parse_args()
+    return args
+
+
 def main():
     """Evaluate expressions typed at the command line"""
+    args = cli()
+    if args.simplify:
+        expr.env.simplifier = simplify.simplify
     while True:
         try:
             inp = input("expression/'help'/'quit': ")
@@ -31,7 +46,10 @@ def main():
             else:
                 exp = parse(inp)
                 print("{} -> ".format(exp), end="")
-                print(exp.eval())
+                val = exp.eval()
+                if args.simplify:
+                    val = simplify.simplify(val)
+                print(val)
         except InputError as e:
             print(e)
             print(help)
@@ -10,11 +10,31 @@ mapping from variable names to values. A variable may evaluate
 to its value if its name is mapped to its value in the environment.
 If its name is not mapped, a variable evaluates to itself (which
 is what we mean calling this a "symbolic" calculator.)
+
+Expression nodes are immutable and hash-consed:  constructing a
+node that is structurally equal to one that already exists returns
+the existing node, so expressions form a shared DAG rather than
+trees, and equality of two nodes is an identity check.  (Constants
+are compared by value, so Const(3) == Const(3.0), although they
+are distinct nodes.)
+
+An expression can also be evaluated over whole columns of data
+at once (eval_batch), given a mapping from variable names to
+NumPy arrays; each operation is then applied element-wise to the
+arrays in one step.  NumPy is needed only for that (see batch.py),
+and is not imported here.
+
+An expression to be evaluated many times with different numbers
+bound to its variables can be compiled to a Python function
+(compile), which is kept on the node; eval_compiled uses it when
+every variable is bound to a number.
 Author: Nicholas Fay, nfay@uoregon.edu ID:951566471
 01/30/2018
 worked with Ryan G, Remy R.
 """
+import math
 import numbers
+import weakref
 import logging
 logging.basicConfig
 log = logging.getLogger(__name__)
@@ -31,30 +51,76 @@ class Env(object):
     recursion, e.g., in case x is bound to y + 3 and y is bound
     to x + 3.  We guard against that by keeping track of the
     variables currently being evaluated.
+
+    Like a spreadsheet, the environment remembers the value of
+    each variable once it has been evaluated, and records which
+    variables each binding refers to.  Binding a variable forgets
+    the values of that variable and of the variables that depend
+    on it, directly or indirectly; all other values are kept.
     """
 
     def __init__(self):
         self.map = {}
-        self.currently_evaluating = []
+        self.currently_evaluating = set()
+        # Evaluated values by variable name
+        self.values = {}
+        # Names each binding refers to, and the reverse:
+        # names whose bindings refer to each name
+        self.depends_on = {}
+        self.dependents = {}
+        # Count of cyclic references met, so that values
+        # computed while bailing out of a cycle are not kept
+        self.cycles = 0
+        # Function applied to values before they are bound,
+        # e.g. simplify.simplify, or None
+        self.simplifier = None
 
     def eval(self, var):
         log.debug("Evaluating {} in Env".format(var))
-        if var in self.currently_evaluating:
-            log.warn("Cyclic reference to {}?  Bailing.".format(var))
+        name = var.name
+        if name in self.values:
+            return self.values[name]
+        if name in self.currently_evaluating:
+            log.warning("Cyclic reference to {}?  Bailing.".format(var))
+            self.cycles += 1
             return var
-        self.currently_evaluating.append(var)
-        if var.name in self.map:
-            val = self.map[var.name].eval()
+        self.currently_evaluating.add(name)
+        cycles = self.cycles
+        if name in self.map:
+            val = self.map[name].eval()
         else:
             val = None
-        self.currently_evaluating.pop()
+        self.currently_evaluating.remove(name)
+        if self.cycles == cycles:
+            self.values[name] = val
         log.debug("Env returning {}".format(val))
         return val
 
     def assign(self, var, value):
         assert isinstance(var, Var)
         assert isinstance(value, Expr)
-        self.map[var.name] = value
+        name = var.name
+        self.map[name] = value
+        for old in self.depends_on.get(name, ()):
+            self.dependents[old].discard(name)
+        self.depends_on[name] = var_names(value)
+        for new in self.depends_on[name]:
+            self.dependents.setdefault(new, set()).add(name)
+        self.invalidate(name)
+
+    def invalidate(self, name):
+        """Forget the values of name and of everything
+        that depends on it
+        """
+        stale = {name}
+        work = [name]
+        while work:
+            name = work.pop()
+            self.values.pop(name, None)
+            for dependent in self.dependents.get(name, ()):
+                if dependent not in stale:
+                    stale.add(dependent)
+                    work.append(dependent)
 
     def dump(self):
         """Command to see what is in the environment"""
@@ -66,14 +132,163 @@ class Env(object):
 env = Env()
 
 
-class Expr(object):
+class Interned(type):
+    """Metaclass of expression nodes.  Calling a node class
+    returns the existing node built from the same class and
+    operands, if there is one, and otherwise a new node.  The
+    table holds nodes weakly, so unused nodes are reclaimed.
+    """
+
+    _table = weakref.WeakValueDictionary()
+
+    def __call__(cls, *args):
+        # Operands that are nodes are interned, so they are
+        # identified by id (each node keeps its operands alive).
+        # The type of a value is part of the key, because 3 and
+        # 3.0 print differently.
+        key = (cls,) + tuple(id(arg) if isinstance(arg, Expr) else (type(arg), arg)
+                             for arg in args)
+        try:
+            node = Interned._table.get(key)
+        except TypeError:
+            # Unhashable operand:  let the constructor reject it
+            return super().__call__(*args)
+        if node is None:
+            node = super().__call__(*args)
+            object.__setattr__(node, "_hash", hash(key))
+            Interned._table[key] = node
+        return node
+
+
+def var_names(exp) -> set:
+    """Names of the variables an expression refers to.  Each
+    shared node is visited once.
+    """
+    names = set()
+    seen = set()
+    work = [exp]
+    while work:
+        node = work.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        if isinstance(node, Var):
+            names.add(node.name)
+        elif isinstance(node, BinOp):
+            work.append(node.left)
+            work.append(node.right)
+        elif isinstance(node, UnOp):
+            work.append(node.left)
+        elif isinstance(node, Assign):
+            work.append(node.var)
+            work.append(node.expr)
+    return names
+
+
+def compile_function(exp):
+    """A Python function computing the value of exp from the
+    values of its variables, passed in order of their names
+    (the function's 'parameters').  Each distinct node is
+    computed once, into a local variable, so shared nodes
+    are not repeated and nesting does not grow with depth.
+    """
+    parameters = tuple(sorted(var_names(exp)))
+    namespace = {}
+    lines = []
+    # Python code for the value of each node, by id, and
+    # nodes to be visited after their operands
+    code = {}
+    work = [(exp, False)]
+    while work:
+        node, operands_done = work.pop()
+        if id(node) in code:
+            continue
+        if isinstance(node, Var):
+            code[id(node)] = "v_" + node.name
+        elif isinstance(node, Const):
+            val = node.value()
+            if type(val) is int or (type(val) is float and math.isfinite(val)):
+                code[id(node)] = repr(val)
+            else:
+                # Like inf or a Fraction, with no literal form
+                name = "k{}".format(len(namespace))
+                namespace[name] = val
+                code[id(node)] = name
+        elif isinstance(node, (BinOp, UnOp)):
+            operands = [node.left, node.right] if isinstance(node, BinOp) else [node.left]
+            if operands_done:
+                temp = "t{}".format(len(lines))
+                lines.append("    {} = {}".format(
+                    temp, node._source(*[code[id(operand)] for operand in operands])))
+                code[id(node)] = temp
+            else:
+                work.append((node, True))
+                work.extend((operand, False) for operand in reversed(operands))
+        else:
+            raise TypeError("Cannot compile {}".format(node))
+    source = "def compiled({}):\n{}    return {}\n".format(
+        ", ".join("v_" + name for name in parameters),
+        "".join(line + "\n" for line in lines), code[id(exp)])
+    exec(compile(source, "<expr>", "exec"), namespace)
+    function = namespace["compiled"]
+    function.parameters = parameters
+    function.source = source
+    return function
+
+
+class Expr(object, metaclass=Interned):
     """Abstract base class. Cannot be instantiated."""
 
+    __slots__ = ("_hash", "_compiled", "__weakref__")
+
+    def __setattr__(self, name, value):
+        """Fields may be set once, in the constructor"""
+        if hasattr(self, name):
+            raise AttributeError("Expression nodes are immutable")
+        object.__setattr__(self, name, value)
+
+    def __hash__(self):
+        return self._hash
+
     def eval(self):
         """Each concrete subclass of Expr must define this method"""
         raise NotImplementedError(
             "No eval method has been defined for class {}".format(type(self)))
 
+    def eval_batch(self, columns):
+        """Each concrete subclass of Expr must define this method,
+        which evaluates the expression element-wise, with columns
+        mapping names to arrays, and returns an array (or a number,
+        if the expression has no variables).
+        """
+        raise NotImplementedError(
+            "No eval_batch method has been defined for class {}".format(type(self)))
+
+    def compile(self):
+        """A Python function computing the value of this
+        expression from numbers for its variables, given in
+        the order of the function's 'parameters' (sorted by
+        name).  It is compiled once and kept on the node.
+        """
+        if not hasattr(self, "_compiled"):
+            self._compiled = compile_function(self)
+        return self._compiled
+
+    def eval_compiled(self):
+        """Same result as eval.  If every variable is bound to
+        a number, it is computed by the compiled function;
+        otherwise the result may be symbolic, and the tree is
+        walked by eval.
+        """
+        function = self.compile()
+        args = []
+        for name in function.parameters:
+            val = env.eval(Var(name))
+            if not isinstance(val, Const):
+                return self.eval()
+            args.append(val.value())
+        return Const(function(*args))
+
 
 class Assign(Expr):
     """let x = Expr.  We treat an assignment as an expression
@@ -82,6 +297,8 @@ class Assign(Expr):
     environment.
     """
 
+    __slots__ = ("var", "expr")
+
     def __init__(self, var, expr):
         """Representation of 'let var = expr'"""
         assert isinstance(var, Var)
@@ -99,13 +316,31 @@ class Assign(Expr):
         """Stores value of expr (evaluated) in environment"""
         log.debug("Evaluating {} in Assign".format(self))
         val = self.expr.eval()
+        if env.simplifier:
+            val = env.simplifier(val)
+        env.assign(self.var, val)
+        return val
+
+    def eval_compiled(self):
+        """Assignments are not compiled, but their values can be"""
+        val = self.expr.eval_compiled()
+        if env.simplifier:
+            val = env.simplifier(val)
         env.assign(self.var, val)
         return val
 
+    def eval_batch(self, columns):
+        """Adds the column computed by expr to columns"""
+        val = self.expr.eval_batch(columns)
+        columns[self.var.name] = val
+        return val
+
 
 class Var(Expr):
     """A variable has a name and may have a value in the environment."""
 
+    __slots__ = ("name",)
+
     def __init__(self, name):
         """Expression is reference to a variable named name"""
         assert isinstance(name, str)
@@ -122,6 +357,18 @@ class Var(Expr):
             log.debug("Bound, returning {}".format(val))
             return val
 
+    def eval_batch(self, columns):
+        """The column with this name, or else the number
+        this variable is bound to in the environment
+        """
+        if self.name in columns:
+            return columns[self.name]
+        val = env.eval(self)
+        if isinstance(val, Const):
+            return val.value()
+        raise KeyError("No column for {}, which is {}".format(
+            self.name, "unbound" if val is None else "not a number"))
+
     def __repr__(self):
         return "Var('{}')".format(self.name)
 
@@ -132,6 +379,8 @@ class Var(Expr):
 class Const(Expr):
     """An expression that is just a constant value, like 5"""
 
+    __slots__ = ("val",)
+
     def __init__(self, value):
         assert isinstance(value, numbers.Number)
         self.val = value
@@ -141,6 +390,10 @@ class Const(Expr):
         log.debug("Evaluating {} in Const".format(self))
         return self
 
+    def eval_batch(self, columns):
+        """The number, which NumPy combines with every element"""
+        return self.val
+
     def value(self):
         """The internal value"""
         return self.val
@@ -154,6 +407,10 @@ class Const(Expr):
     def __eq__(self, other):
         return isinstance(other, type(self)) and self.val == other.val
 
+    def __hash__(self):
+        # Consistent with __eq__, which ignores the numeric type
+        return hash(self.val)
+
 #FIXME: You need an abstract base class BinOp.  It should provide
 # an eval(self) method that calls self._apply(lval,rval). Each
 # concrete subclass should provide its own _apply method.
@@ -167,6 +424,8 @@ class Const(Expr):
 
 class BinOp(Expr):
     """Abstract superclass for binary expressions like plus, minus, Times and Div"""
+    __slots__ = ("left", "right")
+
     #Initializes the program
     def __init__(self, left, right):
         assert isinstance(left, Expr)
@@ -190,19 +449,40 @@ class BinOp(Expr):
             return type(self)(lval, rval)
     def _apply(self, left, right):
         raise NotImplementedError("Class {} has not defined its _apply method".format(type(self)))
-    def __eq__(self, other):
-        #checks right and left points
-        return isinstance(self, type(other)) and self.left == other.left and self.right == other.right
+
+    def eval_batch(self, columns):
+        """Element-wise operation on the operand columns"""
+        return self._op(self.left.eval_batch(columns), self.right.eval_batch(columns))
+
+    def _op(self, left, right):
+        """Each concrete subclass applies its operation to
+        numbers or arrays here
+        """
+        raise NotImplementedError("Class {} has not defined its _op method".format(type(self)))
+
+    def _source(self, left, right):
+        """Each concrete subclass gives the Python code for its
+        operation on operands given as Python code
+        """
+        raise NotImplementedError("Class {} has not defined its _source method".format(type(self)))
 
 #BinOp sub-classes:::::
 class Plus(BinOp):
+    __slots__ = ()
+
     #This function deals with the functionality of addition
     #Uses the apply function to actually make calculations
     def _apply(self, left, right):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the addition function
-        return Const(left.value() + right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left + right
+
+    def _source(self, left, right):
+        return "({} + {})".format(left, right)
 
     def __repr__(self):
         #formats the objects being used in the calculation
@@ -213,13 +493,21 @@ class Plus(BinOp):
         return "({} + {})".format(self.left, self.right)
 
 class Minus(BinOp):
+    __slots__ = ()
+
     #This function deals with the functionality of subtraction
     #Uses the apply function to actually make calculations
     def _apply(self, left, right):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the subtraction function
-        return Const(left.value() - right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left - right
+
+    def _source(self, left, right):
+        return "({} - {})".format(left, right)
 
     def __repr__(self):
         #formats the objects being used in the calculation
@@ -230,13 +518,21 @@ class Minus(BinOp):
         return "({} - {})".format(self.left, self.right)
 
 class Times(BinOp):
+    __slots__ = ()
+
     #This function deals with the functionality of multiplication
     #Uses the apply function to actually make calculations
     def _apply(self, left, right):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the Multiplication function
-        return Const(left.value() * right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left * right
+
+    def _source(self, left, right):
+        return "({} * {})".format(left, right)
 
     def __repr__(self):
         #formats the objects being used in the calculation
@@ -247,13 +543,21 @@ class Times(BinOp):
         return "({} * {})".format(self.left, self.right)
 
 class Div(BinOp):
+    __slots__ = ()
+
     #This function deals the the funcionality of division
     #Uses the apply function to actually make calculations
     def _apply(self, left, right):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the Division function
-        return Const(left.value() / right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left / right
+
+    def _source(self, left, right):
+        return "({} / {})".format(left, right)
 
     def __repr__(self):
         #formats the objects being used in the calculation
@@ -270,6 +574,8 @@ class Div(BinOp):
 class UnOp(Expr):
     """Abstract superclass for unary expressions like negation"""
 
+    __slots__ = ("left",)
+
     def __init__(self, left):
         """A unary operation has only a left  sub-expression"""
         assert isinstance(left, Expr)
@@ -290,14 +596,26 @@ class UnOp(Expr):
                       .format(type(self), lval))
             return type(self)(lval)
 
+    def eval_batch(self, columns):
+        """Element-wise operation on the operand column"""
+        return self._op(self.left.eval_batch(columns))
+
 
 class Neg(UnOp):
     """Numeric negation"""
 
+    __slots__ = ()
+
     def _apply(self, left):
         """Negation of a numeric value (Const node)"""
         assert isinstance(left, Const)
-        return Const(0 - left.value())
+        return Const(self._op(left.value()))
+
+    def _op(self, val):
+        return 0 - val
+
+    def _source(self, val):
+        return "(0 - {})".format(val)
 
     def __repr__(self):
         return "Neg({})".format(repr(self.left))
@@ -30,7 +30,7 @@ class LexicalError(Exception):
 class Token(object):
     """One token from the input stream"""
 
-    def __init__(self, value: any, kind: str, clazz: Type(expr.Expr)):
+    def __init__(self, value: any, kind: str, clazz: Type[expr.Expr]):
         self.value = value
         self.kind = kind
         self.clazz = clazz
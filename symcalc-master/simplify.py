@@ -0,0 +1,180 @@
+"""
+Algebraic simplification of symbolic expressions.  An expression
+is rewritten as a sum of terms, each a numeric coefficient times a
+product of factors, so that
+- chains of + and - (and of *) are flattened, whatever their
+  grouping, e.g. ((x + 3) + 4) and (x + (3 + 4)) alike;
+- like terms are collected, e.g. (x + x) becomes (2 * x), and
+  (x * 1) + (0 * y) becomes x; terms that come to 0 are dropped
+  at once, so ((x + 1) - 1) is a single term wherever it is;
+- constants are folded wherever they appear in the tree;
+- terms, and the factors of each term, are put in one sorted
+  order, so that equal sums give identical expressions.
+
+A product of two sums is not multiplied out, since that can make
+an expression much larger; it is simplified as a single factor.
+A quotient is also a single factor unless both sides are numbers,
+because (x * (1 / 3)) need not be exactly (x / 3) in floating
+point.  Reordering sums of floating point numbers can still change
+the last digits of a result.
+
+Expressions are hash-consed (see expr.py), so the simplified form
+of each expression is remembered.
+"""
+
+import expr
+
+from typing import Dict, Tuple
+import numbers
+import weakref
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# A product of factors, in sorted order, mapped to its coefficient
+Terms = Dict[Tuple[expr.Expr, ...], object]
+
+# Simplified form of each expression simplified so far, or None
+# if it was already simplified (as a value referring to its own
+# key would keep the key alive)
+_simplified = weakref.WeakKeyDictionary()
+
+
+def simplify(exp: expr.Expr) -> expr.Expr:
+    """The simplified, canonical form of exp"""
+    if isinstance(exp, (expr.Const, expr.Var)):
+        return exp
+    if isinstance(exp, expr.Assign):
+        return expr.Assign(exp.var, simplify(exp.expr))
+    if exp not in _simplified:
+        result = build(terms(exp, {}))
+        _simplified[exp] = None if result is exp else result
+    return _simplified[exp] or exp
+
+
+def factor_key(node: expr.Expr) -> tuple:
+    """Order of factors in a product"""
+    return (not isinstance(node, expr.Var), str(node))
+
+
+def term_key(factors: tuple) -> tuple:
+    """Order of terms in a sum:  fewest factors first, with
+    the constant term last
+    """
+    return (len(factors) == 0, len(factors), [factor_key(node) for node in factors])
+
+
+def terms(exp: expr.Expr, seen: Dict[int, Terms]) -> Terms:
+    """exp as a sum of terms.  seen holds the terms of nodes
+    already visited (by id), so a node shared within the
+    expression is visited once.
+    """
+    if id(exp) in seen:
+        return seen[id(exp)]
+    if isinstance(exp, expr.Const):
+        result = constant(exp.value())
+    elif isinstance(exp, expr.Plus):
+        result = add(terms(exp.left, seen), terms(exp.right, seen))
+    elif isinstance(exp, expr.Minus):
+        result = add(terms(exp.left, seen), scale(terms(exp.right, seen), -1))
+    elif isinstance(exp, expr.Neg):
+        result = scale(terms(exp.left, seen), -1)
+    elif isinstance(exp, expr.Times):
+        left = terms(exp.left, seen)
+        right = terms(exp.right, seen)
+        if len(left) <= 1 or len(right) <= 1:
+            result = multiply(left, right)
+        else:
+            # Two sums:  kept as one factor rather than expanded
+            factors = sorted([build(left), build(right)], key=factor_key)
+            result = {(expr.Times(*factors),): 1}
+    elif isinstance(exp, expr.Div):
+        result = divide(simplify(exp.left), simplify(exp.right))
+    else:
+        result = {(exp,): 1}
+    seen[id(exp)] = result
+    return result
+
+
+def constant(value) -> Terms:
+    """A number as a sum of terms; 0 is the empty sum"""
+    return {(): value} if value != 0 else {}
+
+
+def add(left: Terms, right: Terms) -> Terms:
+    """Sum of two sums.  Terms that cancel are dropped, so
+    that a sum that comes to one term counts as one.
+    """
+    result = dict(left)
+    for factors, coefficient in right.items():
+        if factors in result:
+            coefficient = result[factors] + coefficient
+        if coefficient == 0:
+            result.pop(factors, None)
+        else:
+            result[factors] = coefficient
+    return result
+
+
+def scale(sum_terms: Terms, k) -> Terms:
+    return {factors: k * coefficient for factors, coefficient in sum_terms.items()}
+
+
+def multiply(left: Terms, right: Terms) -> Terms:
+    """Product of two sums, at least one with at most one term"""
+    result = {}
+    for left_factors, left_coefficient in left.items():
+        for right_factors, right_coefficient in right.items():
+            factors = tuple(sorted(left_factors + right_factors, key=factor_key))
+            result = add(result, {factors: left_coefficient * right_coefficient})
+    return result
+
+
+def divide(num: expr.Expr, den: expr.Expr) -> Terms:
+    """Quotient of simplified expressions"""
+    if isinstance(num, expr.Const) and isinstance(den, expr.Const):
+        try:
+            return constant(num.value() / den.value())
+        except ZeroDivisionError:
+            # Left for eval to report
+            pass
+    return {(expr.Div(num, den),): 1}
+
+
+def build(sum_terms: Terms) -> expr.Expr:
+    """The expression for a sum of terms, in canonical order.
+    Terms with coefficient 0 are dropped, and a term with a
+    negative coefficient is subtracted.
+    """
+    result = None
+    for factors in sorted(sum_terms, key=term_key):
+        coefficient = sum_terms[factors]
+        if coefficient == 0:
+            continue
+        negative = isinstance(coefficient, numbers.Real) and coefficient < 0
+        term = product(factors, -coefficient if negative and result is not None else coefficient)
+        if result is None:
+            result = term
+        elif negative:
+            result = expr.Minus(result, term)
+        else:
+            result = expr.Plus(result, term)
+    if result is None:
+        return expr.Const(0)
+    return result
+
+
+def product(factors: tuple, coefficient) -> expr.Expr:
+    """coefficient times the factors"""
+    if not factors:
+        return expr.Const(coefficient)
+    node = factors[0]
+    for factor in factors[1:]:
+        node = expr.Times(node, factor)
+    if coefficient == 1:
+        return node
+    if coefficient == -1:
+        return expr.Neg(node)
+    return expr.Times(expr.Const(coefficient), node)
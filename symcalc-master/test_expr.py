@@ -7,8 +7,14 @@ Tests for expr.py,
 import unittest
 import expr
 from rpn_parse import parse
+from simplify import simplify
 import logging
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class TestExpr(unittest.TestCase):
 
@@ -88,6 +94,152 @@ class TestExpr(unittest.TestCase):
         self.assertEqual(expr.Plus(x, expr.Const(4)).eval(),
                          expr.Const(19))
 
+    def test_interned(self):
+        """Equal expressions are the same node"""
+        x = expr.Var('x')
+        self.assertIs(expr.Var('x'), x)
+        self.assertIs(expr.Plus(x, expr.Const(3)), expr.Plus(expr.Var('x'), expr.Const(3)))
+        self.assertIsNot(expr.Plus(x, expr.Const(3)), expr.Plus(x, expr.Const(3.0)))
+        self.assertEqual(str(expr.Plus(x, expr.Const(3.0))), "(x + 3.0)")
+        self.assertEqual(hash(expr.Neg(x)), hash(expr.Neg(expr.Var('x'))))
+        self.assertEqual(expr.Const(3), expr.Const(3.0))
+        self.assertIs(expr.Plus(expr.Var('unbound'), expr.Const(1)).eval(),
+                      expr.Plus(expr.Var('unbound'), expr.Const(1)))
+
+    def test_immutable(self):
+        node = expr.Times(expr.Var('x'), expr.Const(2))
+        with self.assertRaises(AttributeError):
+            node.left = expr.Const(1)
+        with self.assertRaises(AttributeError):
+            node.extra = 1
+
+    def test_dependent_chain(self):
+        """Each variable in a chain is evaluated once, and
+        rebinding one forgets only the values that use it
+        """
+        n = 60
+        for i in range(n, 0, -1):
+            prev = expr.Var('chain{}'.format(i - 1))
+            expr.Assign(expr.Var('chain{}'.format(i)), expr.Plus(prev, prev)).eval()
+        expr.Assign(expr.Var('chain0'), expr.Const(1)).eval()
+        self.assertEqual(expr.Var('chain{}'.format(n)).eval(), expr.Const(2 ** n))
+        self.assertIn('chain1', expr.env.values)
+        expr.Assign(expr.Var('chain30'), expr.Const(1)).eval()
+        self.assertNotIn('chain31', expr.env.values)
+        self.assertIn('chain29', expr.env.values)
+        self.assertEqual(expr.Var('chain{}'.format(n)).eval(), expr.Const(2 ** (n - 30)))
+
+    def test_cycle(self):
+        a = expr.Var('cyc_a')
+        b = expr.Var('cyc_b')
+        expr.Assign(a, expr.Plus(b, expr.Const(1))).eval()
+        expr.Assign(b, expr.Plus(a, expr.Const(1))).eval()
+        self.assertEqual(str(a.eval()), "(((cyc_b + 1) + 1) + 1)")
+        self.assertNotIn('cyc_a', expr.env.values)
+        expr.Assign(b, expr.Const(2)).eval()
+        self.assertEqual(a.eval(), expr.Const(3))
+
+    @unittest.skipIf(numpy is None, "NumPy not installed")
+    def test_eval_batch(self):
+        """Element-wise, giving the same values as eval, with
+        bound variables that are not columns as constants
+        """
+        expr.Assign(expr.Var('batch_k'), expr.Const(10)).eval()
+        columns = {'batch_x': numpy.array([1, 2, 3]), 'batch_y': numpy.array([4.0, 5.0, 8.0])}
+        exp = parse("batch_z batch_x batch_k * batch_y ~ - batch_y / =")
+        result = exp.eval_batch(columns)
+        self.assertIs(columns['batch_z'], result)
+        for i in range(3):
+            expr.Assign(expr.Var('batch_x'), expr.Const(int(columns['batch_x'][i]))).eval()
+            expr.Assign(expr.Var('batch_y'), expr.Const(float(columns['batch_y'][i]))).eval()
+            self.assertEqual(exp.expr.eval(), expr.Const(result[i]))
+        with self.assertRaises(KeyError):
+            parse("batch_unbound batch_x +").eval_batch(columns)
+
+    def test_compile(self):
+        """Compiled functions compute what eval computes, and
+        shared nodes are computed once
+        """
+        exp = parse("cx 3 + cy * cx ~ - cx cy / +")
+        function = exp.compile()
+        self.assertIs(exp.compile(), function)
+        self.assertEqual(function.parameters, ('cx', 'cy'))
+        self.assertEqual(exp.eval_compiled(), exp.eval())
+        for x, y in [(2, 5), (1.5, -4), (0, 3)]:
+            expr.Assign(expr.Var('cx'), expr.Const(x)).eval()
+            expr.Assign(expr.Var('cy'), expr.Const(y)).eval()
+            self.assertEqual(function(x, y), exp.eval().value())
+            self.assertEqual(exp.eval_compiled(), exp.eval())
+        shared = expr.Var('cx')
+        for i in range(200):
+            shared = expr.Plus(shared, shared)
+        self.assertEqual(shared.compile()(1), 2 ** 200)
+        self.assertEqual(expr.Times(expr.Const(float('inf')), expr.Const(-1)).compile()(),
+                         float('-inf'))
+        with self.assertRaises(TypeError):
+            parse("cz 1 =").compile()
+
+    def test_simplify(self):
+        """Sums are flattened, constants folded, like terms
+        collected, and terms put in one order
+        """
+        self.assertEqual(str(simplify(parse("sx 3 + 4 +"))), "(sx + 7)")
+        self.assertEqual(str(simplify(parse("sx 1 * 0 sy * +"))), "sx")
+        self.assertEqual(str(simplify(parse("sx sx +"))), "(2 * sx)")
+        self.assertEqual(str(simplify(parse("sy sx * sx sy * -"))), "0")
+        self.assertEqual(str(simplify(parse("5 sx - ~"))), "(sx - 5)")
+        self.assertIs(simplify(parse("sx 3 + sy +")), simplify(parse("3 sy sx + +")))
+        self.assertIs(simplify(simplify(parse("sx 3 + sy *"))), simplify(parse("sx 3 + sy *")))
+        # Not expanded, and not turned into multiplication
+        self.assertEqual(str(simplify(parse("sx sy + sx sy - *"))), "((sx + sy) * (sx - sy))")
+        self.assertEqual(str(simplify(parse("sx 3 / sx 3 / +"))), "(2 * (sx / 3))")
+        for x, y in [(2, 5), (-1, 0.5)]:
+            for src in ["sx 3 + 4 + sy 2 * sx - *", "sx sy - sy + sx ~ sy * -"]:
+                exp = parse(src)
+                bound = {expr.Var('sx'): expr.Const(x), expr.Var('sy'): expr.Const(y)}
+                self.assertEqual(substitute(simplify(exp), bound), substitute(exp, bound))
+
+    def test_simplify_canonical(self):
+        """Terms that cancel do not keep a product from being
+        multiplied out, simplifying again changes nothing, and
+        the value is the same
+        """
+        self.assertIs(simplify(parse("sx 1 + sy 1 + 1 - *")), simplify(parse("sx 1 + sy *")))
+        self.assertEqual(str(simplify(parse("sy 0 sx / - 0 *"))), "0")
+        self.assertEqual(str(simplify(parse("sx 3 + sx - sx sy - 2 2 * - *"))), "(((3 * sx) - (3 * sy)) - 12)")
+        for src in ["sx sx + 0 sx + + 0.5 sy ~ - * sx sx 0.5 0.5 * * + /",
+                    "sx 0 * 2 0 * - ~ 0.5 0.5 + ~ sy 0.5 sx / * - *",
+                    "sy 1 / sx ~ / 3.0 1 / ~ * sx 3.0 + sx - sy sy - 2 2 * - * -",
+                    "3 ~ 3.0 * sx sy - *"]:
+            exp = parse(src)
+            self.assertIs(simplify(simplify(exp)), simplify(exp))
+            for x, y in [(2, 5), (-1, 0.5)]:
+                bound = {expr.Var('sx'): expr.Const(x), expr.Var('sy'): expr.Const(y)}
+                self.assertAlmostEqual(substitute(simplify(exp), bound).value(),
+                                       substitute(exp, bound).value())
+
+    def test_simplifier(self):
+        """The environment can simplify values as they are bound"""
+        expr.env.simplifier = simplify
+        try:
+            expr.Assign(expr.Var('simple'), parse("sv 1 + 1 +")).eval()
+        finally:
+            expr.env.simplifier = None
+        self.assertEqual(str(expr.Var('simple').eval()), "(sv + 2)")
+
+
+def substitute(exp: expr.Expr, bound: dict) -> expr.Expr:
+    """Value of exp with the bound variables replaced, not
+    using the global environment
+    """
+    if exp in bound:
+        return bound[exp]
+    if isinstance(exp, expr.Const) or isinstance(exp, expr.Var):
+        return exp
+    if isinstance(exp, expr.Neg):
+        return expr.Neg(substitute(exp.left, bound)).eval()
+    return type(exp)(substitute(exp.left, bound), substitute(exp.right, bound)).eval()
+
 
 if __name__ == '__main__':
     unittest.main()
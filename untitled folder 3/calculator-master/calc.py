@@ -1,12 +1,42 @@
 """
 Driver (main program) for symbolic calculator.
+
+With no arguments, evaluates expressions typed at the
+command line.  Given files of expressions (or '-' for
+standard input), evaluates them in batch:  one expression
+per line, with the value of each written on its own line
+of output, and no prompts or help.  Errors are reported on
+standard error, with the file name and line number, and do
+not stop the evaluation.  Each file is evaluated in its own
+environment, so files are independent, and with --jobs they
+are evaluated in parallel; the output is still in order.
+
+Expressions are in RPN, or with --infix in ordinary infix
+notation (see infix_parse.py).  With --exact, arithmetic is
+exact:  decimals are fractions and division does not round.
+
+With --workspace FILE, variables are kept in FILE (see
+PersistentEnv in calc_state.py), for interactive use or for
+all the files of a batch, and are there when FILE is used
+again.  Interactively, 'compact' rewrites the file with just
+the current variables, and 'snapshot PATH' copies them to a
+new workspace file.
 """
 
 from rpn_parse import parse, InputError
 from lexer import LexicalError
+import infix_parse
 import expr
 import calc_state
 
+from typing import Callable, Iterable, List, TextIO, Tuple
+
+import argparse
+import functools
+import io
+import multiprocessing
+import sys
+
 HELP_MSG = """Type 'quit' to quit.
 Assignment: 'expression var ='
 Form expressions with +, -, *, /, ~ (negation)
@@ -17,10 +47,133 @@ for y_not gets z + 3:
 Identifiers can be any_valid_P7thon_identifier
 """
 
+INFIX_HELP_MSG = """Type 'quit' to quit.
+Assignment: 'var = expression'
+Form expressions with +, -, *, /, ~ or - (negation),
+and parentheses, e.g., for y_not gets z + 3:
+  y_not = z + 3
+Identifiers can be any_valid_P7thon_identifier
+"""
+
+# Errors in one expression, reported without stopping a batch
+EXPR_ERRORS = (InputError, LexicalError, NotImplementedError, ZeroDivisionError)
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Calculator for expressions in RPN")
+    parser.add_argument("files", nargs="*",
+                        help="Files of expressions to evaluate in batch ('-' for standard input)")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="Number of worker processes for files (0 to evaluate in this process)")
+    parser.add_argument("--infix", action="store_true",
+                        help="Expressions are in infix notation, e.g. 'x = (y + 3) * 2'")
+    parser.add_argument("--exact", action="store_true",
+                        help="Exact arithmetic with fractions, e.g. 1 3 / is 1/3, 0.1 is 1/10")
+    parser.add_argument("-w", "--workspace",
+                        help="File to keep variables in, to be used again later")
+    args = parser.parse_args()
+    if args.jobs and "-" in args.files:
+        parser.error("Standard input cannot be evaluated with --jobs")
+    if args.jobs and args.workspace:
+        parser.error("Files share a workspace, so cannot be evaluated with --jobs")
+    return args
+
+
+def run_stream(lines: Iterable[str], env: calc_state.Env, out: TextIO,
+               name: str = "<stdin>", parse: Callable[[str], expr.Expr] = parse) -> List[str]:
+    """Evaluate each non-blank line as an expression in env,
+    writing its value to out.  Returns the error messages.
+    """
+    errors = [ ]
+    write = out.write
+    lines = enumerate(lines, 1)
+    while True:
+        # The handler is set up again only after an error,
+        # not for each line
+        try:
+            for lineno, line in lines:
+                if line and not line.isspace():
+                    write("{}\n".format(parse(line).eval(env)))
+            return errors
+        except EXPR_ERRORS as e:
+            errors.append("{}:{}: {}".format(name, lineno, e))
+
+
+def parser_for(infix: bool, exact: bool = False) -> Callable[[str], expr.Expr]:
+    read = infix_parse.parse if infix else parse
+    if exact:
+        return functools.partial(read, exact=True)
+    return read
+
+
+def run_file(name: str, infix: bool = False, exact: bool = False) -> Tuple[str, List[str]]:
+    """Output and error messages for one file of expressions,
+    evaluated in a new environment
+    """
+    env = calc_state.Env(expr.Const, expr.Const(0))
+    out = io.StringIO()
+    with open(name) as lines:
+        errors = run_stream(lines, env, out, name, parser_for(infix, exact))
+    return out.getvalue(), errors
+
+
+def run_batch(names: List[str], jobs: int = 0, infix: bool = False, exact: bool = False,
+              env: calc_state.Env = None) -> int:
+    """Evaluate files, writing output in order, each in a new
+    environment unless env is given.  Returns the number of errors.
+    """
+    errors = 0
+    if jobs:
+        with multiprocessing.Pool(jobs) as pool:
+            for output, messages in pool.imap(functools.partial(run_file, infix=infix, exact=exact), names):
+                sys.stdout.write(output)
+                for message in messages:
+                    print(message, file=sys.stderr)
+                errors += len(messages)
+        return errors
+    shared = env
+    for name in names:
+        env = shared or calc_state.Env(expr.Const, expr.Const(0))
+        if name == "-":
+            messages = run_stream(sys.stdin, env, sys.stdout, parse=parser_for(infix, exact))
+        else:
+            with open(name) as lines:
+                messages = run_stream(lines, env, sys.stdout, name, parser_for(infix, exact))
+        for message in messages:
+            print(message, file=sys.stderr)
+        errors += len(messages)
+    return errors
+
 
 def main():
+    """Evaluate expressions typed at the command line,
+    or in files
+    """
+    args = cli()
+    if args.workspace:
+        env = calc_state.PersistentEnv(args.workspace, expr.Const, expr.Const(0))
+    else:
+        env = calc_state.Env(expr.Const, expr.Const(0))
+    try:
+        if args.files:
+            errors = run_batch(args.files, args.jobs, args.infix, args.exact,
+                               env if args.workspace else None)
+            sys.exit(1 if errors else 0)
+        interact(env, args.infix, args.exact)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.workspace:
+            env.close()
+
+
+def interact(env: calc_state.Env, infix: bool = False, exact: bool = False):
     """Evaluate expressions typed at the command line"""
-    env = calc_state.Env(expr.Const, expr.Const(0))
+    read = parser_for(infix, exact)
+    help_msg = INFIX_HELP_MSG if infix else HELP_MSG
+    persistent = isinstance(env, calc_state.PersistentEnv)
     while True:
         try:
             inp = input("expression/'help'/'quit': ")
@@ -30,18 +183,22 @@ def main():
                 print(str(env))
             elif inp == "clear":
                 env.clear()
+            elif persistent and inp == "compact":
+                env.compact()
+            elif persistent and inp.startswith("snapshot "):
+                env.snapshot(inp[len("snapshot "):].strip())
             elif inp in ["help", "?", "Help"]:
-                print(HELP_MSG)
+                print(help_msg)
             else:
-                exp = parse(inp)
+                exp = read(inp)
                 print("({}) -> ".format(exp), end='')
                 print(exp.eval(env))
         except InputError as e:
             print(e)
-            print(HELP_MSG)
+            print(help_msg)
         except LexicalError as e:
             print(e)
-            print(HELP_MSG)
+            print(help_msg)
         except NotImplementedError as e:
             print(e)
 
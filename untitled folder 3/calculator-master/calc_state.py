@@ -9,9 +9,18 @@ value type, and checking that only that value type is
 stored. This way expr.py depends on calc_state.py, but 
 not vice versa.  
 
+A PersistentEnv also keeps its bindings in a file, so that
+a workspace can be reopened later without re-evaluating
+the expressions that built it.
+
 """
 
-from typing import TypeVar, Generic, Type
+from typing import TypeVar, Generic, Type, Dict, Optional, Tuple
+
+import mmap
+import os
+import pickle
+import struct
 
 import logging
 logging.basicConfig()
@@ -61,3 +70,159 @@ class Env(Generic[Value]):
         if name in self._map:
             return self._map[name]
         return self.default_value
+
+
+class PersistentEnv(Env[Value]):
+    """An Env whose bindings are kept in a file, which is an
+    append-only log:  each put adds a record with the name and
+    the pickled value, and clear adds a record that forgets the
+    records before it.  Values must be picklable.
+
+    Opening the environment does not read the file.  On first
+    use the file is memory-mapped and only the record headers
+    are read, to find the latest record for each name; a value
+    is unpickled when its name is first looked up.  A record
+    cut short (e.g. by a crash while writing) is dropped.
+
+    The log grows with every put; compact() rewrites it with
+    just the current bindings, and snapshot(path) writes such
+    a copy elsewhere, which can be opened as a PersistentEnv.
+    """
+
+    # Record header:  kind, length of name, length of pickled value
+    HEADER = struct.Struct("<cII")
+    PUT = b"P"
+    CLEAR = b"C"
+
+    def __init__(self, path: str, value_type: Type, default_value: Value):
+        super().__init__(value_type, default_value)
+        self.path = path
+        # Name -> (start, end) of its pickled value in the file,
+        # for values not yet in _map;  None until the file is read
+        self._index: Optional[Dict[str, Tuple[int, int]]] = None
+        self._mmap = None
+        self._log = None
+
+    def __repr__(self) -> str:
+        self._load_all()
+        return super().__repr__()
+
+    def _open(self):
+        """Index the file and open it for appending, on first use"""
+        if self._index is not None:
+            return
+        self._index = {}
+        end = 0
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            end = self._scan()
+        self._log = open(self.path, "ab")
+        if self._log.tell() > end:
+            log.warning("Dropping incomplete record at end of {}".format(self.path))
+            self._log.truncate(end)
+
+    def _scan(self) -> int:
+        """Index the records in the file, returning the
+        position after the last complete one
+        """
+        data = self._mmap
+        size = len(data)
+        header = self.HEADER.size
+        pos = 0
+        while pos + header <= size:
+            kind, name_len, value_len = self.HEADER.unpack_from(data, pos)
+            start = pos + header + name_len
+            end = start + value_len
+            if end > size or kind not in (self.PUT, self.CLEAR):
+                break
+            if kind == self.CLEAR:
+                self._index.clear()
+            else:
+                self._index[data[pos + header:start].decode("utf-8")] = (start, end)
+            pos = end
+        return pos
+
+    def _load_all(self):
+        """Unpickle every value not already in _map"""
+        self._open()
+        for name in list(self._index):
+            self.get(name)
+
+    def _write(self, kind: bytes, name: str = "", data: bytes = b""):
+        name_bytes = name.encode("utf-8")
+        self._log.write(self.HEADER.pack(kind, len(name_bytes), len(data)) + name_bytes + data)
+        self._log.flush()
+
+    def clear(self):
+        """Forget all bindings, in the file too"""
+        self._open()
+        super().clear()
+        self._index = {}
+        self._write(self.CLEAR)
+
+    def put(self, name: str, val: Value):
+        """Bind name to val, and record it in the file"""
+        self._open()
+        super().put(name, val)
+        self._index.pop(name, None)
+        self._write(self.PUT, name, pickle.dumps(val, pickle.HIGHEST_PROTOCOL))
+
+    def get(self, name: str) -> Value:
+        """Current value of name, unpickled from the file
+        the first time it is looked up
+        """
+        if name in self._map:
+            return self._map[name]
+        self._open()
+        if name in self._index:
+            start, end = self._index.pop(name)
+            self._map[name] = pickle.loads(self._mmap[start:end])
+            return self._map[name]
+        return self.default_value
+
+    def snapshot(self, path: str):
+        """Write the current bindings to a new log file at path"""
+        if os.path.abspath(path) == os.path.abspath(self.path):
+            self.compact()
+            return
+        self._load_all()
+        self._save(path)
+
+    def compact(self):
+        """Rewrite the file with just the current bindings"""
+        self._load_all()
+        self.close()
+        self._save(self.path)
+
+    def _save(self, path: str):
+        """Write _map as a log file at path, replacing any
+        file there only once it is complete
+        """
+        temp = path + ".tmp"
+        with open(temp, "wb") as f:
+            for name, val in self._map.items():
+                name_bytes = name.encode("utf-8")
+                data = pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+                f.write(self.HEADER.pack(self.PUT, len(name_bytes), len(data)) + name_bytes + data)
+        os.replace(temp, path)
+
+    def close(self):
+        """Close the file;  it is opened again if the
+        environment is used again
+        """
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        # Values in _map are the latest in the file, so the
+        # file can be indexed again as if newly opened
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -7,6 +7,12 @@ Expressions.  An expression is a subtree, which may be
 Expressions are interpreted in an environment, which is a
 mapping from variable names to values. A variable may evaluate
 to its value if its name is mapped to its value in the environment.
+
+An expression can also be evaluated over whole columns of data
+at once (eval_batch), in an environment that maps variable names
+to NumPy arrays; each operation is then applied element-wise to
+the arrays in one step.  NumPy is needed only for that (see
+batch.py), and is not imported here.
 Nicholas Fay 951566471
 """
 
@@ -17,6 +23,9 @@ from calc_state import Env
 # common superclass of int and float
 from numbers import Real
 
+# Exact quotients, for ExactDiv
+from fractions import Fraction
+
 # Debugging aids 
 import logging
 logging.basicConfig()
@@ -36,6 +45,15 @@ class Expr(object):
         raise NotImplementedError(
             "No eval method has been defined for class {}".format(type(self)))
 
+    def eval_batch(self, env: Env):
+        """Each concrete subclass of Expr must define this method,
+        which evaluates the expression element-wise, in an
+        environment mapping names to arrays, and returns an array
+        (or a number, if the expression has no variables).
+        """
+        raise NotImplementedError(
+            "No eval_batch method has been defined for class {}".format(type(self)))
+
 
 class Var(Expr):
     """A variable has a name and may have a value in the environment."""
@@ -51,6 +69,10 @@ class Var(Expr):
         val = env.get(self.name)
         return val
 
+    def eval_batch(self, env: Env):
+        """The column bound to this name"""
+        return env.get(self.name)
+
     def __repr__(self):
         return "Var('{}')".format(self.name)
 
@@ -70,6 +92,10 @@ class Const(Expr):
         log.debug("Evaluating {} in Const".format(self))
         return self
 
+    def eval_batch(self, env: Env) -> Real:
+        """The number, which NumPy combines with every element"""
+        return self.val
+
     def value(self):
         """The internal value"""
         return self.val
@@ -114,6 +140,12 @@ class Assign(Expr):
         env.put(self.var.name, val)
         return val
 
+    def eval_batch(self, env: Env):
+        """Binds the variable to the column computed by expr"""
+        val = self.expr.eval_batch(env)
+        env.put(self.var.name, val)
+        return val
+
 
 class UnOp(Expr):
     """Abstract superclass for unary expressions like negation"""
@@ -137,6 +169,10 @@ class UnOp(Expr):
         lval_n = lval.value()
         return Const(self._apply(lval_n))
 
+    def eval_batch(self, env: Env):
+        """_apply works on arrays as well as numbers"""
+        return self._apply(self.left.eval_batch(env))
+
     def _apply(self, val: Real) -> Real:
         raise NotImplementedError("Class {} has not implemented _apply".format(
             type(self).__name__))
@@ -191,6 +227,14 @@ class BinOp(Expr):
         #_apply method must be implimented in all Binop subclasses, but nowhere else hence the underscore before the variable name.
         raise NotImplementedError("Class {} has not defined its _apply method".format(type(self)))
 
+    def eval_batch(self, env: Env):
+        """Element-wise operation on the operand columns"""
+        return self._op(self.left.eval_batch(env), self.right.eval_batch(env))
+
+    def _op(self, left, right):
+        #_op applies the operation to numbers or to arrays; each concrete subclass defines it
+        raise NotImplementedError("Class {} has not defined its _op method".format(type(self)))
+
     def __eq__(self, other):
         #checks if right and left points are equal to others left and right points. determines if self is the same type as other
         return isinstance(self, type(other)) and self.left == other.left and self.right == other.right
@@ -207,7 +251,10 @@ class Plus(BinOp):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the addition function
-        return Const(left.value() + right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left + right
 
     def __repr__(self):
         #magic method repr
@@ -229,7 +276,10 @@ class Minus(BinOp):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the subtraction function
-        return Const(left.value() - right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left - right
 
     def __repr__(self):
         #magic method repr
@@ -251,7 +301,10 @@ class Times(BinOp):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the Multiplication function
-        return Const(left.value() * right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left * right
 
     def __repr__(self):
         #magic method repr
@@ -274,7 +327,10 @@ class Div(BinOp):
         assert isinstance(left, Const)
         assert isinstance(right, Const)
         #This is where the calculation actually happens for the Division function
-        return Const(left.value() / right.value())
+        return Const(self._op(left.value(), right.value()))
+
+    def _op(self, left, right):
+        return left / right
 
     def __repr__(self):
         #magic method repr
@@ -286,3 +342,22 @@ class Div(BinOp):
         #Handles the given string to deal with the function as an Integer
         return "({} / {})".format(self.left, self.right)
 
+
+class ExactDiv(Div):
+    """Division without rounding, used by the parsers in exact
+    mode.  The quotient of two ints is an int if it is whole and
+    a Fraction otherwise, and a whole Fraction is returned as an
+    int, so integer work stays in fast int arithmetic.
+    """
+
+    def _op(self, left, right):
+        if type(left) is int and type(right) is int:
+            quotient, remainder = divmod(left, right)
+            if remainder == 0:
+                return quotient
+            return Fraction(left, right)
+        quotient = left / right
+        if isinstance(quotient, Fraction) and quotient.denominator == 1:
+            return quotient.numerator
+        return quotient
+
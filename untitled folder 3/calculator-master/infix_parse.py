@@ -0,0 +1,153 @@
+"""
+Infix parser for the calculator, for ordinary formulas
+like 'x = (y + 3) * -z'.  Produces the same Expr objects
+as rpn_parse.  Spaces between tokens are optional.
+
+The input is tokenized in a single scan with one regular
+expression (see the developer notes in lexer.py), and
+parsed by precedence climbing (a Pratt parser):  each
+operator has a binding power, and an operand is claimed
+by the operator on the side that binds more tightly.
+Operators are bound to classes in syntax.py.  The exact
+mode is as in rpn_parse.
+"""
+
+from typing import List, Tuple
+import re
+import expr
+import syntax
+from rpn_parse import InputError, exact_number
+from lexer import LexicalError
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Binding powers of infix operators.  Assignment binds
+# loosest and groups to the right (x = y = 3); the others
+# group to the left (x - y - z is (x - y) - z).
+INFIX = {
+    "=": 1,
+    "+": 10, "-": 10,
+    "*": 20, "/": 20,
+}
+RIGHT_ASSOC = {"="}
+
+# Prefix operators and their classes; both '~' (as in RPN)
+# and '-' negate.  Negation binds tighter than any infix
+# operator, so -x * y is (-x) * y.
+PREFIX = {"~": expr.Neg, "-": expr.Neg}
+PREFIX_POWER = 30
+
+# Token kinds
+NUM, IDENT, OP, END = "NUM", "IDENT", "OP", "END"
+
+TOKEN = re.compile(r"""
+    \s*(?:
+        ([0-9]*\.[0-9]+|[0-9]+)      # 1: number
+      | ([^\W\d]\w*)                 # 2: identifier
+      | ({})                         # 3: operator or parenthesis
+      | (\S)                         # 4: anything else
+    )""".format("|".join(re.escape(sym) for sym in
+                         sorted(set(syntax.OPS) | {"(", ")"}, key=len, reverse=True))),
+    re.VERBOSE)
+
+# (kind, text, position in the input)
+Token = Tuple[str, str, int]
+
+
+def tokenize(s: str) -> List[Token]:
+    """All the tokens of s, ending with an END token"""
+    tokens = [ ]
+    pos = 0
+    end = len(s.rstrip())
+    while pos < end:
+        match = TOKEN.match(s, pos)
+        group = match.lastindex
+        if group == 4:
+            raise LexicalError("Unrecognized token '{}' at position {}".format(
+                match.group(4), match.start(4)))
+        tokens.append(((NUM, IDENT, OP)[group - 1], match.group(group), match.start(group)))
+        pos = match.end()
+    tokens.append((END, "end of input", len(s)))
+    return tokens
+
+
+class Parser(object):
+    """Parses one list of tokens"""
+
+    def __init__(self, tokens: List[Token], exact: bool = False):
+        self.tokens = tokens
+        self.pos = 0
+        self.exact = exact
+
+    def take(self) -> Token:
+        """Consume next token"""
+        token = self.tokens[self.pos]
+        if token[0] != END:
+            self.pos += 1
+        return token
+
+    def expect(self, text: str):
+        kind, found, pos = self.take()
+        if found != text or kind != OP:
+            raise InputError("Expecting '{}' at position {}, found {}".format(text, pos, found))
+
+    def expression(self, power: int = 0) -> expr.Expr:
+        """The longest expression starting here whose operators
+        bind more tightly than power
+        """
+        left = self.operand()
+        while True:
+            kind, text, pos = self.tokens[self.pos]
+            if kind != OP or text not in INFIX or INFIX[text] <= power:
+                return left
+            self.pos += 1
+            op_power = INFIX[text]
+            right = self.expression(op_power - 1 if text in RIGHT_ASSOC else op_power)
+            category, clazz = syntax.OPS[text]
+            if clazz is expr.Div and self.exact:
+                clazz = expr.ExactDiv
+            if category == syntax.ASSIGN:
+                if not isinstance(left, expr.Var):
+                    raise InputError("Left side of assignment at position {} must be"
+                                     " a variable, not {}".format(pos, left))
+                left = clazz(right, left)
+            else:
+                left = clazz(left, right)
+
+    def operand(self) -> expr.Expr:
+        """A number, variable, parenthesized expression,
+        or negated operand
+        """
+        kind, text, pos = self.take()
+        if kind == NUM:
+            if "." not in text:
+                return expr.Const(int(text))
+            return expr.Const(exact_number(text) if self.exact else float(text))
+        if kind == IDENT:
+            return expr.Var(text)
+        if kind == OP and text == "(":
+            inner = self.expression()
+            self.expect(")")
+            return inner
+        if kind == OP and text in PREFIX:
+            return PREFIX[text](self.expression(PREFIX_POWER))
+        raise InputError("Expecting an operand at position {}, found {}".format(pos, text))
+
+
+def parse(s: str, exact: bool = False) -> expr.Expr:
+    """Parse s, an expression in infix notation, into an
+    Expr object.   Example: parse('3*4 + x') =>
+    Plus(Times(Const(3), Const(4)), Var('x'))
+    """
+    tokens = tokenize(s)
+    if len(tokens) == 1:
+        raise InputError("Empty expression")
+    parser = Parser(tokens, exact)
+    exp = parser.expression()
+    kind, text, pos = parser.take()
+    if kind != END:
+        raise InputError("Unexpected {} at position {}".format(text, pos))
+    return exp
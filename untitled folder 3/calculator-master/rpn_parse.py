@@ -3,9 +3,21 @@ Postfix, a.k.a. Reverse Polish Notation (RPN) parser
 for a symbolic calculator.  Produces 
 Expr objects. 
 
+Accepts the tokens described in lexer.py, but finds them
+in a single scan with one regular expression and builds
+the tree as it goes, rather than making a Token for each.
+
+In exact mode, decimal numbers are read as exact fractions
+(0.1 is 1/10) and division does not round (see ExactDiv in
+expr.py), so results are ints or Fractions rather than floats.
+
 Author: Initial version by M Young
 """
 from typing import List
+from fractions import Fraction
+from numbers import Real
+import functools
+import re
 import expr
 import syntax
 import lexer
@@ -20,49 +32,92 @@ class InputError(Exception):
     pass
 
 
-def parse(s: str) -> expr.Expr:
+# One token, which must be delimited by spaces (as in lexer.py).
+# Every word starts a match, since the last group matches anything
+# else, so a single scan finds every token.
+TOKEN = re.compile(r"""
+    ([0-9]+)(?!\S)                  # 1: integer
+  | ([^\W\d]\w*)(?!\S)             # 2: identifier
+  | ({})(?!\S)                      # 3: operator
+  | ([0-9]*\.[0-9]+)(?!\S)          # 4: float
+  | (\S+)                           # 5: unrecognized
+""".format("|".join(re.escape(sym) for sym in sorted(syntax.OPS, key=len, reverse=True))),
+    re.VERBOSE)
+INT, IDENT, OP, FLOAT = 1, 2, 3, 4
+
+# Operator symbol -> (number of operands, class), with
+# assignment marked by 0 since it takes two
+ARITY = {syntax.BINOP: 2, syntax.UNOP: 1, syntax.ASSIGN: 0}
+OPS = {sym: (ARITY[kind], clazz) for sym, (kind, clazz) in syntax.OPS.items()}
+EXACT_OPS = {sym: (arity, expr.ExactDiv if clazz is expr.Div else clazz)
+             for sym, (arity, clazz) in OPS.items()}
+
+
+@functools.lru_cache(maxsize=1024)
+def exact_number(word: str) -> Real:
+    """The exact value of a decimal number, as an int
+    if it is whole and otherwise a Fraction
+    """
+    value = Fraction(word)
+    if value.denominator == 1:
+        return value.numerator
+    return value
+
+
+def parse(s: str, exact: bool = False) -> expr.Expr:
     """Parse s, which should be a sequence of 
     blank-separated tokens in RPN, into an Expr
     object.   Example: parse('3 4 * x +') => 
     Plus(Times(Const(3), Const(4)), Var('x'))
     """
+    ops = EXACT_OPS if exact else OPS
     stack: List[expr.Expr] = [ ]
-    stream = lexer.Token_Stream(s)
-    while stream.has_more():
-        token = stream.take()
-        if token.kind == syntax.ASSIGN:
-            if len(stack) < 2:
-                raise InputError("Insufficient operands for {}".format(token))
-            right = stack.pop()
-            left = stack.pop()
-            op_class = token.clazz
-            if not isinstance(right, expr.Var):
+    push = stack.append
+    pop = stack.pop
+    for match in TOKEN.finditer(s):
+        group = match.lastindex
+        word = match.group(group)
+        if group == OP:
+            arity, op_class = ops[word]
+            if len(stack) < (arity or 2):
+                check_rest(s, match.end())
+                raise InputError("Insufficient operands for {}".format(token(word)))
+            if arity == 1:
+                push(op_class(pop()))
+                continue
+            right = pop()
+            left = pop()
+            if arity == 0 and not isinstance(right, expr.Var):
+                check_rest(s, match.end())
                 raise InputError("First operand of assignment must be" +
                                  " a variable, not {}".format(right))
-            node = op_class(left, right)
-            stack.append(node)
-        elif token.kind == syntax.BINOP: 
-            if len(stack) < 2:
-                raise InputError("Insufficient operands for {}".format(token))
-            right = stack.pop()
-            left = stack.pop()
-            op_class = token.clazz
-            node = op_class(left, right)
-            stack.append(node)
-        elif token.kind == syntax.UNOP:
-            if len(stack) < 1:
-                raise InputError("Insufficient operands for {}".format(token))
-            left = stack.pop()
-            op_class = token.clazz
-            node = op_class(left)
-            stack.append(node)
-        elif token.kind in [syntax.CONST, syntax.IDENT]:
-            leaf_class = token.clazz
-            node = leaf_class(token.value)
-            stack.append(node)
+            push(op_class(left, right))
+        elif group == INT:
+            push(expr.Const(int(word)))
+        elif group == IDENT:
+            push(expr.Var(word))
+        elif group == FLOAT:
+            push(expr.Const(exact_number(word) if exact else float(word)))
+        else:
+            raise lexer.LexicalError("Unrecognized token '{}'".format(word))
     if len(stack) > 1:
         raise InputError("Unbalanced expression (too many operands)")
     if len(stack) == 0:
         raise InputError("Empty expression")
     return stack[0]
 
+
+def token(sym: str) -> lexer.Token:
+    """The token for an operator symbol, for messages"""
+    kind, clazz = syntax.OPS[sym]
+    return lexer.Token(sym, kind, clazz)
+
+
+def check_rest(s: str, pos: int):
+    """Raise LexicalError for an unrecognized token from pos on.
+    The whole input is lexed before it is parsed, so a lexical
+    error takes precedence over a syntax error.
+    """
+    for match in TOKEN.finditer(s, pos):
+        if match.lastindex > FLOAT:
+            raise lexer.LexicalError("Unrecognized token '{}'".format(match.group(match.lastindex)))
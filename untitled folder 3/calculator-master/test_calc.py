@@ -0,0 +1,30 @@
+"""
+Tests for the batch mode of calc.py
+"""
+
+import unittest
+import io
+import expr
+import calc_state
+import calc
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_stream(self):
+        """One environment for the stream, one output line
+        per expression, and errors do not stop evaluation
+        """
+        env = calc_state.Env(expr.Const, expr.Const(0))
+        out = io.StringIO()
+        lines = ["3 4 + x =\n", "x 2 *\n", "\n", "x 0 /\n", "1 +\n", "x y +"]
+        errors = calc.run_stream(lines, env, out, "script")
+        self.assertEqual(out.getvalue(), "7\n14\n7\n")
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith("script:4: "))
+        self.assertTrue(errors[1].startswith("script:5: Insufficient operands"))
+        self.assertEqual(env.get("x"), expr.Const(7))
+
+
+if __name__ == '__main__':
+    unittest.main()
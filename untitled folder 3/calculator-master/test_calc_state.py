@@ -3,6 +3,8 @@ Unit tests for calc_state.py
 """
 
 import unittest
+import os
+import tempfile
 import calc_state
 
 class TestStore(unittest.TestCase):
@@ -25,6 +27,66 @@ class TestStore(unittest.TestCase):
         env = calc_state.Env[str](str, "No value")
         with self.assertRaises(AssertionError):
             env.put("A", 42)
+
+
+class TestPersistent(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "workspace")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def open(self, path=None):
+        return calc_state.PersistentEnv(path or self.path, str, "No value")
+
+    def test_reopen(self):
+        with self.open() as env:
+            for i in range(100):
+                env.put("A{}".format(i % 10), "value {}".format(i))
+            env.put("B", "b")
+        env = self.open()
+        self.assertIsNone(env._index)
+        self.assertEqual(env.get("A3"), "value 93")
+        self.assertEqual(env.get("B"), "b")
+        self.assertEqual(env.get("C"), "No value")
+        # Only what was looked up has been unpickled
+        self.assertNotIn("A4", env._map)
+        env.clear()
+        env.put("C", "c")
+        env.close()
+        env = self.open()
+        self.assertEqual(env.get("A3"), "No value")
+        self.assertEqual(env.get("C"), "c")
+        env.close()
+
+    def test_compact_and_snapshot(self):
+        with self.open() as env:
+            for i in range(100):
+                env.put("A", "value {}".format(i))
+            size = os.path.getsize(self.path)
+            env.compact()
+            self.assertLess(os.path.getsize(self.path), size / 50)
+            env.put("B", "b")
+            env.snapshot(self.path + ".snap")
+            env.put("B", "changed")
+        with self.open(self.path + ".snap") as snap:
+            self.assertEqual(snap.get("A"), "value 99")
+            self.assertEqual(snap.get("B"), "b")
+        with self.open() as env:
+            self.assertEqual(env.get("B"), "changed")
+
+    def test_incomplete_record(self):
+        with self.open() as env:
+            env.put("A", "a")
+        with open(self.path, "ab") as f:
+            f.write(b"P\x05\x00")
+        with self.open() as env:
+            self.assertEqual(env.get("A"), "a")
+            env.put("B", "b")
+        with self.open() as env:
+            self.assertEqual(env.get("B"), "b")
         
 
 if __name__ == '__main__':
@@ -6,6 +6,12 @@ Tests for expr.py,
 import unittest
 import expr
 import calc_state
+from fractions import Fraction
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class TestExpr(unittest.TestCase):
@@ -83,6 +89,41 @@ class TestExpr(unittest.TestCase):
         result = expr.Plus(expr.Times(x, expr.Const(3)), y).eval(env)
         self.assertEqual(result, expr.Const(15))
 
+    def test_exact_div(self):
+        """Quotients are ints when whole, Fractions otherwise"""
+        env = calc_state.Env(expr.Const, expr.Const(0))
+        six = expr.ExactDiv(expr.Const(12), expr.Const(2)).eval(env).value()
+        self.assertEqual(six, 6)
+        self.assertIs(type(six), int)
+        third = expr.ExactDiv(expr.Const(1), expr.Const(3)).eval(env).value()
+        self.assertEqual(third, Fraction(1, 3))
+        whole = expr.ExactDiv(expr.Const(Fraction(3, 2)), expr.Const(Fraction(1, 2))).eval(env).value()
+        self.assertIs(type(whole), int)
+        self.assertEqual(whole, 3)
+        self.assertEqual(expr.ExactDiv(expr.Const(2 ** 100 + 1), expr.Const(2)).eval(env).value(),
+                         Fraction(2 ** 100 + 1, 2))
+        self.assertEqual(str(expr.ExactDiv(expr.Const(1), expr.Var('x'))), "(1 / x)")
+        with self.assertRaises(ZeroDivisionError):
+            expr.ExactDiv(expr.Const(1), expr.Const(0)).eval(env)
+
+    @unittest.skipIf(numpy is None, "NumPy not installed")
+    def test_eval_batch(self):
+        """Element-wise, giving the same values as eval"""
+        env = calc_state.Env(object, 0)
+        env.put("x", numpy.array([1, 2, 3]))
+        env.put("y", numpy.array([4.0, 5.0, 6.0]))
+        x = expr.Var('x')
+        y = expr.Var('y')
+        exp = expr.Div(expr.Minus(expr.Times(x, expr.Const(3)), expr.Neg(y)), y)
+        result = expr.Assign(exp, expr.Var('z')).eval_batch(env)
+        self.assertEqual(list(env.get("z")), list(result))
+        for i in range(3):
+            scalar_env = calc_state.Env(expr.Const, expr.Const(0))
+            scalar_env.put("x", expr.Const(int(env.get("x")[i])))
+            scalar_env.put("y", expr.Const(float(env.get("y")[i])))
+            self.assertEqual(exp.eval(scalar_env), expr.Const(result[i]))
+        self.assertEqual(list(expr.Plus(expr.Var('unset'), x).eval_batch(env)), [1, 2, 3])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
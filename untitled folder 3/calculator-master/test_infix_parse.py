@@ -0,0 +1,46 @@
+"""
+Tests for infix_parse.py:  infix expressions should
+produce the same trees as the equivalent RPN
+"""
+
+import unittest
+import lexer
+import rpn_parse
+from infix_parse import parse, tokenize, InputError
+
+
+class TestInfix(unittest.TestCase):
+
+    def test_same_as_rpn(self):
+        for infix, rpn in [("3*4+x", "3 4 * x +"),
+                           ("3 + 4 * x", "3 4 x * +"),
+                           ("(3+4)*x", "3 4 + x *"),
+                           ("a-b-c", "a b - c -"),
+                           ("a/b*c", "a b / c *"),
+                           ("x=(y+3)*-z", "y 3 + z ~ * x ="),
+                           ("x = y = 2.5", "2.5 y = x ="),
+                           ("-x*y", "x ~ y *"),
+                           ("2 - -3", "2 3 ~ -"),
+                           ("~(a+b)/.5", "a b + ~ .5 /"),
+                           (" 7 ", "7")]:
+            self.assertEqual(repr(parse(infix)), repr(rpn_parse.parse(rpn)), infix)
+
+    def test_tokenize(self):
+        self.assertEqual([text for kind, text, pos in tokenize("x1=(y+3.5)*-z")],
+                         ["x1", "=", "(", "y", "+", "3.5", ")", "*", "-", "z", "end of input"])
+
+    def test_exact(self):
+        self.assertEqual(repr(parse("0.1 + 1/3", exact=True)),
+                         repr(rpn_parse.parse("0.1 1 3 / +", exact=True)))
+        self.assertEqual(repr(parse("0.5", exact=True)), "Const(1/2)")
+
+    def test_errors(self):
+        for src in ["", "  ", "3+", "(3", "3)", "x y", "3 = x", "()", "1.2.3"]:
+            with self.assertRaises(InputError):
+                parse(src)
+        with self.assertRaises(lexer.LexicalError):
+            parse("3 $ 4")
+
+
+if __name__ == '__main__':
+    unittest.main()
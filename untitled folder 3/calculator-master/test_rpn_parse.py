@@ -0,0 +1,55 @@
+"""
+Tests for rpn_parse.py
+"""
+
+import unittest
+import expr
+import lexer
+import calc_state
+from fractions import Fraction
+from rpn_parse import parse, InputError
+
+
+class TestParse(unittest.TestCase):
+
+    def test_trees(self):
+        self.assertEqual(repr(parse("3 4 * x +")), "Plus(Times(Const(3), Const(4)), Var('x'))")
+        self.assertEqual(repr(parse(" 2.5  .5 / ~\n")), "Neg(Div(Const(2.5), Const(0.5)))")
+        assign = parse("y_1 7 - x =")
+        self.assertIsInstance(assign, expr.Assign)
+        self.assertEqual(assign.var.name, 'x')
+        self.assertEqual(repr(assign.expr), "Minus(Var('y_1'), Const(7))")
+        self.assertIsInstance(parse("12").value(), int)
+        self.assertIsInstance(parse("1.0").value(), float)
+
+    def test_long(self):
+        """Long expressions parse in one pass"""
+        exp = parse(" ".join(["x"] + ["1 +"] * 5000))
+        for i in range(5000):
+            self.assertEqual(exp.right, expr.Const(1))
+            exp = exp.left
+        self.assertEqual(repr(exp), "Var('x')")
+
+    def test_exact(self):
+        """Decimals are exact and division does not round"""
+        env = calc_state.Env(expr.Const, expr.Const(0))
+        self.assertEqual(parse("0.1 0.2 +", exact=True).eval(env), expr.Const(Fraction(3, 10)))
+        self.assertEqual(parse("1 3 / 3 *", exact=True).eval(env).value(), 1)
+        self.assertIs(type(parse("2.0", exact=True).value()), int)
+        self.assertIsInstance(parse("1 3 /", exact=True), expr.ExactDiv)
+        self.assertNotIsInstance(parse("1 3 /"), expr.ExactDiv)
+        self.assertEqual(parse("1 3 /").eval(env), expr.Const(1 / 3))
+
+    def test_errors(self):
+        for src in ["", "  ", "3 +", "~", "3 4", "3 4 =", "x ="]:
+            with self.assertRaises(InputError):
+                parse(src)
+        for src in ["3x", "x % y", "1.2.3", "x+", "3 + 4x"]:
+            with self.assertRaises(lexer.LexicalError):
+                parse(src)
+        with self.assertRaisesRegex(InputError, r"Insufficient operands for Token\('\+', BINOP, Plus\)"):
+            parse("3 +")
+
+
+if __name__ == '__main__':
+    unittest.main()
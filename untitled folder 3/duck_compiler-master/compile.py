@@ -3,15 +3,26 @@ Driver (main program) for expression compiler.
 Input is parsed by llparse.py to create an
 Expr object.  The 'gen' methods in Expr walk over
 the Expr tree and produce assembly code in the
-Context object.
+Context object.  With --cache, tokens, the syntax tree,
+and the assembly code are kept in a cache directory
+(--cache-dir, see compiler/cache.py) and reused for
+unchanged input.
+With --timings, the time and memory used by each phase
+are reported as JSON on standard error.  --unroll and --hoist
+select loop optimizations (see codegen_context.py).
 """
 
-from compiler.llparse import parse, InputError
-from compiler.lexer import LexicalError
-from compiler import codegen_context
+from compiler.llparse import parse, parse_tokens, InputError
+from compiler.lexer import LexicalError, lex
+from compiler import codegen_context, expr
+from compiler.cache import Cache, DEFAULT_DIR
+from compiler.timings import Timings, count_nodes
+
+from typing import List, Optional, TextIO
 
 import datetime
 import argparse
+import os
 import sys
 
 import logging
@@ -28,29 +39,149 @@ def cli() -> object:
     parser.add_argument("outfile", type=argparse.FileType('w'),
                         nargs="?", default=sys.stdout,
                         help="Output file for assembly code")
+    add_cache_args(parser)
+    parser.add_argument("--timings", action="store_true",
+                        help="Report time and memory for each phase as JSON on stderr"
+                        " (not with --cache, since cached phases are skipped)")
+    add_optimization_args(parser)
     args = parser.parse_args()
+    if args.timings and cache_dir(args):
+        parser.error("--timings cannot be combined with --cache")
     return args
 
 
-def main():
-    args = cli()
-    context = codegen_context.Context()
-    context.add_line("# Lovingly crafted by robots")
-    context.add_line("# {} from {}".format(datetime.datetime.now(), args.sourcefile.name))
-    context.add_line("#")
+def add_cache_args(parser: argparse.ArgumentParser):
+    """Command line options for the compilation cache"""
+    parser.add_argument("-c", "--cache", action="store_true",
+                        help="Reuse results kept in a cache directory")
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        help="Cache directory (default {}); implies --cache"
+                        .format(DEFAULT_DIR))
+
+
+def cache_dir(args) -> Optional[str]:
+    """The cache directory from the command line, or
+    None if the cache is not used
+    """
+    if args.cache_dir:
+        return args.cache_dir
+    return DEFAULT_DIR if args.cache else None
+
+
+def add_optimization_args(parser: argparse.ArgumentParser):
+    """Command line options for the loop optimizations"""
+    parser.add_argument("--unroll", type=int, default=1, metavar="N",
+                        help="Unroll counted loops N times (default 1, no unrolling)")
+    parser.add_argument("--hoist", action="store_true",
+                        help="Keep loop-invariant variables and constants in registers")
+
+
+def optimizations(args) -> dict:
+    """Keyword arguments for Context from the command line"""
+    return {"unroll": args.unroll, "hoist": args.hoist}
+
+
+def stage_name(stage: str, unroll: int = 1, hoist: bool = False) -> str:
+    """Name of a cache stage for code generated with
+    these optimizations.
+    """
+    if unroll > 1:
+        stage += "_unroll{}".format(unroll)
+    if hoist:
+        stage += "_hoist"
+    return stage
+
+
+# Modules that assembly code depends on, besides the front end
+BACK_END = [codegen_context.__file__, os.path.abspath(__file__)]
+
+
+def header(name: str) -> List[str]:
+    """Comment lines at the start of the assembly code"""
+    return ["# Lovingly crafted by robots",
+            "# {} from {}".format(datetime.datetime.now(), name),
+            "#"]
+
+
+def generate(sourcefile: TextIO, **options) -> codegen_context.Context:
+    """Parse the source program and generate code for it,
+    returning the Context holding the generated program.
+    Options are passed to the Context.
+    """
+    context = codegen_context.Context(**options)
+    for line in header(sourcefile.name):
+        context.add_line(line)
+    exp = parse(sourcefile)
+    log.debug("Parsed to: %s", exp)
+    return gen_program(exp, context)
+
+
+def gen_program(exp: expr.Expr, context: codegen_context.Context = None,
+                **options) -> codegen_context.Context:
+    """Generate code for a parsed program, in a new Context
+    with these options if none is given.
+    """
+    if context is None:
+        context = codegen_context.Context(**options)
     # Memory mapped IO addressed hooked to special variables named 'in' and 'out'
     context.hook_var("in", 510)
     context.hook_var("out", 511)
-    ok = True
-    try:
-        exp = parse(args.sourcefile)
-        log.debug("Parsed to: {}".format(exp))
-        work_register = context.alloc_reg()
-        exp.gen(context, work_register)
-        context.free_reg(work_register)
-        context.add_line("\tHALT  r0,r0,r0")
+    work_register = context.alloc_reg()
+    exp.gen(context, work_register)
+    context.free_reg(work_register)
+    context.add_instr("HALT")
+    context.gen_functions()
+    return context
+
+
+def generate_cached(sourcefile: TextIO, directory: str, **options) -> List[str]:
+    """Assembly code for the source program, reusing
+    whatever stages are cached in directory.
+    """
+    cache = Cache(directory, sourcefile.read())
+    stage = stage_name("asm", **options)
+    assm = cache.get(stage, BACK_END)
+    if assm is None:
+        assm = gen_program(cache.ast(), **options).get_lines()
+        cache.put(stage, assm, BACK_END)
+    return header(sourcefile.name) + assm
+
+
+def generate_timed(sourcefile: TextIO, timings: Timings, **options) -> List[str]:
+    """Assembly code for the source program, measuring each
+    phase separately.  Lexing is done in full before parsing
+    so that the two can be told apart.
+    """
+    with timings.phase("read"):
+        source = sourcefile.read()
+    with timings.phase("lex"):
+        tokens = lex(source)
+    with timings.phase("parse"):
+        exp = parse_tokens(tokens)
+    with timings.phase("gen"):
+        context = gen_program(exp, **options)
+    with timings.phase("emit"):
         assm = context.get_lines()
-        log.debug("assm = {}".format(assm))
+    timings.count("tokens", len(tokens))
+    timings.count("nodes", count_nodes(exp))
+    timings.count("instructions", sum(isinstance(line, codegen_context.AsmInstr)
+                                      for line in context.assm_lines))
+    timings.count("lines", len(assm))
+    return header(sourcefile.name) + assm
+
+
+def main():
+    args = cli()
+    try:
+        if args.timings:
+            timings = Timings()
+            assm = generate_timed(args.sourcefile, timings, **optimizations(args))
+            print(timings.report(program=args.sourcefile.name, mode="compile"), file=sys.stderr)
+        elif cache_dir(args):
+            assm = generate_cached(args.sourcefile, cache_dir(args), **optimizations(args))
+        else:
+            assm = generate(args.sourcefile, **optimizations(args)).get_lines()
+        log.debug("assm = %s", assm)
         for line in assm:
             # noinspection PyUnresolvedReferences
             print(line, file=args.outfile)
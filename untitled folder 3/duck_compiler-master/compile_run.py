@@ -0,0 +1,139 @@
+"""
+Driver (main program) to compile an Awl program and run it
+on the Duck Machine in one process.  Code generation is the
+same as in compile.py, but rather than writing assembly code
+to be re-parsed by the assembler, labels are resolved in the
+Context and instructions are encoded directly into object code,
+which may be written to an object file and/or loaded straight
+into the memory of a simulated Duck Machine.  With --cache
+(or --cache-dir), object code is cached along with the
+earlier stages (see compiler/cache.py).
+
+The Duck Machine simulator is a separate project; its directory
+is added to the module search path (see --machine).
+"""
+
+from compile import generate, gen_program, BACK_END, add_optimization_args, optimizations, stage_name, \
+    add_cache_args, cache_dir
+from compiler.llparse import InputError
+from compiler.lexer import LexicalError
+from compiler.codegen_context import AsmInstr
+from compiler.cache import Cache
+
+from typing import List, TextIO, Union
+
+import argparse
+import os
+import sys
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MACHINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, "duck_machine-master-2")
+
+# Memory size and memory-mapped I/O addresses, as in duck_machine.py
+MEMORY_SIZE = 512
+IN_ADDR = 510
+OUT_ADDR = 511
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Compile and run an Awl program")
+    parser.add_argument("sourcefile", type=argparse.FileType('r'),
+                        help="Source program text")
+    parser.add_argument("-o", "--objfile", type=argparse.FileType('w'),
+                        help="Also write object code to this file")
+    parser.add_argument("-n", "--norun", help="Compile only, do not run",
+                        action="store_true")
+    parser.add_argument("--machine", default=MACHINE_DIR,
+                        help="Directory of the Duck Machine simulator")
+    add_cache_args(parser)
+    add_optimization_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def encode(program: List[Union[AsmInstr, int]]) -> List[int]:
+    """Encode resolved instructions and data as object code words.
+    Requires the Duck Machine instr_format module.
+    """
+    from instr_format import Instruction, OpCode, CondFlag, NAMED_REGS, offset_field
+    limit = 1 << (offset_field.field_width - 1)
+    words = [ ]
+    for item in program:
+        if isinstance(item, int):
+            words.append(item)
+            continue
+        if not -limit <= item.offset < limit:
+            raise RuntimeError("Offset {} out of range in {}".format(item.offset, item))
+        instr = Instruction(OpCode[item.op], CondFlag[item.cond],
+                            NAMED_REGS[item.target], NAMED_REGS[item.src1],
+                            NAMED_REGS[item.src2], item.offset)
+        words.append(instr.encode())
+    return words
+
+
+def compile_cached(sourcefile: TextIO, directory: str, **options) -> List[int]:
+    """Object code for the source program, reusing
+    whatever stages are cached in directory.
+    """
+    import instr_format
+    deps = BACK_END + [os.path.abspath(__file__), instr_format.__file__]
+    cache = Cache(directory, sourcefile.read())
+    stage = stage_name("obj", **options)
+    words = cache.get(stage, deps)
+    if words is None:
+        words = encode(gen_program(cache.ast(), **options).get_instructions())
+        cache.put(stage, words, deps)
+    return words
+
+
+def duck_out(addr: int, value: int) -> None:
+    print("Quack!: {}".format(value))
+
+
+def duck_in(addr: int) -> int:
+    return int(input("Quack! Gimme an int! "))
+
+
+def run(words: List[int]) -> None:
+    """Load object code into a fresh Duck Machine and run it"""
+    from memory import MemoryMappedIO
+    from cpu import CPU
+    mem = MemoryMappedIO(MEMORY_SIZE)
+    mem.map_address_in(IN_ADDR, duck_in)
+    mem.map_address_out(OUT_ADDR, duck_out)
+    for addr, word in enumerate(words):
+        mem.put(addr, word)
+    CPU(mem).run()
+    print("Halted")
+
+
+def main():
+    args = cli()
+    sys.path.insert(0, args.machine)
+    try:
+        if cache_dir(args):
+            words = compile_cached(args.sourcefile, cache_dir(args), **optimizations(args))
+        else:
+            words = encode(generate(args.sourcefile, **optimizations(args)).get_instructions())
+    except InputError as e:
+        print("Syntax error, bailing")
+        return
+    except LexicalError as e:
+        print("Lexical error, bailing")
+        return
+    if args.objfile:
+        for word in words:
+            print(word, file=args.objfile)
+        args.objfile.close()
+    if not args.norun:
+        run(words)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Batch compiler for many Awl programs in one process, so
+that Python start-up and module import are paid once
+rather than for each program.
+
+Requests are read from standard input and responses written
+to standard output, one JSON object per line.  A request is
+    {"id": any, "source": "program text", "name": "optional file name",
+     "unroll": optional factor, "hoist": optional true or false}
+and the response to it is
+    {"id": same, "asm": [assembly code lines]}
+or, if the program cannot be compiled,
+    {"id": same, "error": "description"}
+Responses are written in the order requests were read.
+
+Requests are compiled by a pool of worker processes
+(see --jobs); with --jobs 0 they are compiled in this process.
+Each request is compiled as soon as it is read, unless --chunk
+asks for several at a time.
+"""
+
+from compile import header, gen_program
+from compiler.llparse import parse, InputError
+from compiler.lexer import LexicalError
+
+from typing import Iterable, Iterator
+
+import argparse
+import io
+import json
+import multiprocessing
+import sys
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Batch compile server for Awl programs")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of worker processes (0 to compile in this process)")
+    parser.add_argument("--chunk", type=int, default=1,
+                        help="Requests handed to a worker at a time (default 1;"
+                        " more suits batch input, but no request is compiled"
+                        " until a whole chunk has been read)")
+    args = parser.parse_args()
+    return args
+
+
+def compile_request(line: str) -> str:
+    """Compile the program in one JSON request line,
+    returning one JSON response line.
+    """
+    response = { }
+    try:
+        request = json.loads(line)
+        response["id"] = request.get("id")
+        source = io.StringIO(request["source"])
+        name = request.get("name", "<request>")
+        context = gen_program(parse(source), unroll=request.get("unroll", 1),
+                              hoist=request.get("hoist", False))
+        response["asm"] = header(name) + context.get_lines()
+    except InputError as e:
+        response["error"] = "Syntax error: {}".format(e)
+    except LexicalError as e:
+        response["error"] = "Lexical error: {}".format(e)
+    except Exception as e:
+        response["error"] = "{}: {}".format(type(e).__name__, e)
+    return json.dumps(response)
+
+
+def serve(requests: Iterable[str], jobs: int, chunk: int = 1) -> Iterator[str]:
+    """Responses to requests, in order.  With the default
+    chunk of 1, each request is compiled as soon as it is
+    read, so a client may wait for each response before
+    sending the next request.
+    """
+    requests = (line for line in requests if line.strip())
+    if jobs == 0:
+        yield from map(compile_request, requests)
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap(compile_request, requests, chunk)
+
+
+def main():
+    args = cli()
+    for response in serve(sys.stdin, args.jobs, args.chunk):
+        print(response, flush=True)
+
+
+if __name__ == "__main__":
+    main()
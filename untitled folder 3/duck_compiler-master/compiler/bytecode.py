@@ -0,0 +1,351 @@
+"""
+A compact bytecode and a register-based virtual machine for
+the interpreter.  The 'gen_bytecode' methods of Expr nodes
+walk the tree once, producing a flat list of instructions in
+a Program object, much as the 'gen' methods build assembly
+code in a Context object.  Running the Program then needs
+no tree walk, no Const allocation, and no dictionary lookup
+for variables.
+
+Every value lives in a numbered slot of one list:  each
+variable is resolved to a slot when the program is compiled,
+each distinct constant gets a slot holding its value, and each
+intermediate result gets a temporary slot.  An instruction like
+ADD names its target and operand slots directly, so
+'x = x + 1 ;' is a single instruction.
+
+Variables hooked to input or output (like 'in' and 'out')
+are also resolved once, when the program is compiled, into
+IN and OUT instructions.
+
+Each function has a contiguous range of slots for its local
+variables, constants and temporaries.  CALL saves the callee's
+range on a stack of call frames and resets it to its initial
+values before passing the arguments; RET restores it.  Thus
+a recursive call cannot disturb the caller's locals.
+
+Arrays are kept apart from the slots, each in its own list,
+and are reached only by the LOADX, STOREX, FILL and COPY
+instructions, which name an array by number.
+
+Like codegen_context, this module does not import expr.
+"""
+
+from typing import Callable, List
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Operation codes.  Each instruction is four entries in the
+# code list:  an operation code and three arguments, usually
+# a target slot and two source slots (0 if unused).
+MOVE = 0     # slots[t] = slots[a]
+ADD = 1      # slots[t] = slots[a] + slots[b]
+SUB = 2      # slots[t] = slots[a] - slots[b]
+MUL = 3      # slots[t] = slots[a] * slots[b]
+DIV = 4      # slots[t] = slots[a] // slots[b]
+NEG = 5      # slots[t] = - slots[a]
+JUMP = 6     # go to address t
+JUMPZ = 7    # go to address t if slots[a] is zero
+IN = 8       # slots[t] = value from input hook number a
+OUT = 9      # slots[t] = slots[a], and send it to output hook number b
+LT = 10      # slots[t] = 1 if slots[a] < slots[b] else 0
+LE = 11      # and so on for the other comparisons
+EQ = 12
+NE = 13
+GE = 14
+GT = 15
+CALL = 16    # slots[t] = result of call site number a
+RET = 17     # return slots[a] from the current function
+LOADX = 18   # slots[t] = array a [slots[b]]
+STOREX = 19  # array t [slots[a]] = slots[b]
+FILL = 20    # every element of array t = slots[a]
+COPY = 21    # the first elements of array t = all of array a
+
+# Arithmetic instructions by Duck Machine opcode, so that
+# BinOp nodes can share one gen_bytecode method
+ALU_OPS = {"ADD": ADD, "SUB": SUB, "MUL": MUL, "DIV": DIV}
+
+# Comparison instructions by operator symbol
+CMP_OPS = {"<": LT, "<=": LE, "==": EQ, "!=": NE, ">=": GE, ">": GT}
+
+OP_NAMES = ["MOVE", "ADD", "SUB", "MUL", "DIV", "NEG",
+            "JUMP", "JUMPZ", "IN", "OUT",
+            "LT", "LE", "EQ", "NE", "GE", "GT", "CALL", "RET",
+            "LOADX", "STOREX", "FILL", "COPY"]
+
+INSTR_SIZE = 4
+
+
+class Function(object):
+    """Where a function's code and slots are"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.entry = None
+        # Slots of the parameters, and the range
+        # lo <= slot < hi of all the function's slots
+        self.params = [ ]
+        self.lo = None
+        self.hi = None
+
+
+class Program(object):
+    """A bytecode program under construction, and the
+    virtual machine that runs it.
+    """
+
+    def __init__(self, default: int):
+        # Flat list of instructions, INSTR_SIZE entries each
+        self.code = [ ]
+        # Variable names to slot numbers
+        self.vars = { }
+        # Constant values to slot numbers
+        self.consts = { }
+        # Slots holding intermediate results
+        self.temps = set()
+        # Initial value of every slot:  the default value
+        # for variables, the value itself for constants
+        self.initial = [ ]
+        self.default = default
+        # Hook functions, by variable name.  Input hooks are
+        # given the variable name and return an int; output
+        # hooks are given an int.
+        self.read_hooks = { }
+        self.write_hooks = { }
+        # Hooks referenced by IN and OUT instructions, by number
+        self.hook_funcs = [ ]
+        # Functions by name; while generating code for one,
+        # its local variable names to slot numbers
+        self.functions = { }
+        self.locals = None
+        # Call sites referenced by CALL instructions, by number,
+        # as a Function and the slots of the arguments
+        self.sites = [ ]
+        # Array numbers by name, and the size of each array
+        self.arrays = { }
+        self.array_sizes = [ ]
+        # Contents of the arrays after the program has run
+        self.array_values = None
+
+    def hook_input(self, name: str, func: Callable[[str], int]):
+        """Reading this variable calls func.  Must be
+        called before code is generated.
+        """
+        self.read_hooks[name] = func
+
+    def hook_output(self, name: str, func: Callable[[int], None]):
+        """Storing to this variable also calls func.  Must be
+        called before code is generated.
+        """
+        self.write_hooks[name] = func
+
+    def _new_slot(self, initial: int) -> int:
+        self.initial.append(initial)
+        return len(self.initial) - 1
+
+    def var_slot(self, name: str) -> int:
+        """The slot holding a variable"""
+        if self.locals is not None and name in self.locals:
+            return self.locals[name]
+        if name not in self.vars:
+            self.vars[name] = self._new_slot(self.default)
+        return self.vars[name]
+
+    def const_slot(self, value: int) -> int:
+        """The slot holding a constant value"""
+        if value not in self.consts:
+            self.consts[value] = self._new_slot(value)
+        return self.consts[value]
+
+    def temp_slot(self) -> int:
+        """A fresh slot for an intermediate result"""
+        slot = self._new_slot(0)
+        self.temps.add(slot)
+        return slot
+
+    def declare_array(self, name: str, size: int):
+        """Create an array, initialized to zero"""
+        self.arrays[name] = len(self.array_sizes)
+        self.array_sizes.append(size)
+
+    def function(self, name: str) -> Function:
+        """The Function for a name, which may not yet
+        have been generated.
+        """
+        if name not in self.functions:
+            self.functions[name] = Function(name)
+        return self.functions[name]
+
+    def begin_function(self, name: str, params: List[str], local_names: List[str],
+                       global_names: List[str]):
+        """Start generating code for a function.  Global
+        variables it uses are given slots first, so that they
+        fall outside the function's range.
+        """
+        for global_name in global_names:
+            if global_name not in self.read_hooks:
+                self.var_slot(global_name)
+        func = self.function(name)
+        func.entry = self.here()
+        func.lo = len(self.initial)
+        self.locals = { }
+        for local_name in local_names:
+            self.locals[local_name] = self._new_slot(self.default)
+        func.params = [self.locals[param] for param in params]
+
+    def end_function(self, name: str):
+        """Finish generating code for a function"""
+        self.functions[name].hi = len(self.initial)
+        self.locals = None
+
+    def call(self, name: str, args: List[int]) -> int:
+        """Call a function with the values in slots args,
+        returning the slot for the result.
+        """
+        self.sites.append((self.function(name), args))
+        result = self.temp_slot()
+        self.emit(CALL, result, len(self.sites) - 1)
+        return result
+
+    def here(self) -> int:
+        """Address of the next instruction to be emitted"""
+        return len(self.code)
+
+    def emit(self, op: int, target: int = 0, a: int = 0, b: int = 0) -> int:
+        """Add an instruction, returning its address"""
+        addr = len(self.code)
+        self.code.extend((op, target, a, b))
+        return addr
+
+    def patch(self, addr: int, target: int):
+        """Set the jump target of instruction at addr"""
+        self.code[addr + 1] = target
+
+    def load(self, name: str) -> int:
+        """The slot holding the value of a variable.  Only
+        a hooked variable needs an instruction to read it.
+        """
+        if name in self.read_hooks:
+            func = self.read_hooks[name]
+            self.hook_funcs.append(lambda: func(name))
+            temp = self.temp_slot()
+            self.emit(IN, temp, len(self.hook_funcs) - 1)
+            return temp
+        return self.var_slot(name)
+
+    def store(self, name: str, value: int):
+        """Store the value in slot 'value' into a variable,
+        sending it to the variable's hook if it has one.
+        """
+        slot = self.var_slot(name)
+        if name in self.write_hooks:
+            self.hook_funcs.append(self.write_hooks[name])
+            self.emit(OUT, slot, value, len(self.hook_funcs) - 1)
+            return
+        last = len(self.code) - INSTR_SIZE
+        if (value in self.temps and last >= 0 and self.code[last + 1] == value
+                and self.code[last] not in (JUMP, JUMPZ, RET, STOREX, FILL, COPY)):
+            # The value was just computed into a temporary;
+            # compute it straight into the variable instead.
+            self.code[last + 1] = slot
+        else:
+            self.emit(MOVE, slot, value)
+
+    def listing(self) -> List[str]:
+        """Human-readable form of the program, for debugging"""
+        lines = [ ]
+        for addr in range(0, len(self.code), INSTR_SIZE):
+            op, target, a, b = self.code[addr:addr + INSTR_SIZE]
+            lines.append("{:5}  {:6} {},{},{}".format(addr, OP_NAMES[op], target, a, b))
+        return lines
+
+    def run(self) -> List[int]:
+        """Execute the program.  Returns the final values of
+        the slots; the arrays are left in array_values.
+        """
+        code = self.code
+        end = len(code)
+        initial = self.initial
+        slots = initial.copy()
+        hook_funcs = self.hook_funcs
+        sites = [(func.lo, func.hi, func.entry, func.params, args)
+                 for func, args in self.sites]
+        frames = [ ]
+        arrays = [[0] * size for size in self.array_sizes]
+        self.array_values = arrays
+        pc = 0
+        # Tests are ordered roughly by frequency, and opcodes
+        # are written as literals to avoid global lookups.
+        while pc < end:
+            op, target, a, b = code[pc:pc + 4]
+            pc += 4
+            if op == 1:    # ADD
+                slots[target] = slots[a] + slots[b]
+            elif op == 2:  # SUB
+                slots[target] = slots[a] - slots[b]
+            elif op == 7:  # JUMPZ
+                if slots[a] == 0:
+                    pc = target
+            elif op == 6:  # JUMP
+                pc = target
+            elif op == 3:  # MUL
+                slots[target] = slots[a] * slots[b]
+            elif op == 4:  # DIV
+                slots[target] = slots[a] // slots[b]
+            elif op == 0:  # MOVE
+                slots[target] = slots[a]
+            elif op == 5:  # NEG
+                slots[target] = - slots[a]
+            elif op == 8:  # IN
+                slots[target] = hook_funcs[a]()
+            elif op == 9:  # OUT
+                val = slots[a]
+                slots[target] = val
+                hook_funcs[b](val)
+            elif op == 10:  # LT
+                slots[target] = 1 if slots[a] < slots[b] else 0
+            elif op == 11:  # LE
+                slots[target] = 1 if slots[a] <= slots[b] else 0
+            elif op == 12:  # EQ
+                slots[target] = 1 if slots[a] == slots[b] else 0
+            elif op == 13:  # NE
+                slots[target] = 1 if slots[a] != slots[b] else 0
+            elif op == 14:  # GE
+                slots[target] = 1 if slots[a] >= slots[b] else 0
+            elif op == 15:  # GT
+                slots[target] = 1 if slots[a] > slots[b] else 0
+            elif op == 16:  # CALL
+                lo, hi, entry, params, args = sites[a]
+                vals = [slots[arg] for arg in args]
+                frames.append((pc, target, lo, hi, slots[lo:hi]))
+                slots[lo:hi] = initial[lo:hi]
+                for param, val in zip(params, vals):
+                    slots[param] = val
+                pc = entry
+            elif op == 17:  # RET
+                val = slots[a]
+                pc, target, lo, hi, saved = frames.pop()
+                slots[lo:hi] = saved
+                slots[target] = val
+            elif op == 18:  # LOADX
+                i = slots[b]
+                if i < 0:
+                    raise IndexError("Negative array index {}".format(i))
+                slots[target] = arrays[a][i]
+            elif op == 19:  # STOREX
+                i = slots[a]
+                if i < 0:
+                    raise IndexError("Negative array index {}".format(i))
+                arrays[target][i] = slots[b]
+            elif op == 20:  # FILL
+                array = arrays[target]
+                array[:] = [slots[a]] * len(array)
+            elif op == 21:  # COPY
+                src = arrays[a]
+                arrays[target][:len(src)] = src
+            else:
+                raise RuntimeError("Bad bytecode {} at {}".format(op, pc - INSTR_SIZE))
+        return slots
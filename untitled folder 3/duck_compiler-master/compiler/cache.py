@@ -0,0 +1,117 @@
+"""
+A content-addressed cache of compilation results, so that
+compiling an unchanged Awl program again is just a lookup.
+
+Each stage of compilation (lexed tokens, the syntax tree,
+assembly code, object code) is stored in its own file,
+named by a hash of the source text and of the source code
+of the compiler modules that stage depends on.  The front end
+(lexer, syntax, llparse, expr) is part of every key, and a
+back end stage adds its own modules, so changing only the
+code generator invalidates assembly and object code but not
+tokens or syntax trees.  Stale entries are simply never
+looked up again; delete the cache directory to reclaim space.
+
+Like env.py, this module does not interpret the values it
+stores; they are pickled.
+"""
+
+from compiler import lexer, syntax, llparse, expr
+
+from typing import Iterable, Optional
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DEFAULT_DIR = ".awl_cache"
+
+# Bump if the layout of cache files changes
+FORMAT = "1"
+
+FRONT_END = [lexer.__file__, syntax.__file__, llparse.__file__, expr.__file__]
+
+
+def version(paths: Iterable[str]) -> str:
+    """Hash of the contents of source files"""
+    digest = hashlib.sha256(FORMAT.encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class Cache(object):
+    """Cached stages for one source text"""
+
+    def __init__(self, directory: str, source: str):
+        self.directory = directory
+        self.source = source
+        self.source_hash = hashlib.sha256(source.encode()).hexdigest()
+        # Versions of groups of modules, computed once each
+        self._versions = { }
+
+    def _version(self, deps: Iterable[str]) -> str:
+        deps = tuple(deps)
+        if deps not in self._versions:
+            self._versions[deps] = version(deps)
+        return self._versions[deps]
+
+    def path(self, stage: str, deps: Iterable[str] = ()) -> str:
+        """File holding a stage that depends on the front end
+        and, for a back end stage, the modules in deps.
+        """
+        key = hashlib.sha256("{} {} {}".format(
+            self.source_hash, self._version(FRONT_END), self._version(deps)).encode())
+        return os.path.join(self.directory, stage, key.hexdigest() + ".pickle")
+
+    def get(self, stage: str, deps: Iterable[str] = ()) -> Optional[object]:
+        """The cached value of a stage, or None"""
+        path = self.path(stage, deps)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            log.debug("Cache miss for %s: %s", stage, e)
+            return None
+        log.debug("Cache hit for %s", stage)
+        return value
+
+    def put(self, stage: str, value: object, deps: Iterable[str] = ()):
+        """Store the value of a stage.  The file is written
+        under a temporary name and renamed, so that a reader
+        never sees a partial entry.
+        """
+        path = self.path(stage, deps)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            log.warning("Not caching %s: too deeply nested to pickle", stage)
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def tokens(self) -> list:
+        """The tokens of the source, from the cache if possible"""
+        tokens = self.get("tokens")
+        if tokens is None:
+            tokens = lexer.lex(self.source)
+            self.put("tokens", tokens)
+        return tokens
+
+    def ast(self) -> expr.Expr:
+        """The syntax tree of the source, from the cache if possible"""
+        tree = self.get("ast")
+        if tree is None:
+            tree = llparse.parse_tokens(self.tokens())
+            self.put("ast", tree)
+        return tree
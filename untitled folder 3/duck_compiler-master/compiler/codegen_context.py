@@ -11,26 +11,178 @@ place several small design decisions:  How
 registers are allocated, how constants and variables
 are declared, when and how the code is actually
 emitted to the output file. 
+
+Instructions are kept in structured form (AsmInstr) rather
+than as text, so the same generated code can either be
+rendered as assembly source (get_lines) or have its labels
+resolved here and be encoded directly as object code
+(get_instructions), skipping the assembler.
+
+Functions follow a register calling convention:  arguments
+are passed in r1, r2, ..., the result is returned in r1, the
+return address is passed in LINK_REG (r13), and STACK_REG (r14)
+is a stack pointer, growing down from STACK_TOP.  The caller
+saves the registers it has in use on the stack around a call.
+The stack must fit between the data segment and STACK_TOP, so
+the words it needs are counted along the deepest chain of calls
+(see stack_size) when the program is laid out.  LINK_REG and
+STACK_REG are reserved only in programs that define functions
+(see reserve_call_regs).
+While the body of a function is generated, its local variables
+are found through 'scope' in registers (leaf functions) or in
+its stack frame, rather than in the data segment.
+
+Arrays are laid out in the data segment after the variables and
+constants.  An element is addressed as index register plus the
+absolute address of the array in the offset field, e.g.
+LOAD r1,r2,r0[base].  The assembler only resolves labels as
+PC-relative addresses, so the Context fills in those absolute
+addresses itself when it lays out the program (see AsmInstr.base).
+
+Two optional loop optimizations are selected when the Context is
+created:  unrolling counted loops by a factor, and hoisting loads
+of loop-invariant variables and constants into registers before a
+loop.  While a loop is generated, its hoisted values are found in
+held_vars and held_consts.
 """
 
-from typing import List
+from typing import Callable, List, Optional, Union
 
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Range of the signed 10-bit offset field of an instruction
+OFFSET_MIN = -512
+OFFSET_MAX = 511
+
+# Registers reserved for function calls, and the highest
+# register that can be allocated with and without them
+LINK_REG = "r13"
+STACK_REG = "r14"
+MAX_REG = 14
+MAX_CALL_REG = 12
+# The stack pointer starts just below memory-mapped input, and
+# is decremented before each word is pushed.
+STACK_TOP = 510
+
+
+class AsmLabel(object):
+    """A label marking the address of the next instruction"""
+
+    def __init__(self, label: str, comment: str = ""):
+        self.label = label
+        self.comment = comment
+
+    def __str__(self) -> str:
+        if self.comment:
+            return "{}:  #{}".format(self.label, self.comment)
+        return "{}: ".format(self.label)
+
+
+class AsmInstr(object):
+    """One DM2018S instruction.  Registers are named as in
+    assembly code (r0 .. r15).  If 'symbol' is given, the
+    instruction refers to a label that must still be resolved
+    into a PC-relative address:  JUMP symbol, or
+    LOAD/STORE target,symbol.  If 'base' is given, it is the
+    label of data (an array) whose absolute address must still
+    be added to the offset.
+    """
+
+    def __init__(self, op: str, target: str = "r0",
+                 src1: str = "r0", src2: str = "r0",
+                 offset: int = 0, cond: str = "ALWAYS",
+                 symbol: str = None, comment: str = "",
+                 base: str = None):
+        self.op = op
+        self.cond = cond
+        self.target = target
+        self.src1 = src1
+        self.src2 = src2
+        self.offset = offset
+        self.symbol = symbol
+        self.comment = comment
+        self.base = base
+
+    def __repr__(self) -> str:
+        return "AsmInstr({})".format(str(self).strip())
+
+    def __str__(self) -> str:
+        """Assembly source form, as accepted by the assembler"""
+        if self.cond == "ALWAYS":
+            op = self.op
+        else:
+            op = "{}/{}".format(self.op, self.cond)
+        if self.base is not None:
+            # Not yet located; see locate
+            operands = "{},{},{}[{}+{}]".format(self.target, self.src1, self.src2,
+                                                self.base, self.offset)
+        elif self.symbol is None:
+            operands = "{},{},{}".format(self.target, self.src1, self.src2)
+            if self.offset != 0:
+                operands += "[{}]".format(self.offset)
+        elif self.op == "JUMP":
+            operands = self.symbol
+        else:
+            operands = "{},{}".format(self.target, self.symbol)
+        line = "\t{} {}".format(op, operands)
+        if self.comment:
+            line += "  # {}".format(self.comment)
+        return line
+
+    def locate(self, symbols: dict) -> "AsmInstr":
+        """This instruction with the address of its base
+        label added to the offset.
+        """
+        if self.base is None:
+            return self
+        offset = symbols[self.base] + self.offset
+        if not OFFSET_MIN <= offset <= OFFSET_MAX:
+            raise RuntimeError("Address {}+{} out of range".format(self.base, self.offset))
+        return AsmInstr(self.op, self.target, self.src1, self.src2, offset,
+                        cond=self.cond, comment=self.comment)
+
+    def resolve(self, symbols: dict, address: int) -> "AsmInstr":
+        """The fully resolved form of this instruction, if it
+        is placed at address.  JUMP becomes an ADD to the
+        program counter, and LOAD or STORE of a label becomes
+        a PC-relative memory reference.
+        """
+        if self.base is not None:
+            return self.locate(symbols)
+        if self.symbol is None:
+            return self
+        if self.symbol not in symbols:
+            raise RuntimeError("Use of undefined label: {}".format(self.symbol))
+        relative = symbols[self.symbol] - address
+        if self.op == "JUMP":
+            return AsmInstr("ADD", "r15", "r0", "r15", relative, cond=self.cond)
+        return AsmInstr(self.op, self.target, "r0", "r15", relative, cond=self.cond)
+
+
+class LayoutError(RuntimeError):
+    """The program, its data and its stack do not fit in memory"""
+    pass
+
 
 class Context(object):
-    """The state of code generation"""
+    """The state of code generation.  'unroll' is the factor
+    by which counted loops are unrolled (1 for none), and
+    'hoist' enables hoisting of loop-invariant loads.
+    """
 
-    def __init__(self):
+    def __init__(self, unroll: int = 1, hoist: bool = False):
 
         # The range of registers available for code generation;
-        # excludes r0 and r15
+        # excludes r0 and r15, and LINK_REG and STACK_REG if
+        # there are functions
         self.min_reg = 1
-        self.max_reg = 14
+        self.max_reg = MAX_REG
         self.cur_reg = 0   # The most recently allocated register
+        # The highest register allocated so far (see measure)
+        self.peak_reg = 0
 
         # A table of integer constants to be declared at
         # the end of the source program.  The table maps
@@ -42,23 +194,135 @@ class Context(object):
         # symbols used for them in the assembly code. 
         self.vars = { }
 
+        # Arrays to be declared after the variables and
+        # constants, by name, as (label, size)
+        self.arrays = { }
+
         # A table of variable names that are hooked
         # to special memory-mapped addresses, e.g.,
         # they may trigger input or output.
         self.hooks = { }
 
         # Instructions in the source code, as a list of
-        # strings.
+        # AsmInstr and AsmLabel objects, with plain strings
+        # for comment lines.
         self.assm_lines = [ ]
 
         # A counter that we append to each symbol to ensure
         # uniqueness
         self.unique_counter = 0
 
+        # Function definitions by name, generated after
+        # the main program (see gen_functions)
+        self.functions = { }
+
+        # While generating a function, its local variables
+        # by name, each mapped to a register name or to an
+        # index in the stack frame, and the label of its return
+        # code.  frame_depth counts words pushed on the stack
+        # since the frame was allocated.
+        self.scope = None
+        self.return_label = None
+        self.frame_depth = 0
+
+        # Stack words used by the main program (None) and by
+        # each function:  the size of its own frame, and the
+        # calls it makes as (words in use at the call, callee).
+        self.function = None
+        self.frame_words = {None: 0}
+        self.call_sites = {None: [ ]}
+
+        # Loop optimizations, and the registers holding
+        # hoisted variables (by name) and constants (by value)
+        # while a loop is generated
+        self.unroll = unroll
+        self.hoist = hoist
+        self.held_vars = { }
+        self.held_consts = { }
+
     def add_line(self, line: str) -> None:
-        """Add a line of assembly code"""
+        """Add a line of assembly source text, such as a comment.
+        Text lines are not seen by get_instructions, so code
+        should be added with add_instr.
+        """
         self.assm_lines.append(line)
-        log.debug("Added line, now {}".format(self.assm_lines))
+        log.debug("Added line, now %s", self.assm_lines)
+
+    def add_instr(self, op: str, target: str = "r0",
+                  src1: str = "r0", src2: str = "r0",
+                  offset: int = 0, cond: str = "ALWAYS",
+                  symbol: str = None, comment: str = "",
+                  base: str = None) -> None:
+        """Add one instruction; see AsmInstr"""
+        self.assm_lines.append(AsmInstr(op, target, src1, src2, offset,
+                                        cond=cond, symbol=symbol, comment=comment,
+                                        base=base))
+
+    def add_label(self, label: str, comment: str = "") -> None:
+        """The next instruction will be at this label"""
+        self.assm_lines.append(AsmLabel(label, comment))
+
+    def add_var_access(self, op: str, reg: str, var_name: str) -> None:
+        """LOAD or STORE register reg from or to variable var_name,
+        which may be hooked to a memory-mapped address.
+        """
+        if op == "LOAD" and var_name in self.held_vars:
+            self.add_instr("ADD", reg, self.held_vars[var_name], "r0")
+        elif self.scope is not None and var_name in self.scope:
+            where = self.scope[var_name]
+            if isinstance(where, str):
+                # Held in a register
+                if op == "LOAD":
+                    self.add_instr("ADD", reg, where, "r0")
+                else:
+                    self.add_instr("ADD", where, reg, "r0")
+            else:
+                self.add_instr(op, reg, STACK_REG, "r0", where + self.frame_depth)
+        elif var_name in self.hooks:
+            self.add_instr(op, reg, "r0", "r0", self.hooks[var_name])
+        else:
+            self.add_instr(op, reg, symbol=self.get_var_symbol(var_name))
+
+    def var_register(self, var_name: str) -> Optional[str]:
+        """The register holding a variable, if it is kept
+        in one (in a leaf function, or hoisted out of a loop),
+        else None.
+        """
+        if self.scope is not None and isinstance(self.scope.get(var_name), str):
+            return self.scope[var_name]
+        return self.held_vars.get(var_name)
+
+    def held_top(self) -> int:
+        """The number of the highest register holding a
+        hoisted value, or 0 if none
+        """
+        held = list(self.held_vars.values()) + list(self.held_consts.values())
+        return max((int(reg[1:]) for reg in held), default=0)
+
+    def const_register(self, value: int) -> Optional[str]:
+        """The register holding a constant hoisted out
+        of a loop, or None.
+        """
+        return self.held_consts.get(value)
+
+    def add_element_access(self, op: str, reg: str, array_name: str,
+                           index_reg: str = "r0", offset: int = 0) -> None:
+        """LOAD or STORE register reg from or to element
+        index_reg + offset of an array.
+        """
+        symbol, size = self.arrays[array_name]
+        self.add_instr(op, reg, index_reg, "r0", offset, base=symbol,
+                       comment="{}[{}{:+}]".format(array_name, index_reg, offset))
+
+    def declare_array(self, name: str, size: int):
+        """Reserve space for an array, initialized to zero"""
+        if name in self.arrays:
+            raise RuntimeError("Array {} declared twice".format(name))
+        self.arrays[name] = (self.new_label(name), size)
+
+    def array_size(self, name: str) -> int:
+        """Number of elements in an array"""
+        return self.arrays[name][1]
 
     def get_const_symbol(self, value: int) -> str:
         """Returns the name of the label associated
@@ -104,30 +368,173 @@ class Context(object):
         label = "{}_{}".format(base_name, self.unique_counter)
         return label
 
+    def push_regs(self, regs: List[str]):
+        """Save registers on the stack"""
+        if not regs:
+            return
+        self.add_instr("SUB", STACK_REG, STACK_REG, "r0", len(regs))
+        for i, reg in enumerate(regs):
+            self.add_instr("STORE", reg, STACK_REG, "r0", i)
+        self.frame_depth += len(regs)
+
+    def begin_frame(self, name: str, size: int):
+        """Start generating a function whose frame is size words"""
+        self.function = name
+        self.frame_words[name] = size
+        self.call_sites[name] = [ ]
+        self.frame_depth = 0
+
+    def note_call(self, name: str):
+        """Record a call from the code being generated"""
+        in_use = self.frame_words[self.function] + self.frame_depth
+        self.call_sites[self.function].append((in_use, name))
+
+    def stack_size(self, name: str = None, active: tuple = ()) -> int:
+        """Words of stack needed by the main program (or a
+        function) and everything it calls.  Recursion cannot be
+        bounded here, so a recursive call counts one frame.
+        """
+        if name in active:
+            return self.frame_words[name]
+        need = self.frame_words[name]
+        for in_use, callee in self.call_sites[name]:
+            need = max(need, in_use + self.stack_size(callee, active + (name,)))
+        return need
+
+    def pop_regs(self, regs: List[str]):
+        """Restore registers saved by push_regs"""
+        if not regs:
+            return
+        for i, reg in enumerate(regs):
+            self.add_instr("LOAD", reg, STACK_REG, "r0", i)
+        self.add_instr("ADD", STACK_REG, STACK_REG, "r0", len(regs))
+        self.frame_depth -= len(regs)
+
+    def gen_functions(self):
+        """Code for the functions called by the program,
+        placed after the main program.  Each function object
+        must have a gen_function(context) method.
+        """
+        for func in self.functions.values():
+            func.gen_function(self)
+
     def get_lines(self) -> List[str]:
         """Get all the generated source code, including 
-        declarations of variables and constants.
+        declarations of variables, constants and arrays.
         """
-        code = self.assm_lines.copy()
+        symbols = self._layout()[0] if self.arrays else { }
+        code = [str(line.locate(symbols)) if isinstance(line, AsmInstr) else str(line)
+                for line in self.assm_lines]
         for varname in self.vars:
             code.append("{}: DATA 0 #{}"
                         .format(self.vars[varname], varname))
         for constval in self.consts:
             code.append("{}:  DATA {}"
                         .format(self.consts[constval], constval))
+        for name, (symbol, size) in self.arrays.items():
+            code.append("{}: DATA 0 #{}[{}]".format(symbol, name, size))
+            code.extend(["\tDATA 0"] * (size - 1))
         return code
 
+    def _layout(self) -> tuple:
+        """Addresses of all labels, and the data words
+        that follow the instructions.
+        """
+        symbols = { }
+        address = 0
+        for item in self.assm_lines:
+            if isinstance(item, AsmLabel):
+                if item.label in symbols:
+                    raise RuntimeError("Duplicate label {}".format(item.label))
+                symbols[item.label] = address
+            elif isinstance(item, AsmInstr):
+                address += 1
+        data = [ ]
+        for varname in self.vars:
+            symbols[self.vars[varname]] = address + len(data)
+            data.append(0)
+        for constval in self.consts:
+            symbols[self.consts[constval]] = address + len(data)
+            data.append(constval)
+        for symbol, size in self.arrays.values():
+            symbols[symbol] = address + len(data)
+            data.extend([0] * size)
+        # Memory-mapped input and output are at STACK_TOP and
+        # above, and the stack grows down from there
+        needed = address + len(data) + self.stack_size()
+        if needed > STACK_TOP:
+            raise LayoutError("Program, data and stack need {} words of memory, but only {} are available"
+                              .format(needed, STACK_TOP))
+        return symbols, data
+
+    def get_instructions(self) -> List[Union[AsmInstr, int]]:
+        """Get the whole program as it will be laid out in
+        memory from address 0:  fully resolved instructions
+        followed by data words for variables, constants and
+        arrays.  Labels are resolved here, as the assembler
+        would resolve them.
+        """
+        symbols, data = self._layout()
+        code = [ ]
+        for item in self.assm_lines:
+            if isinstance(item, AsmInstr):
+                code.append(item.resolve(symbols, len(code)))
+        return code + data
+
     # Register management:
     #   alloc_reg  reserves and returns a register name.
     #   free_reg   marks the most recently reserved register
     #      as being available again. It requires the name of that
     #      register as a safety check.
+    def live_regs(self) -> List[str]:
+        """The registers currently allocated"""
+        return ["r{}".format(i) for i in range(self.min_reg, self.cur_reg + 1)]
+
     def alloc_reg(self) -> str:
         if self.cur_reg >= self.max_reg: 
             raise RuntimeError("Ran out of registers in code generation")
         self.cur_reg += 1
+        self.peak_reg = max(self.peak_reg, self.cur_reg)
         return "r{}".format(self.cur_reg)
 
+    def reserve_call_regs(self):
+        """The program defines functions, so LINK_REG and
+        STACK_REG cannot be allocated
+        """
+        self.max_reg = MAX_CALL_REG
+
+    def measure(self, gen: Callable[[], None]) -> int:
+        """The number of registers above cur_reg that gen()
+        allocates, with no limit and with loop hoisting off.
+        gen is run as a trial:  the code it generates, and its
+        other effects on this Context, are discarded.
+        """
+        # Tables are restored in place, since callers may hold them
+        tables = [self.consts, self.vars, self.frame_words,
+                  self.held_vars, self.held_consts]
+        saved_tables = [dict(table) for table in tables]
+        saved_sites = {name: list(sites) for name, sites in self.call_sites.items()}
+        saved = (len(self.assm_lines), self.unique_counter, self.max_reg, self.cur_reg,
+                 self.peak_reg, self.frame_depth, self.function, self.scope,
+                 self.return_label, self.hoist)
+        base = self.cur_reg
+        self.peak_reg = base
+        self.max_reg = 1000
+        self.hoist = False
+        try:
+            gen()
+            return self.peak_reg - base
+        finally:
+            (lines, self.unique_counter, self.max_reg, self.cur_reg,
+             self.peak_reg, self.frame_depth, self.function, self.scope,
+             self.return_label, self.hoist) = saved
+            for table, contents in zip(tables, saved_tables):
+                table.clear()
+                table.update(contents)
+            self.call_sites.clear()
+            self.call_sites.update(saved_sites)
+            del self.assm_lines[lines:]
+
     def free_reg(self, regname: str) -> None:
         expected = "r{}".format(self.cur_reg)
         assert self.cur_reg >= self.min_reg, (
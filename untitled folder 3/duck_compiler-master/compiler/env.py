@@ -11,7 +11,7 @@ not vice versa.
 
 """
 
-from typing import TypeVar, Generic, Type, Callable
+from typing import TypeVar, Generic, Type, Callable, Iterable, List, Optional
 
 import logging
 logging.basicConfig()
@@ -37,6 +37,8 @@ class Env(Generic[Value]):
         # for input and output
         self.read_hooks = { }
         self.write_hooks = { }
+        # Arrays by name, each a list of values
+        self.arrays = { }
         assert isinstance(default_value, self.value_type), "Default value should be of type {}".format(value_type)
 
     def __repr__(self) -> str:
@@ -53,6 +55,18 @@ class Env(Generic[Value]):
         """"When we 'put' to this variable, send value to this function instead"""
         self.write_hooks[name] = func
 
+    def declare_array(self, name: str, size: int, initial: Value):
+        """Create an array of size copies of initial"""
+        assert isinstance(initial, self.value_type), "Can't save value of type {}, only {}".format(
+            type(initial), self.value_type)
+        self.arrays[name] = [initial] * size
+
+    def array(self, name: str) -> List[Value]:
+        """The list of values of an array.  Elements are
+        read and written directly in the list.
+        """
+        return self.arrays[name]
+
     def clear(self):
         """Clear all (name, value) pairs from the map,
         like the 'Clear Memory' key on a calculator.
@@ -84,3 +98,136 @@ class Env(Generic[Value]):
             return self._map[name]
         log.debug("Did not find a mapping for variable '{}' in {}".format(name, self._map))
         return self.default_value
+
+
+class Frame(Env[Value]):
+    """The environment of one call of a function:  local
+    variables are kept here, and other names are looked up
+    in the global environment.
+    """
+
+    def __init__(self, outer: Env[Value], local_names: Iterable[str]):
+        super().__init__(outer.value_type, outer.default_value)
+        self.outer = outer
+        self.local_names = set(local_names)
+
+    def put(self, name: str, val: Value):
+        if name in self.local_names:
+            self._map[name] = val
+        else:
+            self.outer.put(name, val)
+
+    def get(self, name: str) -> Value:
+        if name in self.local_names:
+            return self._map.get(name, self.default_value)
+        return self.outer.get(name)
+
+    def array(self, name: str) -> List[Value]:
+        """Arrays are global"""
+        return self.outer.array(name)
+
+
+class SlotEnv(Env[Value]):
+    """A compiled environment.  Each variable name is resolved,
+    once, to an integer slot in a list of values, so that code
+    compiled against the environment (see the 'closure' methods
+    in expr.py) reads and writes variables by list index, with
+    no dictionary lookup, type check, or debug logging per access.
+
+    Hooked variables are special-cased when they are resolved:
+    read_hook and write_hook return the hook function (or None),
+    and compiled code calls it directly.  Hooks must therefore be
+    installed before code is compiled against the environment.
+    """
+
+    def __init__(self, value_type: Type, default_value: Value):
+        super().__init__(value_type, default_value)
+        # Variable names to slot numbers
+        self.slots = { }
+        # The values, indexed by slot
+        self.values = [ ]
+        # Compiled functions by name, shared by all code
+        # compiled against this environment
+        self.functions = { }
+
+    def __repr__(self) -> str:
+        return "SlotEnv[{}]{}".format(self.value_type.__name__,
+                                      {name: self.values[slot] for name, slot in self.slots.items()})
+
+    def slot(self, name: str) -> int:
+        """Resolve a variable name to its slot"""
+        if name not in self.slots:
+            self.slots[name] = len(self.values)
+            self.values.append(self.default_value)
+        return self.slots[name]
+
+    def frame_slot(self, name: str) -> Optional[int]:
+        """The slot of a variable in the frame passed to
+        compiled code, or None if the variable belongs to an
+        enclosing environment.  Here every variable does.
+        """
+        return self.slot(name)
+
+    def read_hook(self, name: str) -> Optional[Callable[[], Value]]:
+        """The function to call instead of reading this variable, or None"""
+        if name not in self.read_hooks:
+            return None
+        func = self.read_hooks[name]
+        return lambda: func(name)
+
+    def write_hook(self, name: str) -> Optional[Callable[[Value], None]]:
+        """The function to call after writing this variable, or None"""
+        return self.write_hooks.get(name)
+
+    def clear(self):
+        """Reset every variable to the default value.  Slots
+        remain valid, since compiled code refers to them.
+        """
+        for slot in range(len(self.values)):
+            self.values[slot] = self.default_value
+
+    def put(self, name: str, val: Value):
+        """Store by name; compiled code stores by slot instead"""
+        self.values[self.slot(name)] = val
+        hook = self.write_hook(name)
+        if hook:
+            hook(val)
+
+    def get(self, name: str) -> Value:
+        """Fetch by name; compiled code fetches by slot instead"""
+        hook = self.read_hook(name)
+        if hook:
+            return hook()
+        return self.values[self.slot(name)]
+
+
+class FrameEnv(SlotEnv[Value]):
+    """The compiled environment of a function.  Its local
+    variables have slots in a fresh frame for each call,
+    parameters first; other names resolve to slots of the
+    global environment, whose values list is shared.
+    """
+
+    def __init__(self, outer: SlotEnv[Value], local_names: Iterable[str]):
+        super().__init__(outer.value_type, outer.default_value)
+        self.outer = outer
+        self.functions = outer.functions
+        for name in local_names:
+            self.slot(name)
+
+    def frame_slot(self, name: str) -> Optional[int]:
+        return self.slots.get(name)
+
+    def read_hook(self, name: str) -> Optional[Callable[[], Value]]:
+        if name in self.slots:
+            return None
+        return self.outer.read_hook(name)
+
+    def write_hook(self, name: str) -> Optional[Callable[[Value], None]]:
+        if name in self.slots:
+            return None
+        return self.outer.write_hook(name)
+
+    def array(self, name: str) -> List[Value]:
+        """Arrays are global"""
+        return self.outer.array(name)
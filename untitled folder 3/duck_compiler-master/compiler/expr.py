@@ -7,15 +7,32 @@ Expressions.  An expression is a subtree, which may be
 - a control flow operator, like 
    - pass: do nothing
    - sequence: do one thing, and then another
+   - block: a flat list of statements, done in order
    - if/then/else:  test a condition and then execute one branch or another
    - while: test a condition to control a loop
    Where there is a condition, we treat 0 as False and any other value
    as true. 
+- a comparison, like 'less than', with value 1 if true and 0 if false
+- a function call, and the 'return' statement in a function body.
+  A program with functions is a Program node holding the function
+  definitions (FunctionDef) and the main block.  Parameters, and
+  any variable assigned in a function body, are local to a call.
+- arrays of fixed size, declared in the Program, with element
+  access (Index), element assignment (IndexAssign), and the
+  bulk operations fill and copy.  Arrays are global.
 
 In addition to the new control flow operators, the calculator is extended
 for Duck Machine assembly code generation.  The 'eval' methods evaluate an 
 expression immediately, while the 'gen' methods create assembly language 
 that can be translated into object code to evaluate the expression. 
+The 'gen_bytecode' methods are a faster alternative to 'eval' for the
+interpreter:  they translate the tree once into bytecode for the small
+virtual machine in bytecode.py.  Expressions return the number of the
+virtual machine slot that will hold their value; statements return None. 
+The 'closure' methods are a middle ground:  they convert each node once
+into a Python function of a frame, the list of values of a SlotEnv (see
+env.py), so that, e.g., Plus becomes 'lambda frame: left(frame) + right(frame)'
+on plain ints. 
 
 Nicholas Fay: 951566471: nfay@uoregon.edu
 June 7th 2018
@@ -23,10 +40,13 @@ June 7th 2018
 
 # Python standard libraries
 from numbers import Real
+from operator import add, floordiv, itemgetter, mul, sub
+from typing import Callable, Container, Dict, Iterator, List, Optional
 
 # Our modules
-from compiler.env import Env
-from compiler.codegen_context import Context
+from compiler.env import Env, SlotEnv, Frame, FrameEnv
+from compiler.codegen_context import Context, OFFSET_MIN, OFFSET_MAX, LINK_REG, STACK_REG, STACK_TOP
+from compiler import bytecode
 
 import logging
 
@@ -38,6 +58,16 @@ log.setLevel(logging.INFO)
 class Expr(object):
     """Abstract base class. Cannot be instantiated."""
 
+    def children(self) -> List["Expr"]:
+        """The sub-expressions of this node"""
+        result = [ ]
+        for child in vars(self).values():
+            if isinstance(child, Expr):
+                result.append(child)
+            elif isinstance(child, list):
+                result.extend(item for item in child if isinstance(item, Expr))
+        return result
+
     def eval(self, env: Env) -> "Const":
         """Each concrete subclass of Expr must define this method"""
         raise NotImplementedError(
@@ -52,6 +82,35 @@ class Expr(object):
         raise NotImplementedError(
             "No gen method has been defined for class {}".format(type(self)))
 
+    def gen_branch(self, context: Context, false_label: str):
+        """Code to test this expression as the condition of
+        an 'if' or 'while', jumping to false_label if it is
+        false (zero).  Comparisons override this to jump on
+        the condition code set by subtraction rather than
+        computing 0 or 1 first.
+        """
+        reg = context.alloc_reg()
+        self.gen(context, target=reg)
+        # Is it zero?
+        context.add_instr("SUB", "r0", reg, "r0")
+        context.add_instr("JUMP", cond="Z", symbol=false_label)
+        context.free_reg(reg)
+
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """Bytecode generation for the interpreter's virtual machine.
+        Returns the slot that will hold the value of an expression.
+        """
+        raise NotImplementedError(
+            "No gen_bytecode method has been defined for class {}".format(type(self)))
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Convert to a function of a frame of variable values.
+        The function returns an int for an expression, None
+        for a statement.
+        """
+        raise NotImplementedError(
+            "No closure method has been defined for class {}".format(type(self)))
+
 
 class Const(Expr):
     """An expression that is just a constant value, like 5"""
@@ -74,21 +133,97 @@ class Const(Expr):
 
     def eval(self, env: Env) -> "Const":
         """This is about as evaluated as it can get"""
-        log.debug("Evaluating {} in Const".format(self))
+        log.debug("Evaluating %s in Const", self)
         return self
 
     def gen(self, context: Context, target: str):
         """Load a constant from memory into a register"""
+        held = context.const_register(self.val)
+        if held:
+            context.add_instr("ADD", target, held, "r0")
+            return
         const_label = context.get_const_symbol(self.val)
-        context.add_line("\tLOAD {},{}  # Const {}".format(target, const_label, self.val))
+        context.add_instr("LOAD", target, symbol=const_label,
+                          comment="Const {}".format(self.val))
+
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """Constants are preloaded in their own slots"""
+        return program.const_slot(self.val)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Just the value"""
+        val = self.val
+        return lambda frame: val
 
 
 # It's handy to have a special singleton value for things that are undefined, and another
 # for things that default to zero
 NO_VALUE = Const(-97979797)
+
+
 ZERO = Const(0)
 
 
+def walk(exp: Expr) -> Iterator[Expr]:
+    """All the nodes of a tree, without recursion"""
+    work = [exp]
+    while work:
+        node = work.pop()
+        yield node
+        work.extend(reversed(node.children()))
+
+
+def held_register(exp: Expr, context: Context) -> Optional[str]:
+    """The register that already holds the value of a
+    variable or constant, if there is one, so that it can
+    be used as an operand without loading it.
+    """
+    if isinstance(exp, Var):
+        return context.var_register(exp.name)
+    if isinstance(exp, Const):
+        return context.const_register(exp.value())
+    return None
+
+
+def pure(exp: Expr, context: Context) -> bool:
+    """Evaluating exp has no effect but its value, so it
+    may be evaluated before or after its sibling.  Hooked
+    variables like 'in' are not pure, since reading one
+    may take input.
+    """
+    for node in walk(exp):
+        if isinstance(node, Var) and node.name in context.hooks:
+            return False
+        if not isinstance(node, (Var, Const, BinOp, Compare, UnOp, Index)):
+            return False
+    return True
+
+
+def reg_need(exp: Expr) -> int:
+    """About how many registers exp takes to evaluate, by
+    the Sethi-Ullman count:  an operation whose operands
+    need equally many needs one more, while otherwise the
+    operand that needs more can go first and no more are
+    needed.
+    """
+    need = { }
+    for node in reversed(list(walk(exp))):
+        counts = [need[id(child)] for child in node.children()]
+        if isinstance(node, (BinOp, Compare)):
+            left, right = counts
+            need[id(node)] = left + 1 if left == right else max(left, right)
+        else:
+            need[id(node)] = max(counts, default=1)
+    return need[id(exp)]
+
+
+def right_first(left: Expr, right: Expr, context: Context) -> bool:
+    """Whether to evaluate right before left, because it
+    needs more registers and the order cannot be seen.
+    """
+    return pure(left, context) and pure(right, context) and reg_need(right) > reg_need(left)
+
+
 class Var(Expr):
     """A variable has a name and may have a value in the environment."""
 
@@ -99,9 +234,9 @@ class Var(Expr):
 
     def eval(self, env: Env) -> Const:
         """Fetches value from environment."""
-        log.debug("Evaluating {} in Var".format(self))
+        log.debug("Evaluating %s in Var", self)
         val = env.get(self.name)
-        log.debug("Returning {}".format(val))
+        log.debug("Returning %s", val)
         return val
 
     def __repr__(self):
@@ -117,10 +252,26 @@ class Var(Expr):
         """
         log.debug("Generating code for reference to variable {}"
                   .format(self.name))
-        symbol = context.get_var_symbol(self.name)
-        context.add_line("\tLOAD {},{}".format(target, symbol))
+        context.add_var_access("LOAD", target, self.name)
         return
 
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """The variable's own slot, unless it is hooked"""
+        return program.load(self.name)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """The variable's frame slot, unless it is hooked"""
+        hook = env.read_hook(self.name)
+        if hook:
+            return lambda frame: hook()
+        slot = env.frame_slot(self.name)
+        if slot is None:
+            # A global variable, used in a function
+            values = env.outer.values
+            slot = env.outer.slot(self.name)
+            return lambda frame: values[slot]
+        return itemgetter(slot)
+
 
 # noinspection PyAbstractClass
 class Control(Expr):
@@ -164,6 +315,65 @@ class Seq(Control):
         self.left.gen(context, target)
         self.right.gen(context, target)
 
+    def gen_bytecode(self, program: bytecode.Program):
+        """Just the statements in order"""
+        self.left.gen_bytecode(program)
+        self.right.gen_bytecode(program)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """Just the statements in order"""
+        left = self.left.closure(env)
+        right = self.right.closure(env)
+
+        def seq(frame: List[int]):
+            left(frame)
+            right(frame)
+        return seq
+
+
+class Block(Control):
+    """A list of statements.  Unlike nested Seq nodes, a
+    long block does not make the tree deep, so the methods
+    below loop rather than recurse.
+    """
+
+    def __init__(self, stmts: List[Expr]):
+        self.stmts = stmts
+
+    def __repr__(self):
+        return "Block({})".format(repr(self.stmts))
+
+    def __str__(self):
+        return "{{\n{} }}".format("\n".join(str(stmt) for stmt in self.stmts))
+
+    def eval(self, env: Env) -> Const:
+        """Just evaluate in order"""
+        for stmt in self.stmts:
+            stmt.eval(env)
+        return NO_VALUE
+
+    def gen(self, context: Context, target: str):
+        """Just execute the statements in order.
+        Discard the results, if any.
+        """
+        log.debug("Generating code for block")
+        for stmt in self.stmts:
+            stmt.gen(context, target)
+
+    def gen_bytecode(self, program: bytecode.Program):
+        """Just the statements in order"""
+        for stmt in self.stmts:
+            stmt.gen_bytecode(program)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """Just the statements in order"""
+        stmts = tuple(stmt.closure(env) for stmt in self.stmts)
+
+        def block(frame: List[int]):
+            for stmt in stmts:
+                stmt(frame)
+        return block
+
 
 class While(Control):
     """Classic while loop; in postfix we will write
@@ -190,20 +400,162 @@ class While(Control):
         return Const(0)
 
     def gen(self, context: Context, target: str):
-        """Translate 'while' loop into explicit jumps.
+        """Translate 'while' loop into explicit jumps, after
+        the optional loop optimizations:  loads of invariant
+        values are hoisted into registers held for the whole
+        loop, and a counted loop is unrolled, leaving the
+        plain loop to run the remaining iterations.
         """
+        held = self._hoist(context, target) if context.hoist else [ ]
+        self._gen_loops(context, target)
+        for table, key, reg in reversed(held):
+            del table[key]
+            context.free_reg(reg)
+
+    def _gen_loops(self, context: Context, target: str):
+        """The unrolled loop, if any, then the plain loop"""
+        counter = self._counter(context) if context.unroll > 1 else None
+        if counter:
+            self._gen_unrolled(context, target, *counter)
+        self._gen_loop(context, target)
+
+    def _gen_loop(self, context: Context, target: str):
+        """The loop itself, testing the condition each time"""
         loop_head = context.new_label("loop")
         loop_exit = context.new_label("endloop")
-        context.add_line("{}:  #While loop".format(loop_head))
-        reg = context.alloc_reg()
-        self.cond.gen(context, target=reg)
-        # Is it zero?
-        context.add_line("\tSUB  r0,{},r0 ".format(reg))
-        context.add_line("\tJUMP/Z {}".format(loop_exit))
-        context.free_reg(reg)
+        context.add_label(loop_head, "While loop")
+        self.cond.gen_branch(context, loop_exit)
         self.expr.gen(context, target)
-        context.add_line("\tJUMP {}".format(loop_head))
-        context.add_line("{}: ".format(loop_exit))
+        context.add_instr("JUMP", symbol=loop_head)
+        context.add_label(loop_exit)
+
+    def _counter(self, context: Context) -> Optional[tuple]:
+        """If this is a loop that counts a variable down,
+            while x do ... x = x - k ; od
+        (or 'while x != 0' or 'while x > 0'), with no other
+        assignment to x and no nested loop, returns the name
+        of x and the step k.  Such a loop continues at least
+        while x >= 1, which is what unrolling relies on.
+        Functions cannot assign to the caller's variables, so
+        calls in the body cannot change x.
+        """
+        cond = self.cond
+        if isinstance(cond, (NotEquals, Greater)) and cond.right == ZERO:
+            cond = cond.left
+        if not isinstance(cond, Var) or cond.name in context.hooks:
+            return None
+        name = cond.name
+        if not isinstance(self.expr, Block):
+            return None
+        last = self.expr.stmts[-1]
+        if not (isinstance(last, Assign) and last.var.name == name
+                and isinstance(last.expr, Minus)
+                and isinstance(last.expr.left, Var) and last.expr.left.name == name
+                and isinstance(last.expr.right, Const) and last.expr.right.value() > 0):
+            return None
+        for stmt in self.expr.stmts[:-1]:
+            for node in walk(stmt):
+                if isinstance(node, While):
+                    return None
+                if isinstance(node, Assign) and node.var.name == name:
+                    return None
+        return name, last.expr.right.value()
+
+    def _gen_unrolled(self, context: Context, target: str, counter: str, step: int):
+        """While the counter is at least factor * step, the
+        body can run factor times with no test in between.
+        """
+        factor = context.unroll
+        if factor * step > OFFSET_MAX:
+            return
+        unrolled_head = context.new_label("unrolled")
+        remainder = context.new_label("remainder")
+        context.add_label(unrolled_head, "While loop unrolled {} times".format(factor))
+        reg = context.var_register(counter)
+        if reg is None:
+            reg = context.alloc_reg()
+            context.add_var_access("LOAD", reg, counter)
+            context.free_reg(reg)
+        context.add_instr("SUB", "r0", reg, "r0", factor * step)
+        context.add_instr("JUMP", cond="M", symbol=remainder)
+        for i in range(factor):
+            self.expr.gen(context, target)
+        context.add_instr("JUMP", symbol=unrolled_head)
+        context.add_label(remainder)
+
+    def _hoist(self, context: Context, target: str) -> list:
+        """Load invariant variables and constants used in the
+        loop into registers, most used first, as many as still
+        leave the loop enough registers, as measured with the
+        values held.  Returns what is held, as (table, key,
+        register) to be released after the loop.
+        """
+        assigned = {node.var.name for node in walk(self) if isinstance(node, Assign)}
+        # Constants that become offsets need no register
+        immediate = set()
+        uses = { }
+        for node in walk(self):
+            if isinstance(node, Compare) and isinstance(node.right, Const):
+                immediate.add(id(node.right))
+            elif isinstance(node, (Index, IndexAssign)):
+                immediate.update(id(part) for part in walk(node.index) if isinstance(part, Const))
+            elif isinstance(node, Var):
+                if (node.name not in assigned and node.name not in context.hooks
+                        and context.var_register(node.name) is None):
+                    uses[("var", node.name)] = uses.get(("var", node.name), 0) + 1
+            elif isinstance(node, Const) and id(node) not in immediate:
+                if context.const_register(node.value()) is None:
+                    uses[("const", node.value())] = uses.get(("const", node.value()), 0) + 1
+        ranked = sorted(uses, key=lambda use: - uses[use])
+        count = min(HOIST_MAX, len(ranked))
+
+        def trial():
+            self._hold(context, ranked[:count])
+            self._gen_loops(context, target)
+        while count and context.cur_reg + context.measure(trial) > context.max_reg:
+            count -= 1
+        return self._hold(context, ranked[:count])
+
+    def _hold(self, context: Context, chosen: list) -> list:
+        """Load the chosen variables and constants into new
+        registers, as (table, key, register)
+        """
+        held = [ ]
+        for kind, key in chosen:
+            reg = context.alloc_reg()
+            if kind == "var":
+                context.add_var_access("LOAD", reg, key)
+                table = context.held_vars
+            else:
+                Const(key).gen(context, reg)
+                table = context.held_consts
+            table[key] = reg
+            held.append((table, key, reg))
+        return held
+
+    def gen_bytecode(self, program: bytecode.Program):
+        """Test at the head of the loop, jump back at the end"""
+        loop_head = program.here()
+        cond = self.cond.gen_bytecode(program)
+        exit_jump = program.emit(bytecode.JUMPZ, 0, cond)
+        self.expr.gen_bytecode(program)
+        program.emit(bytecode.JUMP, loop_head)
+        program.patch(exit_jump, program.here())
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """A Python while loop"""
+        cond = self.cond.closure(env)
+        body = self.expr.closure(env)
+
+        def loop(frame: List[int]):
+            while cond(frame) != 0:
+                body(frame)
+        return loop
+
+
+# At most this many values are hoisted out of a loop, since
+# each held register is saved and restored around calls
+HOIST_MAX = 4
 
 
 class Pass(Control):
@@ -232,6 +584,14 @@ class Pass(Control):
         """
         return
 
+    def gen_bytecode(self, program: bytecode.Program):
+        """Nothing to see here"""
+        return
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """Does nothing"""
+        return lambda frame: None
+
 
 class If(Control):
     """If with optional Else (no elif)"""
@@ -276,18 +636,39 @@ class If(Control):
         # free register
         endif_part = context.new_label("endif")
         else_part = context.new_label("elsepart")
-        target_reg = context.alloc_reg()
-        self.cond.gen(context, target=target_reg)
-        context.add_line("\tSUB  r0,{},r0 ".format(target_reg))
-        context.add_line("\tJUMP/Z {}".format(else_part))
-        context.free_reg(target_reg)
+        self.cond.gen_branch(context, else_part)
         self.thenpart.gen(context, target)
-        context.add_line("\tJUMP {}".format(endif_part))
-        context.add_line("{}: ".format(else_part))
+        context.add_instr("JUMP", symbol=endif_part)
+        context.add_label(else_part)
         self.elsepart.gen(context, target)
-        context.add_line("{}: ".format(endif_part))
+        context.add_label(endif_part)
         return
 
+    def gen_bytecode(self, program: bytecode.Program):
+        """Jump over the 'then' part if the condition is zero,
+        and over the 'else' part at the end of the 'then' part.
+        """
+        cond = self.cond.gen_bytecode(program)
+        else_jump = program.emit(bytecode.JUMPZ, 0, cond)
+        self.thenpart.gen_bytecode(program)
+        endif_jump = program.emit(bytecode.JUMP)
+        program.patch(else_jump, program.here())
+        self.elsepart.gen_bytecode(program)
+        program.patch(endif_jump, program.here())
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """A Python if statement"""
+        cond = self.cond.closure(env)
+        thenpart = self.thenpart.closure(env)
+        elsepart = self.elsepart.closure(env)
+
+        def if_else(frame: List[int]):
+            if cond(frame) != 0:
+                thenpart(frame)
+            else:
+                elsepart(frame)
+        return if_else
+
 
 class Assign(Expr):
     """x = Expr.  Evaluated for side-effect;
@@ -309,7 +690,7 @@ class Assign(Expr):
 
     def eval(self, env: Env) -> Const:
         """Stores value of expr (evaluated) in environment"""
-        log.debug("Evaluating {} in Assign".format(self))
+        log.debug("Evaluating %s in Assign", self)
         val = self.expr.eval(env)
         env.put(self.var.name, val)
         return NO_VALUE
@@ -319,9 +700,42 @@ class Assign(Expr):
         then store into memory
         """
         log.debug("Generating code for assignment")
-        var_symbol = context.get_var_symbol(self.var.name)
         self.expr.gen(context, target)
-        context.add_line("\tSTORE  {},{}".format(target, var_symbol))
+        context.add_var_access("STORE", target, self.var.name)
+
+    def gen_bytecode(self, program: bytecode.Program):
+        """Calculate, then store into the variable"""
+        value = self.expr.gen_bytecode(program)
+        program.store(self.var.name, value)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """Store into the variable's frame slot, and send
+        the value to its hook if it has one.
+        """
+        slot = env.frame_slot(self.var.name)
+        value = self.expr.closure(env)
+        hook = env.write_hook(self.var.name)
+        if slot is None:
+            # A global variable, assigned in a function
+            values = env.outer.values
+            slot = env.outer.slot(self.var.name)
+
+            def assign_global(frame: List[int]):
+                val = value(frame)
+                values[slot] = val
+                if hook:
+                    hook(val)
+            return assign_global
+        if hook:
+            def assign_hooked(frame: List[int]):
+                val = value(frame)
+                frame[slot] = val
+                hook(val)
+            return assign_hooked
+
+        def assign(frame: List[int]):
+            frame[slot] = value(frame)
+        return assign
 
 
 class BinOp(Expr):
@@ -340,18 +754,33 @@ class BinOp(Expr):
             and self.left == other.left \
             and self.right == other.right
 
+    def _chain(self) -> tuple:
+        """A left operand like a - b - c is itself a BinOp.
+        Returns the leftmost operand that is not, and the
+        chain of BinOp nodes above it, innermost first, so
+        that long chains can be walked in a loop.
+        """
+        chain = [ ]
+        node = self
+        while isinstance(node, BinOp):
+            chain.append(node)
+            node = node.left
+        chain.reverse()
+        return node, chain
+
     def eval(self, env: Env) -> Const:
         """Evaluation strategy for binary operations
         that apply to numbers and produce numbers.
         """
-        log.debug("Evaluating {} in BinOp".format(self))
-        lval = self.left.eval(env)
-        assert isinstance(lval, Const), "Op {} applies to numbers, not to {}".format(type(self).__name__, lval)
-        lval_n = lval.value()
-        rval = self.right.eval(env)
-        assert isinstance(lval, Const), "Op {} applies to numbers, not to {}".format(type(self).__name__, rval)
-        rval_n = rval.value()
-        return Const(self._apply(lval_n, rval_n))
+        log.debug("Evaluating %s in BinOp", self)
+        first, chain = self._chain()
+        lval = first.eval(env)
+        for op in chain:
+            assert isinstance(lval, Const), "Op {} applies to numbers, not to {}".format(type(op).__name__, lval)
+            rval = op.right.eval(env)
+            assert isinstance(rval, Const), "Op {} applies to numbers, not to {}".format(type(op).__name__, rval)
+            lval = Const(op._apply(lval.value(), rval.value()))
+        return lval
 
     def _apply(self, left: int, right: int) -> int:
         """Apply operation to numeric values.  Each concrete
@@ -380,21 +809,91 @@ class BinOp(Expr):
         #    operation code.
         #    After generating code for this operation, be sure to
         #    free the register you allocated for the right operand.
-        log.debug("Code gen on {} into {}".format(self, target))
-        # recursivily generates code from the left operand
-        self.left.gen(context, target=target)
-        # allocates a single register for the right operand
-        right_register = context.alloc_reg()
-        log.debug("Allocated register {}".format(right_register))
-        # recursively generates code from the newly allocated register
-        # get the operation code from the _opcode function
-        self.right.gen(context, target=right_register)
-        # generates the instruction from the opcode and registers
-        context.add_line("\t{} {},{},{}".format(self._opcode(), target, target, right_register))
-        # frees the allocated target register
-        context.free_reg(right_register)
+        #    A chain of left-nested operations like a - b - c
+        #    is generated in a loop, innermost operation first.
+        #    A right operand already held in a register is
+        #    used directly.  A right operand that needs more
+        #    registers than the left goes first, into the target,
+        #    so that a + (b + (c + ...)) does not take a register
+        #    per level.
+        log.debug("Code gen on %s into %s", self, target)
+        first, chain = self._chain()
+        op = chain[0]
+        if held_register(op.right, context) is None and right_first(first, op.right, context):
+            op.right.gen(context, target=target)
+            left_register = held_register(first, context)
+            allocated = left_register is None
+            if allocated:
+                left_register = context.alloc_reg()
+                first.gen(context, target=left_register)
+            context.add_instr(op._opcode(), target, left_register, target)
+            if allocated:
+                context.free_reg(left_register)
+            chain = chain[1:]
+        else:
+            # generates code for the leftmost operand into the target
+            first.gen(context, target=target)
+        for op in chain:
+            held = held_register(op.right, context)
+            if held:
+                context.add_instr(op._opcode(), target, target, held)
+                continue
+            # allocates a single register for the right operand
+            right_register = context.alloc_reg()
+            log.debug("Allocated register %s", right_register)
+            # recursively generates code into the newly allocated register
+            op.right.gen(context, target=right_register)
+            # generates the instruction from the opcode and registers
+            context.add_instr(op._opcode(), target, target, right_register)
+            # frees the allocated target register
+            context.free_reg(right_register)
         return
 
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """Both operands, then the operation named by the
+        same _opcode used for code generation, into a new
+        temporary slot.
+        """
+        first, chain = self._chain()
+        result = first.gen_bytecode(program)
+        for op in chain:
+            left = result
+            right = op.right.gen_bytecode(program)
+            result = program.temp_slot()
+            program.emit(bytecode.ALU_OPS[op._opcode()], result, left, right)
+        return result
+
+    # Closure builders by the same _opcode used for code generation,
+    # so that the concrete subclasses can share one closure method.
+    _CLOSURES = {
+        "ADD": lambda left, right: lambda frame: left(frame) + right(frame),
+        "SUB": lambda left, right: lambda frame: left(frame) - right(frame),
+        "MUL": lambda left, right: lambda frame: left(frame) * right(frame),
+        "DIV": lambda left, right: lambda frame: left(frame) // right(frame)
+    }
+
+    # The operations themselves, for chains
+    _OPERATIONS = {"ADD": add, "SUB": sub, "MUL": mul, "DIV": floordiv}
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Apply the operation directly to the ints
+        produced by the operand closures.  A chain like
+        a - b - c is one closure that applies each operation
+        in a loop, so that long chains do not nest calls.
+        """
+        first, chain = self._chain()
+        left = first.closure(env)
+        if len(chain) == 1:
+            return self._CLOSURES[self._opcode()](left, self.right.closure(env))
+        steps = [(self._OPERATIONS[op._opcode()], op.right.closure(env)) for op in chain]
+
+        def apply_chain(frame: List[int]) -> int:
+            val = left(frame)
+            for operation, right in steps:
+                val = operation(val, right(frame))
+            return val
+        return apply_chain
+
     def _opcode(self):
         """Each operation that inherits gen must provide the opcode
         to be used in the instruction.
@@ -483,6 +982,763 @@ class Div(BinOp):
         return "DIV"
 
 
+class Compare(Expr):
+    """Abstract superclass for comparisons like less than.
+    The value of a comparison is 1 if it is true, 0 if false.
+    """
+
+    # For code generation, each concrete subclass gives its
+    # operator symbol, the offset k for which 'SUB r0,left,right[k]'
+    # (that is, left - (right + k)) sets a condition code that
+    # decides it, and the condition codes for which it is false.
+    # Thus left < right is false when left - (right - 1) is positive.
+    _symbol = None
+    _offset = 0
+    _false_conds = [ ]
+
+    def __init__(self, left: Expr, right: Expr):
+        """A comparison has a left and right sub-expression"""
+        assert isinstance(left, Expr)
+        assert isinstance(right, Expr)
+        self.left = left
+        self.right = right
+
+    def __eq__(self, other):
+        """Identical expression"""
+        return type(self) == type(other) \
+            and self.left == other.left \
+            and self.right == other.right
+
+    def __repr__(self):
+        return "{}({},{})".format(type(self).__name__, repr(self.left), repr(self.right))
+
+    def __str__(self):
+        """Print fully parenthesized"""
+        return "({} {} {})".format(self.left, self._symbol, self.right)
+
+    def _apply(self, left: int, right: int) -> bool:
+        """Each concrete subclass must define the comparison"""
+        raise NotImplementedError(
+            "Class {} has not defined its _apply method".format(type(self)))
+
+    def eval(self, env: Env) -> Const:
+        """1 if the comparison holds, else 0"""
+        lval = self.left.eval(env)
+        rval = self.right.eval(env)
+        return Const(1 if self._apply(lval.value(), rval.value()) else 0)
+
+    def gen_branch(self, context: Context, false_label: str, work: Optional[str] = None):
+        """Subtract and jump on the condition code, without
+        computing 0 or 1.  A constant right operand that fits
+        in the offset field needs no register, nor does an
+        operand already held in one.  The operand that needs
+        more registers is computed first.  The left operand
+        may be computed in a given work register.
+        """
+        right_reg = None
+        allocated = [ ]
+        if held_register(self.right, context) is None and right_first(self.left, self.right, context):
+            right_reg = context.alloc_reg()
+            allocated.append(right_reg)
+            self.right.gen(context, target=right_reg)
+        left_reg = held_register(self.left, context)
+        if left_reg is None:
+            left_reg = work
+            if left_reg is None:
+                left_reg = context.alloc_reg()
+                allocated.append(left_reg)
+            self.left.gen(context, target=left_reg)
+        if right_reg:
+            context.add_instr("SUB", "r0", left_reg, right_reg, offset=self._offset)
+        elif (isinstance(self.right, Const)
+                and OFFSET_MIN <= self.right.value() + self._offset <= OFFSET_MAX):
+            context.add_instr("SUB", "r0", left_reg, "r0",
+                              offset=self.right.value() + self._offset)
+        else:
+            right_reg = held_register(self.right, context)
+            if right_reg is None:
+                right_reg = context.alloc_reg()
+                allocated.append(right_reg)
+                self.right.gen(context, target=right_reg)
+            context.add_instr("SUB", "r0", left_reg, right_reg, offset=self._offset)
+        for cond in self._false_conds:
+            context.add_instr("JUMP", cond=cond, symbol=false_label)
+        for reg in reversed(allocated):
+            context.free_reg(reg)
+
+    def gen(self, context: Context, target: str):
+        """A comparison used as a value is 1 unless the
+        branch for a false comparison is taken.  The left
+        operand is computed in the target, so the value is
+        set only after the branch.
+        """
+        false_label = context.new_label("false")
+        end_label = context.new_label("endcmp")
+        self.gen_branch(context, false_label, work=target)
+        context.add_instr("ADD", target, "r0", "r0", offset=1)
+        context.add_instr("JUMP", symbol=end_label)
+        context.add_label(false_label)
+        context.add_instr("ADD", target, "r0", "r0", offset=0)
+        context.add_label(end_label)
+
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """Comparison into a new temporary slot"""
+        left = self.left.gen_bytecode(program)
+        right = self.right.gen_bytecode(program)
+        result = program.temp_slot()
+        program.emit(bytecode.CMP_OPS[self._symbol], result, left, right)
+        return result
+
+    # Closure builders by operator symbol
+    _CLOSURES = {
+        "<": lambda left, right: lambda frame: 1 if left(frame) < right(frame) else 0,
+        "<=": lambda left, right: lambda frame: 1 if left(frame) <= right(frame) else 0,
+        "==": lambda left, right: lambda frame: 1 if left(frame) == right(frame) else 0,
+        "!=": lambda left, right: lambda frame: 1 if left(frame) != right(frame) else 0,
+        ">=": lambda left, right: lambda frame: 1 if left(frame) >= right(frame) else 0,
+        ">": lambda left, right: lambda frame: 1 if left(frame) > right(frame) else 0
+    }
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Compare the ints produced by the operand closures"""
+        left = self.left.closure(env)
+        right = self.right.closure(env)
+        return self._CLOSURES[self._symbol](left, right)
+
+
+class Less(Compare):
+    """left < right"""
+    _symbol = "<"
+    _offset = -1
+    _false_conds = ["P"]
+
+    def _apply(self, left: int, right: int) -> bool:
+        return left < right
+
+
+class LessEq(Compare):
+    """left <= right"""
+    _symbol = "<="
+    _offset = 0
+    _false_conds = ["P"]
+
+    def _apply(self, left: int, right: int) -> bool:
+        return left <= right
+
+
+class Equals(Compare):
+    """left == right"""
+    _symbol = "=="
+    _offset = 0
+    _false_conds = ["M", "P"]
+
+    def _apply(self, left: int, right: int) -> bool:
+        return left == right
+
+
+class NotEquals(Compare):
+    """left != right"""
+    _symbol = "!="
+    _offset = 0
+    _false_conds = ["Z"]
+
+    def _apply(self, left: int, right: int) -> bool:
+        return left != right
+
+
+class GreaterEq(Compare):
+    """left >= right"""
+    _symbol = ">="
+    _offset = 0
+    _false_conds = ["M"]
+
+    def _apply(self, left: int, right: int) -> bool:
+        return left >= right
+
+
+class Greater(Compare):
+    """left > right"""
+    _symbol = ">"
+    _offset = 1
+    _false_conds = ["M"]
+
+    def _apply(self, left: int, right: int) -> bool:
+        return left > right
+
+
+# Parameters are passed in registers r1 .. r6
+MAX_PARAMS = 6
+# A function with no calls keeps up to this many parameters
+# and local variables in registers, with no stack frame, if
+# the registers left are enough for its body
+LEAF_REGS = 8
+
+
+class ReturnValue(Exception):
+    """Raised by a return statement in the interpreter,
+    to be caught by the Call.
+    """
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+
+class Program(Control):
+    """A main block with function definitions and
+    array declarations (sizes by name).
+    """
+
+    def __init__(self, body: Expr, functions: Dict[str, "FunctionDef"],
+                 arrays: Dict[str, int] = None):
+        self.body = body
+        self.functions = functions
+        self.arrays = arrays or { }
+
+    def children(self) -> List[Expr]:
+        return [self.body] + list(self.functions.values())
+
+    def __repr__(self):
+        return "Program({},{},{})".format(repr(self.body), repr(self.functions), self.arrays)
+
+    def __str__(self):
+        decls = ["array {} [ {} ]".format(name, size) for name, size in self.arrays.items()]
+        return "{}\n{}".format("\n".join(decls + [str(func) for func in self.functions.values()]),
+                               self.body)
+
+    def eval(self, env: Env) -> Const:
+        """Calls find their functions directly"""
+        for name, size in self.arrays.items():
+            env.declare_array(name, size, ZERO)
+        return self.body.eval(env)
+
+    def gen(self, context: Context, target: str):
+        """The main block.  Functions are generated after
+        the end of the main program.
+        """
+        for name, size in self.arrays.items():
+            context.declare_array(name, size)
+        context.functions.update(self.functions)
+        if self.functions:
+            context.reserve_call_regs()
+            context.add_instr("ADD", STACK_REG, "r0", "r0", STACK_TOP, comment="Stack pointer")
+        self.body.gen(context, target)
+
+    def gen_bytecode(self, program: bytecode.Program):
+        """The main block, then a jump past the functions"""
+        for name, size in self.arrays.items():
+            program.declare_array(name, size)
+        self.body.gen_bytecode(program)
+        if not self.functions:
+            return
+        end_jump = program.emit(bytecode.JUMP)
+        for func in self.functions.values():
+            func.gen_bytecode_function(program)
+        program.patch(end_jump, program.here())
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """Functions are compiled when calls to them are.
+        Arrays are created now, since closures refer to them.
+        """
+        for name, size in self.arrays.items():
+            env.declare_array(name, size, 0)
+        return self.body.closure(env)
+
+
+class FunctionDef(Expr):
+    """def name ( params ) do body od"""
+
+    def __init__(self, name: str, params: List[str], body: Expr):
+        self.name = name
+        self.params = params
+        self.body = body
+        self.assigned = [ ]
+        self.leaf = True
+        for node in walk(body):
+            if isinstance(node, Assign) and node.var.name not in self.assigned:
+                self.assigned.append(node.var.name)
+            elif isinstance(node, Call):
+                self.leaf = False
+
+    def __repr__(self):
+        return "FunctionDef('{}',{},{})".format(self.name, self.params, repr(self.body))
+
+    def __str__(self):
+        return "def {} ( {} ) do\n{}\nod".format(self.name, " , ".join(self.params), self.body)
+
+    def label(self) -> str:
+        """Label of the function's code.  Generated labels
+        always end in _ and a number, so this is unique.
+        """
+        return "fn_{}".format(self.name)
+
+    def local_names(self, hooked: Container[str]) -> List[str]:
+        """Names of the local variables, parameters first.
+        Hooked variables (in, out) are always global.
+        """
+        return self.params + [name for name in self.assigned
+                              if name not in self.params and name not in hooked]
+
+    def gen_function(self, context: Context):
+        """Code for the function body, called with the return
+        address in LINK_REG and the arguments in r1, r2, ...
+        Locals of a leaf function stay in registers, if enough
+        are left for the body; otherwise they are kept in a
+        stack frame, with the return address.
+        """
+        local_names = self.local_names(context.hooks)
+        context.return_label = context.new_label("return")
+        leaf = self.leaf and len(local_names) <= LEAF_REGS
+        if leaf:
+            leaf = len(local_names) + context.measure(
+                lambda: self._gen_leaf_body(context, local_names)) <= context.max_reg
+        context.add_label(self.label(), "Function {}".format(self.name))
+        if leaf:
+            self._gen_leaf_body(context, local_names)
+        else:
+            frame_size = len(local_names) + 1
+            context.begin_frame(self.name, frame_size)
+            context.scope = {name: i + 1 for i, name in enumerate(local_names)}
+            context.add_instr("SUB", STACK_REG, STACK_REG, "r0", frame_size)
+            context.add_instr("STORE", LINK_REG, STACK_REG, "r0", 0)
+            for i, param in enumerate(self.params):
+                context.add_instr("STORE", "r{}".format(i + 1), STACK_REG, "r0", i + 1)
+            work_register = context.alloc_reg()
+            self.body.gen(context, work_register)
+            context.free_reg(work_register)
+        context.add_instr("ADD", "r1", "r0", "r0", comment="No return value")
+        context.add_label(context.return_label)
+        if not leaf:
+            context.add_instr("LOAD", LINK_REG, STACK_REG, "r0", 0)
+            context.add_instr("ADD", STACK_REG, STACK_REG, "r0", frame_size)
+        context.add_instr("ADD", "r15", LINK_REG, "r0", comment="Return")
+        context.scope = None
+        context.return_label = None
+        context.function = None
+        context.cur_reg = 0
+
+    def _gen_leaf_body(self, context: Context, local_names: List[str]):
+        """The body of a leaf function, with its locals in
+        registers r1, r2, ...
+        """
+        context.begin_frame(self.name, 0)
+        context.scope = {name: "r{}".format(i + 1) for i, name in enumerate(local_names)}
+        context.cur_reg = len(local_names)
+        work_register = context.alloc_reg()
+        self.body.gen(context, work_register)
+        context.free_reg(work_register)
+
+    def gen_bytecode_function(self, program: bytecode.Program):
+        """The function body in its own range of slots"""
+        hooked = set(program.read_hooks) | set(program.write_hooks)
+        local_names = self.local_names(hooked)
+        global_names = [node.name for node in walk(self.body)
+                        if isinstance(node, Var) and node.name not in local_names]
+        program.begin_function(self.name, self.params, local_names, global_names)
+        self.body.gen_bytecode(program)
+        program.emit(bytecode.RET, 0, program.const_slot(0))
+        program.end_function(self.name)
+
+    def compiled(self, env: SlotEnv) -> list:
+        """The closure for the function body and the initial
+        frame for a call, compiled once per global environment.
+        The list is filled in after it is shared, so that
+        recursive calls can refer to it.
+        """
+        if self.name in env.functions:
+            return env.functions[self.name]
+        record = [None, None]
+        env.functions[self.name] = record
+        outer = env.outer if isinstance(env, FrameEnv) else env
+        hooked = set(outer.read_hooks) | set(outer.write_hooks)
+        frame_env = FrameEnv(outer, self.local_names(hooked))
+        record[0] = self.body.closure(frame_env)
+        record[1] = frame_env.values
+        return record
+
+
+class Call(Expr):
+    """name ( args ).  The parser links the call to the
+    FunctionDef, in 'func'.
+    """
+
+    def __init__(self, name: str, args: List[Expr]):
+        self.name = name
+        self.args = args
+        self.func = None
+
+    def children(self) -> List[Expr]:
+        return list(self.args)
+
+    def __repr__(self):
+        return "Call('{}',{})".format(self.name, repr(self.args))
+
+    def __str__(self):
+        return "{}({})".format(self.name, ", ".join(str(arg) for arg in self.args))
+
+    def eval(self, env: Env) -> Const:
+        """Evaluate the body in a new Frame"""
+        vals = [arg.eval(env) for arg in self.args]
+        outer = env.outer if isinstance(env, Frame) else env
+        hooked = set(outer.read_hooks) | set(outer.write_hooks)
+        frame = Frame(outer, self.func.local_names(hooked))
+        for param, val in zip(self.func.params, vals):
+            frame.put(param, val)
+        try:
+            self.func.body.eval(frame)
+        except ReturnValue as result:
+            return result.value
+        return Const(0)
+
+    def gen(self, context: Context, target: str):
+        """Save the registers in use, pass the arguments in
+        r1, r2, ..., and jump to the function with the
+        return address in LINK_REG.  The result is in r1.
+        Registers saved on the stack are reused for the
+        arguments, except those holding hoisted values,
+        which the arguments may read.
+        """
+        saved = [reg for reg in context.live_regs() if reg != target]
+        context.push_regs(saved)
+        in_use = context.cur_reg
+        context.cur_reg = context.held_top()
+        arg_regs = [ ]
+        for arg in self.args:
+            reg = context.alloc_reg()
+            arg.gen(context, reg)
+            arg_regs.append(reg)
+        # Each argument register is above the parameter register
+        # it moves to, so moving in order overwrites nothing needed.
+        for i, reg in enumerate(arg_regs):
+            param_reg = "r{}".format(i + 1)
+            if reg != param_reg:
+                context.add_instr("ADD", param_reg, reg, "r0")
+        context.note_call(self.name)
+        context.add_instr("ADD", LINK_REG, "r15", "r0", 2, comment="Call {}".format(self.name))
+        context.add_instr("JUMP", symbol=self.func.label())
+        for reg in reversed(arg_regs):
+            context.free_reg(reg)
+        context.cur_reg = in_use
+        if target != "r1":
+            context.add_instr("ADD", target, "r1", "r0")
+        context.pop_regs(saved)
+
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """The arguments, then a CALL"""
+        args = [arg.gen_bytecode(program) for arg in self.args]
+        return program.call(self.name, args)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Run the body closure on a fresh frame of locals,
+        with the arguments in the first slots.
+        """
+        args = [arg.closure(env) for arg in self.args]
+        record = self.func.compiled(env)
+        nparams = len(args)
+
+        def call(frame: List[int]) -> int:
+            vals = [arg(frame) for arg in args]
+            body, initial = record
+            local_frame = initial.copy()
+            local_frame[:nparams] = vals
+            try:
+                body(local_frame)
+            except ReturnValue as result:
+                return result.value
+            return 0
+        return call
+
+
+class Return(Control):
+    """return exp ;   (only in a function body)"""
+
+    def __init__(self, expr: Expr):
+        self.expr = expr
+
+    def __repr__(self):
+        return "Return({})".format(repr(self.expr))
+
+    def __str__(self):
+        return "return {}".format(self.expr)
+
+    def eval(self, env: Env) -> Const:
+        raise ReturnValue(self.expr.eval(env))
+
+    def gen(self, context: Context, target: str):
+        """Result in r1, then jump to the return code"""
+        self.expr.gen(context, target)
+        if target != "r1":
+            context.add_instr("ADD", "r1", target, "r0")
+        context.add_instr("JUMP", symbol=context.return_label)
+
+    def gen_bytecode(self, program: bytecode.Program):
+        program.emit(bytecode.RET, 0, self.expr.gen_bytecode(program))
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        value = self.expr.closure(env)
+
+        def ret(frame: List[int]):
+            raise ReturnValue(value(frame))
+        return ret
+
+
+# Fill and copy of arrays up to this size are unrolled
+BULK_UNROLL = 4
+
+
+def check_index(name: str, i: int, size: int) -> int:
+    """The index, if it is in range for the array"""
+    if not 0 <= i < size:
+        raise IndexError("Index {} out of range for array {} of size {}".format(i, name, size))
+    return i
+
+
+def index_parts(index: Expr, size: int) -> tuple:
+    """An index as a variable part and a constant displacement,
+    for code generation:  a [ i + 1 ] is element i of the array
+    starting one word later, so the addition costs nothing.
+    The variable part is None for a constant index.  Only
+    displacements smaller than the array are split off, which
+    keeps the addresses in range of the offset field.
+    """
+    if isinstance(index, Const) and 0 <= index.value() < size:
+        return None, index.value()
+    part = index
+    displacement = 0
+    while isinstance(part, (Plus, Minus)) and isinstance(part.right, Const):
+        k = part.right.value() if isinstance(part, Plus) else - part.right.value()
+        if not - size < displacement + k < size:
+            break
+        displacement += k
+        part = part.left
+    return part, displacement
+
+
+class Index(Expr):
+    """name [ index ], an element of an array"""
+
+    def __init__(self, name: str, index: Expr):
+        assert isinstance(index, Expr)
+        self.name = name
+        self.index = index
+
+    def __repr__(self):
+        return "Index('{}',{})".format(self.name, repr(self.index))
+
+    def __str__(self):
+        return "{}[{}]".format(self.name, self.index)
+
+    def eval(self, env: Env) -> Const:
+        values = env.array(self.name)
+        i = self.index.eval(env).value()
+        return values[check_index(self.name, i, len(values))]
+
+    def gen(self, context: Context, target: str):
+        """The index is computed in the target register,
+        which then addresses the element, unless the index
+        is constant or already held in a register.
+        """
+        part, offset = index_parts(self.index, context.array_size(self.name))
+        if part is None:
+            index_reg = "r0"
+        elif held_register(part, context):
+            index_reg = held_register(part, context)
+        else:
+            part.gen(context, target)
+            index_reg = target
+        context.add_element_access("LOAD", target, self.name, index_reg, offset)
+
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """Indexed load into a new temporary slot"""
+        index = self.index.gen_bytecode(program)
+        result = program.temp_slot()
+        program.emit(bytecode.LOADX, result, program.arrays[self.name], index)
+        return result
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Index the array's list directly"""
+        name = self.name
+        values = env.array(name)
+        size = len(values)
+        index = self.index.closure(env)
+
+        def load(frame: List[int]) -> int:
+            i = index(frame)
+            if 0 <= i < size:
+                return values[i]
+            return values[check_index(name, i, size)]
+        return load
+
+
+class IndexAssign(Expr):
+    """name [ index ] = expr.  The index is evaluated first."""
+
+    def __init__(self, name: str, index: Expr, expr: Expr):
+        assert isinstance(index, Expr)
+        assert isinstance(expr, Expr)
+        self.name = name
+        self.index = index
+        self.expr = expr
+
+    def __repr__(self):
+        return "IndexAssign('{}',{},{})".format(self.name, repr(self.index), repr(self.expr))
+
+    def __str__(self):
+        return "let {}[{}] = {}".format(self.name, self.index, self.expr)
+
+    def eval(self, env: Env) -> Const:
+        values = env.array(self.name)
+        i = self.index.eval(env).value()
+        val = self.expr.eval(env)
+        values[check_index(self.name, i, len(values))] = val
+        return NO_VALUE
+
+    def gen(self, context: Context, target: str):
+        """Index into a register of its own, value into
+        the target, then an indexed store.
+        """
+        part, offset = index_parts(self.index, context.array_size(self.name))
+        index_reg = "r0"
+        allocated = None
+        if part is None:
+            pass
+        elif held_register(part, context):
+            index_reg = held_register(part, context)
+        else:
+            allocated = index_reg = context.alloc_reg()
+            part.gen(context, index_reg)
+        self.expr.gen(context, target)
+        context.add_element_access("STORE", target, self.name, index_reg, offset)
+        if allocated:
+            context.free_reg(allocated)
+
+    def gen_bytecode(self, program: bytecode.Program):
+        index = self.index.gen_bytecode(program)
+        value = self.expr.gen_bytecode(program)
+        program.emit(bytecode.STOREX, program.arrays[self.name], index, value)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        """Store into the array's list directly"""
+        name = self.name
+        values = env.array(name)
+        size = len(values)
+        index = self.index.closure(env)
+        value = self.expr.closure(env)
+
+        def store(frame: List[int]):
+            i = index(frame)
+            values[check_index(name, i, size)] = value(frame)
+        return store
+
+
+class Fill(Control):
+    """fill ( name , expr ) sets every element of an array"""
+
+    def __init__(self, name: str, expr: Expr):
+        assert isinstance(expr, Expr)
+        self.name = name
+        self.expr = expr
+
+    def __repr__(self):
+        return "Fill('{}',{})".format(self.name, repr(self.expr))
+
+    def __str__(self):
+        return "fill({}, {})".format(self.name, self.expr)
+
+    def eval(self, env: Env) -> Const:
+        values = env.array(self.name)
+        values[:] = [self.expr.eval(env)] * len(values)
+        return NO_VALUE
+
+    def gen(self, context: Context, target: str):
+        """A small array is filled by one store per element.
+        Otherwise a counter runs down from the size to 1,
+        storing below it; the subtraction sets the condition
+        code for the loop test.
+        """
+        size = context.array_size(self.name)
+        self.expr.gen(context, target)
+        if size <= BULK_UNROLL:
+            for i in range(size):
+                context.add_element_access("STORE", target, self.name, "r0", i)
+            return
+        count = context.alloc_reg()
+        loop_head = context.new_label("fill")
+        context.add_instr("ADD", count, "r0", "r0", size)
+        context.add_label(loop_head)
+        context.add_element_access("STORE", target, self.name, count, -1)
+        context.add_instr("SUB", count, count, "r0", 1)
+        context.add_instr("JUMP", cond="P", symbol=loop_head)
+        context.free_reg(count)
+
+    def gen_bytecode(self, program: bytecode.Program):
+        value = self.expr.gen_bytecode(program)
+        program.emit(bytecode.FILL, program.arrays[self.name], value)
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        values = env.array(self.name)
+        size = len(values)
+        value = self.expr.closure(env)
+
+        def fill(frame: List[int]):
+            values[:] = [value(frame)] * size
+        return fill
+
+
+class Copy(Control):
+    """copy ( target , source ) copies all of the source
+    array to the start of the target array, which is at
+    least as large.
+    """
+
+    def __init__(self, target: str, source: str):
+        self.target = target
+        self.source = source
+
+    def __repr__(self):
+        return "Copy('{}','{}')".format(self.target, self.source)
+
+    def __str__(self):
+        return "copy({}, {})".format(self.target, self.source)
+
+    def eval(self, env: Env) -> Const:
+        source = env.array(self.source)
+        env.array(self.target)[:len(source)] = source
+        return NO_VALUE
+
+    def gen(self, context: Context, target: str):
+        """Like fill, a load and store per element, in a
+        loop unless the source array is small.
+        """
+        size = context.array_size(self.source)
+        if size <= BULK_UNROLL:
+            for i in range(size):
+                context.add_element_access("LOAD", target, self.source, "r0", i)
+                context.add_element_access("STORE", target, self.target, "r0", i)
+            return
+        count = context.alloc_reg()
+        loop_head = context.new_label("copy")
+        context.add_instr("ADD", count, "r0", "r0", size)
+        context.add_label(loop_head)
+        context.add_element_access("LOAD", target, self.source, count, -1)
+        context.add_element_access("STORE", target, self.target, count, -1)
+        context.add_instr("SUB", count, count, "r0", 1)
+        context.add_instr("JUMP", cond="P", symbol=loop_head)
+        context.free_reg(count)
+
+    def gen_bytecode(self, program: bytecode.Program):
+        program.emit(bytecode.COPY, program.arrays[self.target], program.arrays[self.source])
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], None]:
+        source = env.array(self.source)
+        target = env.array(self.target)
+        size = len(source)
+
+        def copy(frame: List[int]):
+            target[:size] = source
+        return copy
+
+
 class UnOp(Expr):
     """Abstract superclass for unary expressions like negation"""
 
@@ -498,7 +1754,7 @@ class UnOp(Expr):
 
     def eval(self, env: Env) -> Const:
         """Evaluation strategy for unary expressions"""
-        log.debug("Evaluating {} in UnOp".format(self))
+        log.debug("Evaluating %s in UnOp", self)
         lval = self.left.eval(env)
         assert isinstance(lval, Const), "Op {} applies to numbers, not to {}".format(
             type(self).__name__, lval)
@@ -509,6 +1765,16 @@ class UnOp(Expr):
         """Each unary operator should provide a code generation method"""
         raise NotImplementedError("Unary operator class {} did not implement gen method".format(type(self).__name__))
 
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """Each unary operator should provide a bytecode generation method"""
+        raise NotImplementedError("Unary operator class {} did not implement gen_bytecode method"
+                                  .format(type(self).__name__))
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Each unary operator should provide a closure method"""
+        raise NotImplementedError("Unary operator class {} did not implement closure method"
+                                  .format(type(self).__name__))
+
     def _apply(self, val: int) -> int:
         raise NotImplementedError("Class {} has not implemented _apply".format(
             type(self).__name__))
@@ -533,5 +1799,17 @@ class Neg(UnOp):
         subtracting from zero.
         """
         self.left.gen(context, target)
-        context.add_line("\tSUB  {},r0,{}".format(target, target))
+        context.add_instr("SUB", target, "r0", target)
         return
+
+    def gen_bytecode(self, program: bytecode.Program) -> int:
+        """Negation into a new temporary slot"""
+        left = self.left.gen_bytecode(program)
+        result = program.temp_slot()
+        program.emit(bytecode.NEG, result, left)
+        return result
+
+    def closure(self, env: SlotEnv) -> Callable[[List[int]], int]:
+        """Negation of the operand's int"""
+        left = self.left.closure(env)
+        return lambda frame: - left(frame)
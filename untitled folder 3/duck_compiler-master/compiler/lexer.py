@@ -1,15 +1,17 @@
 """
 Lexical analysis to convert input file into
 streams of tokens.  Input string must delimit tokens
-by spaces.  
+by spaces.  The whole file is read at once and
+scanned with regular expressions compiled once. 
 
 Based on lexer.py from symbolic calculator project, 
 but modified to read from a file. 
 
 Author: Michal Young (michal@cs.uoregon.edu), March 2018
 """
-from typing import Sequence, TextIO
+from typing import Iterable, Iterator, Sequence, TextIO
 
+import re
 import logging
 
 from compiler import syntax
@@ -29,11 +31,16 @@ class LexicalError(Exception):
 
 
 class Token(object):
-    """One token from the input stream"""
+    """One token from the input stream, with the line
+    and column (both counting from 1) where it starts.
+    """
 
-    def __init__(self, value: any, kind: syntax.TokenCat):
+    def __init__(self, value: any, kind: syntax.TokenCat,
+                 line: int = 0, column: int = 0):
         self.value = value
         self.kind = kind
+        self.line = line
+        self.column = column
 
     def __repr__(self) -> str:
         return "Token({}: {})".format(repr(self.value), self.kind)
@@ -44,80 +51,103 @@ class Token(object):
 
 END = Token("End of Input", syntax.TokenCat.END)
 
+# Tokens are delimited by white space.  A word starting
+# with '#' begins a comment that runs to the end of the line.
+# Newlines are matched separately only to count lines.
+WORDS = re.compile(r"(?P<newline>\n)|(?P<comment>(?<!\S)\#[^\n]*)|(?P<word>\S+)")
+
+
+def _literal(kind: syntax.TokenCat) -> str:
+    """The one word matched by a token category, or None
+    if its pattern matches more than one word.
+    """
+    pattern = kind.value.pattern
+    text = re.sub(r"\\(.)", r"\1", pattern)
+    if kind is not syntax.TokenCat.END and re.escape(text) == pattern:
+        return text
+    return None
+
+
+# Keywords and operators are classified by lookup in one table,
+# built from the fixed-text token categories and the operator
+# symbols in syntax.OPS.
+KEYWORDS = {_literal(kind): kind for kind in syntax.TokenCat
+            if _literal(kind) is not None}
+KEYWORDS.update({sym: kind for sym, (kind, clazz) in syntax.OPS.items()})
+
+# Other words are classified by one pattern with a named group
+# for each remaining category (identifiers and constants).
+TOKEN_PAT = re.compile("|".join("(?P<{}>{})".format(kind.name, kind.value.pattern)
+                                for kind in syntax.TokenCat
+                                if kind is not syntax.TokenCat.END
+                                and _literal(kind) is None))
+
 
 class TokenStream(object):
     """
-    Provides the tokens within a string one-by-one.
+    Provides the tokens within a file one-by-one.
+    The file is read in one piece and lexed lazily by the
+    generator 'tokens', with one token of lookahead, so
+    taking a token is constant time.  Tokens lexed earlier
+    may be given instead of a file.
     """
 
-    def __init__(self, f: TextIO):
+    def __init__(self, f: TextIO, toks: Iterable[Token] = None):
         self.file = f
-        self.tokens = []
-        self._check_fill()
-        log.debug("Tokens: {}".format(self.tokens))
+        if toks is None:
+            self._tokens = tokens(f.read())
+        else:
+            self._tokens = iter(toks)
+        self._next = next(self._tokens, END)
 
     def __str__(self) -> str:
-        return "[{}]".format("|".join(self.tokens))
-
-    def _check_fill(self):
-        while len(self.tokens) == 0:
-            # We could read more than one line before hitting
-            # a token, but the loop will be broken if we
-            # hit end of file
-            line = self.file.readline()
-            if len(line) == 0:
-                # End of file, leave zero tokens in buffer
-                break
-            self.tokens = lex(line.strip())
-            log.debug("Refilled, tokens: {}".format(self.tokens))
-            # Note this might also leave zero tokens in buffer,
-            # but in that case outer while loop will attempt
-            # to refill it until we either get some tokens
-            # or hit end of file
+        return "TokenStream(next={})".format(self._next)
 
     def has_more(self) -> bool:
         """True if there are more tokens in the stream"""
-        self._check_fill()
-        return len(self.tokens) > 0
+        return self._next is not END
 
     def peek(self) -> Token:
         """Examine next token without consuming it. """
-        self._check_fill()
-        if len(self.tokens) > 0:
-            token = self.tokens[0]
-        else:
-            token = END
-        return token
+        return self._next
 
     def take(self) -> Token:
         """Consume next token"""
-        self._check_fill()
-        if len(self.tokens) > 0:
-            token = self.tokens.pop(0)
-        else:
-            token = END
+        token = self._next
+        if token is not END:
+            self._next = next(self._tokens, END)
         return token
 
 
+def tokens(text: str) -> Iterator[Token]:
+    """Generate the Token objects in text, tracking the
+    line and column of each.
+    """
+    line = 1
+    line_start = 0
+    for match in WORDS.finditer(text):
+        kind = match.lastgroup
+        if kind == "newline":
+            line += 1
+            line_start = match.end()
+        elif kind == "word":
+            yield classify(match.group(), line, match.start() - line_start + 1)
+
+
 def lex(s: str) -> Sequence[Token]:
     """Break string into a list of Token objects"""
-    words = s.split()
-    tokens = []
-    for word in words:
-        if word.startswith("#"):
-            break  # Discard comments
-        tokens.append(classify(word))
-    return tokens
+    return list(tokens(s))
 
 
-def classify(word: str) -> Token:
+def classify(word: str, line: int = 0, column: int = 0) -> Token:
     """Convert a textual token into a Token object
     with a value and category.
     """
-    for kind in syntax.TokenCat:
-        log.debug(f"Checking {word} for token class {kind}")
-        pattern = kind.value
-        if pattern.fullmatch(word):
-            log.debug(f"Classified as {kind}")
-            return Token(word, kind)
-    raise LexicalError("Unrecognized token '{}'".format(word))
+    kind = KEYWORDS.get(word)
+    if kind is not None:
+        return Token(word, kind, line, column)
+    match = TOKEN_PAT.fullmatch(word)
+    if match is None:
+        raise LexicalError("Unrecognized token '{}' at line {}, column {}"
+                           .format(word, line, column))
+    return Token(word, syntax.TokenCat[match.lastgroup], line, column)
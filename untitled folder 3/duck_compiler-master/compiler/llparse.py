@@ -2,10 +2,10 @@
 An LL parser (attempt) for CIS 211
 """
 
-from compiler.lexer import TokenStream
+from compiler.lexer import TokenStream, Token
 from compiler import expr
-from compiler.syntax import TokenCat
-from typing import TextIO
+from compiler.syntax import TokenCat, OPS
+from typing import Iterable, TextIO
 
 import logging
 
@@ -25,18 +25,31 @@ def parse(srcfile: TextIO) -> expr.Expr:
     return _program(stream)
 
 
+def parse_tokens(tokens: Iterable[Token]) -> expr.Expr:
+    """Parse tokens lexed earlier"""
+    stream = TokenStream(None, tokens)
+    return _program(stream)
+
+
 #
 # The grammar comes here.  It should follow this ebnf:
 #
-#  program ::=  block
+#  program ::=  { funcdef | arraydecl | stmt }
+#  funcdef ::= 'def' IDENT '(' [ IDENT { ',' IDENT } ] ')' 'do' block 'od'
+#  arraydecl ::= 'array' IDENT '[' CONST ']' ';'
 #  block ::= { stmt }
-#  stmt ::=  assign | loop | ifstmt
+#  stmt ::=  assign | loop | ifstmt | returnstmt | fillstmt | copystmt
+#  returnstmt ::= 'return' exp ';'     (only in a function)
+#  fillstmt ::= 'fill' '(' IDENT ',' exp ')' ';'
+#  copystmt ::= 'copy' '(' IDENT ',' IDENT ')' ';'
 #  whilestmt ::= 'while' exp 'do' block 'od'
 #  ifstmt ::= 'if' exp 'then' block ['else' block] 'fi'
-#  assignment ::=  IDENT '=' exp
-#  exp ::= term { ('+'|'-') term }
+#  assignment ::=  IDENT [ '[' exp ']' ] '=' exp
+#  exp ::= sum [ RELOP sum ]
+#  sum ::= term { ('+'|'-') term }
 #  term ::= primary { ('*'|'/')  primary }
-#  primary ::= IDENT | CONST | '(' exp ')'
+#  primary ::= IDENT | IDENT '[' exp ']' | call | CONST | '(' exp ')'
+#  call ::= IDENT '(' [ exp { ',' exp } ] ')'
 #
 
 # Predictions based on next token:
@@ -44,7 +57,11 @@ first = {}
 first["ifstmt"] = {TokenCat.IF}
 first["whilestmt"] = {TokenCat.WHILE}
 first["assignment"] = {TokenCat.IDENT}
-first["stmt"] = first["ifstmt"].union(first["whilestmt"], first["assignment"])
+first["returnstmt"] = {TokenCat.RETURN}
+first["fillstmt"] = {TokenCat.FILL}
+first["copystmt"] = {TokenCat.COPY}
+first["stmt"] = first["ifstmt"].union(first["whilestmt"], first["assignment"], first["returnstmt"],
+                                      first["fillstmt"], first["copystmt"])
 first["exp"] = {TokenCat.IDENT, TokenCat.CONST}  # Add LPAREN !
 
 
@@ -63,11 +80,112 @@ def require(stream: TokenStream, category: TokenCat, desc: str = "", consume=Fal
 
 def _program(stream: TokenStream) -> expr.Expr:
     """
-    program ::= block
+    program ::= { funcdef | arraydecl | stmt }
+    A program without functions or arrays is just its block.
     """
-    left = _block(stream)
+    functions = { }
+    arrays = { }
+    stmts = [ ]
+    while True:
+        if stream.peek().kind is TokenCat.DEF:
+            func = _funcdef(stream)
+            if func.name in functions:
+                raise InputError(f"Function {func.name} is defined twice")
+            functions[func.name] = func
+        elif stream.peek().kind is TokenCat.ARRAY:
+            name, size = _arraydecl(stream)
+            if name in arrays:
+                raise InputError(f"Array {name} is declared twice")
+            arrays[name] = size
+        elif stream.peek().kind in first["stmt"]:
+            stmts.append(_stmt(stream))
+        else:
+            break
     require(stream, TokenCat.END)
-    return left
+    body = expr.Block(stmts) if stmts else expr.Pass()
+    if any(isinstance(node, expr.Return) for node in expr.walk(body)):
+        raise InputError("'return' outside of a function")
+    # Link each call to the function it calls
+    for tree in [body] + [func.body for func in functions.values()]:
+        for node in expr.walk(tree):
+            if isinstance(node, expr.Call):
+                if node.name not in functions:
+                    raise InputError(f"Call to undefined function {node.name}")
+                node.func = functions[node.name]
+                if len(node.args) != len(node.func.params):
+                    raise InputError(f"{node.name} takes {len(node.func.params)} arguments, "
+                                     f"but {len(node.args)} were given")
+            else:
+                _check_arrays(node, arrays)
+    if not functions and not arrays:
+        return body
+    return expr.Program(body, functions, arrays)
+
+
+def _check_arrays(node: expr.Expr, arrays: dict):
+    """Arrays must be declared and used only as arrays"""
+    if isinstance(node, (expr.Index, expr.IndexAssign, expr.Fill)):
+        names = [node.name]
+    elif isinstance(node, expr.Copy):
+        names = [node.target, node.source]
+    elif isinstance(node, expr.Var) and node.name in arrays:
+        raise InputError(f"Array {node.name} used without an index")
+    else:
+        return
+    for name in names:
+        if name not in arrays:
+            raise InputError(f"Array {name} is not declared")
+    if isinstance(node, expr.Copy) and arrays[node.source] > arrays[node.target]:
+        raise InputError(f"Cannot copy array {node.source} of size {arrays[node.source]} "
+                         f"into array {node.target} of size {arrays[node.target]}")
+    index = getattr(node, "index", None)
+    if isinstance(index, expr.Const) and not 0 <= index.value() < arrays[node.name]:
+        raise InputError(f"Index {index.value()} out of range for array {node.name} "
+                         f"of size {arrays[node.name]}")
+
+
+def _arraydecl(stream: TokenStream) -> tuple:
+    """
+    arraydecl ::= 'array' IDENT '[' CONST ']' ';'
+    Returns the name and size.
+    """
+    require(stream, TokenCat.ARRAY, consume=True)
+    require(stream, TokenCat.IDENT, "array name")
+    name = stream.take().value
+    require(stream, TokenCat.LBRACKET, consume=True)
+    require(stream, TokenCat.CONST, "array size")
+    size = int(stream.take().value)
+    if size < 1:
+        raise InputError(f"Array {name} must have at least one element")
+    require(stream, TokenCat.RBRACKET, consume=True)
+    require(stream, TokenCat.SEMI, "semicolon after array declaration", consume=True)
+    return name, size
+
+
+def _funcdef(stream: TokenStream) -> expr.FunctionDef:
+    """
+    funcdef ::= 'def' IDENT '(' [ IDENT { ',' IDENT } ] ')' 'do' block 'od'
+    """
+    require(stream, TokenCat.DEF, consume=True)
+    require(stream, TokenCat.IDENT, "function name")
+    name = stream.take().value
+    require(stream, TokenCat.LPAREN, consume=True)
+    params = [ ]
+    if stream.peek().kind is TokenCat.IDENT:
+        params.append(stream.take().value)
+        while stream.peek().kind is TokenCat.COMMA:
+            stream.take()
+            require(stream, TokenCat.IDENT, "parameter name")
+            params.append(stream.take().value)
+    require(stream, TokenCat.RPAREN, consume=True)
+    if len(set(params)) != len(params):
+        raise InputError(f"Repeated parameter name in function {name}")
+    if len(params) > expr.MAX_PARAMS:
+        raise InputError(f"Function {name} has more than {expr.MAX_PARAMS} parameters")
+    require(stream, TokenCat.DO, consume=True)
+    body = _block(stream)
+    require(stream, TokenCat.OD, consume=True)
+    return expr.FunctionDef(name, params, body)
 
 
 def _block(stream: TokenStream) -> expr.Expr:
@@ -77,13 +195,10 @@ def _block(stream: TokenStream) -> expr.Expr:
     log.debug(f"Parsing block from token {stream.peek()}")
     if stream.peek().kind not in first["stmt"]:
         return expr.Pass()
-    left = _stmt(stream)
-    log.debug(f"Starting block with {left}")
+    stmts = [ ]
     while stream.peek().kind in first["stmt"]:
-        right = _stmt(stream)
-        log.debug(f"Adding statement to block: {right}")
-        left = expr.Seq(left, right)
-    return left
+        stmts.append(_stmt(stream))
+    return expr.Block(stmts)
 
 
 def _stmt(stream: TokenStream) -> expr.Expr:
@@ -94,17 +209,57 @@ def _stmt(stream: TokenStream) -> expr.Expr:
         return _while(stream)
     if stream.peek().kind is TokenCat.IF:
         return _if(stream)
+    if stream.peek().kind is TokenCat.RETURN:
+        stream.take()
+        value = _expr(stream)
+        require(stream, TokenCat.SEMI, "semicolon after return", consume=True)
+        return expr.Return(value)
+    if stream.peek().kind in (TokenCat.FILL, TokenCat.COPY):
+        return _bulk(stream)
     if stream.peek().kind is not TokenCat.IDENT:
         raise InputError(f"Expecting identifier at beginning of assignment, got {stream.peek()}")
-    target = expr.Var(stream.take().value)
+    name = stream.take().value
+    index = None
+    if stream.peek().kind is TokenCat.LBRACKET:
+        index = _subscript(stream)
     if stream.peek().kind is not TokenCat.ASSIGN:
-        raise InputError("Expecting assignment symbol, got {stream.peek()}")
+        raise InputError(f"Expecting assignment symbol, got {stream.peek()}")
     stream.take()  # Discard token
     value = _expr(stream)
     if stream.peek().kind is not TokenCat.SEMI:
         raise InputError(f"Expecting semicolon after assignment, got {stream.peek()}")
     stream.take()  # Discard token
-    return expr.Assign(target, value)
+    if index is not None:
+        return expr.IndexAssign(name, index, value)
+    return expr.Assign(expr.Var(name), value)
+
+
+def _bulk(stream: TokenStream) -> expr.Expr:
+    """
+    fillstmt ::= 'fill' '(' IDENT ',' exp ')' ';'
+    copystmt ::= 'copy' '(' IDENT ',' IDENT ')' ';'
+    """
+    op = stream.take()
+    require(stream, TokenCat.LPAREN, consume=True)
+    require(stream, TokenCat.IDENT, "array name")
+    name = stream.take().value
+    require(stream, TokenCat.COMMA, consume=True)
+    if op.kind is TokenCat.FILL:
+        result = expr.Fill(name, _expr(stream))
+    else:
+        require(stream, TokenCat.IDENT, "array name")
+        result = expr.Copy(name, stream.take().value)
+    require(stream, TokenCat.RPAREN, consume=True)
+    require(stream, TokenCat.SEMI, f"semicolon after {op.value}", consume=True)
+    return result
+
+
+def _subscript(stream: TokenStream) -> expr.Expr:
+    """'[' exp ']'"""
+    require(stream, TokenCat.LBRACKET, consume=True)
+    index = _expr(stream)
+    require(stream, TokenCat.RBRACKET, consume=True)
+    return index
 
 
 def _while(stream: TokenStream) -> expr.While:
@@ -137,7 +292,21 @@ def _if(stream: TokenStream) -> expr.If:
 
 def _expr(stream: TokenStream) -> expr.Expr:
     """
-    expr ::= term { ('+'|'-') term }
+    expr ::= sum [ RELOP sum ]
+    Comparisons do not chain:  a < b < c is an error.
+    """
+    left = _sum(stream)
+    if stream.peek().kind is TokenCat.RELOP:
+        op = stream.take()
+        right = _sum(stream)
+        kind, clazz = OPS[op.value]
+        left = clazz(left, right)
+    return left
+
+
+def _sum(stream: TokenStream) -> expr.Expr:
+    """
+    sum ::= term { ('+'|'-') term }
     """
     log.debug(f"parsing sum starting from token {stream.peek()}")
     left = _term(stream)
@@ -179,6 +348,10 @@ def _primary(stream: TokenStream) -> expr.Expr:
         log.debug(f"Returning Const node from token {token}")
         return expr.Const(int(token.value))
     elif token.kind is TokenCat.IDENT:
+        if stream.peek().kind is TokenCat.LPAREN:
+            return _call(token.value, stream)
+        if stream.peek().kind is TokenCat.LBRACKET:
+            return expr.Index(token.value, _subscript(stream))
         log.debug(f"Variable {token.value}")
         return expr.Var(token.value)
     elif token.kind is TokenCat.LPAREN:
@@ -187,3 +360,18 @@ def _primary(stream: TokenStream) -> expr.Expr:
         return nested
     else:
         raise InputError(f"Confused about {token} in expression")
+
+
+def _call(name: str, stream: TokenStream) -> expr.Call:
+    """call ::= IDENT '(' [ exp { ',' exp } ] ')'
+    (the IDENT has been consumed)
+    """
+    require(stream, TokenCat.LPAREN, consume=True)
+    args = [ ]
+    if stream.peek().kind is not TokenCat.RPAREN:
+        args.append(_expr(stream))
+        while stream.peek().kind is TokenCat.COMMA:
+            stream.take()
+            args.append(_expr(stream))
+    require(stream, TokenCat.RPAREN, consume=True)
+    return expr.Call(name, args)
@@ -25,11 +25,20 @@ class TokenCat(Enum):
         THEN = re.compile("then")
         ELSE = re.compile("else")
         FI = re.compile("fi")
+        DEF = re.compile("def")
+        RETURN = re.compile("return")
+        COMMA = re.compile(",")
+        ARRAY = re.compile("array")
+        FILL = re.compile("fill")
+        COPY = re.compile("copy")
+        LBRACKET = re.compile(r"\[")
+        RBRACKET = re.compile(r"\]")
         ASSIGN = re.compile("=")
         SEMI = re.compile(";")
         IDENT = re.compile(r"[a-zA-Z]\w*")
         MULOP = re.compile(r"[*/]")
         ADDOP = re.compile(r"[-+]")
+        RELOP = re.compile(r"==|!=|<=|>=|<|>")
         UNOP = re.compile(r"~")
         CONST = re.compile(r"[0-9]+")
         LPAREN = re.compile(r"\(")
@@ -49,6 +58,12 @@ OPS = { "*": (TokenCat.MULOP, expr.Times)
         , "+": (TokenCat.ADDOP, expr.Plus)
         , "-": (TokenCat.ADDOP, expr.Minus)
         , "/": (TokenCat.MULOP, expr.Div)
-        , "=": (TokenCat.ASSIGN, expr.Assign)  # Later we'll want separate ==, <=, etc.
+        , "=": (TokenCat.ASSIGN, expr.Assign)
+        , "<": (TokenCat.RELOP, expr.Less)
+        , "<=": (TokenCat.RELOP, expr.LessEq)
+        , "==": (TokenCat.RELOP, expr.Equals)
+        , "!=": (TokenCat.RELOP, expr.NotEquals)
+        , ">=": (TokenCat.RELOP, expr.GreaterEq)
+        , ">": (TokenCat.RELOP, expr.Greater)
         , "~": (TokenCat.UNOP, expr.Neg)
       }
@@ -0,0 +1,257 @@
+"""
+Tests for bytecode.py:  the bytecode virtual machine
+should produce the same output as the tree-walking
+interpreter (the 'eval' methods).
+"""
+
+import unittest
+import io
+from compiler import expr
+from compiler.env import Env, SlotEnv
+from compiler.bytecode import Program
+from compiler.codegen_context import Context
+from compiler.llparse import parse, InputError
+
+FACT = """
+x = in ;
+fact = 1 ;
+while x do
+    fact = fact * x ;
+    x = x - 1 ;
+od
+out = fact ;
+out = 0 - ( 7 / 2 ) + x ;
+if fact - 120 then out = 1 ; else out = 0 ; fi
+"""
+
+COMPARE = """
+a = in ; b = in ;
+out = a < b ; out = a <= b ; out = a == b ;
+out = a != b ; out = a >= b ; out = a > b ;
+"""
+
+FUNCS = """
+def square ( x ) do return x * x ; od
+def fact ( n ) do
+    if n <= 1 then return 1 ; fi
+    return n * fact ( n - 1 ) ;
+od
+def sumsq ( a , b ) do
+    s = square ( a ) + square ( b ) ;
+    total = total + s ;
+    return s ;
+od
+total = 0 ;
+n = in ;
+out = fact ( n ) ;
+out = 2 * sumsq ( sumsq ( 1 , 2 ) , n ) - n ;
+out = total ;
+"""
+
+ARRAYS = """
+array a [ 6 ] ;
+array b [ 8 ] ;
+fill ( b , in ) ;
+i = 0 ;
+while i < 6 do a [ i ] = i * i ; i = i + 1 ; od
+i = 1 ;
+while i < 5 do b [ i ] = a [ i - 1 ] + a [ i + 1 ] ; i = i + 1 ; od
+out = b [ 0 ] ; out = b [ 4 ] ;
+copy ( b , a ) ;
+out = b [ 5 ] + b [ 7 ] ;
+def get ( k ) do return a [ k ] ; od
+out = get ( 3 ) ;
+"""
+
+
+def run_eval(src: str, inputs: list) -> list:
+    """Outputs of the tree-walking interpreter"""
+    outputs = [ ]
+    env = Env(expr.Const, expr.NO_VALUE)
+    env.hook_input("in", lambda name: expr.Const(inputs.pop(0)))
+    env.hook_output("out", lambda val: outputs.append(val.value()))
+    parse(io.StringIO(src)).eval(env)
+    return outputs
+
+
+def run_bytecode(src: str, inputs: list) -> list:
+    """Outputs of the bytecode virtual machine"""
+    outputs = [ ]
+    program = Program(expr.NO_VALUE.value())
+    program.hook_input("in", lambda name: inputs.pop(0))
+    program.hook_output("out", outputs.append)
+    parse(io.StringIO(src)).gen_bytecode(program)
+    program.run()
+    return outputs
+
+
+def run_closure(src: str, inputs: list) -> list:
+    """Outputs of the closure compiler"""
+    outputs = [ ]
+    env = SlotEnv(int, expr.NO_VALUE.value())
+    env.hook_input("in", lambda name: inputs.pop(0))
+    env.hook_output("out", outputs.append)
+    parse(io.StringIO(src)).closure(env)(env.values)
+    return outputs
+
+
+class TestBytecode(unittest.TestCase):
+
+    def test_same_as_eval(self):
+        self.assertEqual(run_bytecode(FACT, [5]), [120, -3, 0])
+        self.assertEqual(run_bytecode(FACT, [5]), run_eval(FACT, [5]))
+        self.assertEqual(run_bytecode(FACT, [3]), run_eval(FACT, [3]))
+
+    def test_compare(self):
+        for a, b in [(2, 5), (5, 5), (7, 3)]:
+            self.assertEqual(run_bytecode(COMPARE, [a, b]), run_eval(COMPARE, [a, b]))
+        self.assertEqual(run_bytecode(COMPARE, [2, 5]), [1, 1, 0, 1, 0, 0])
+
+    def test_default_value(self):
+        src = "out = y ; y = 3 ; out = y ;"
+        self.assertEqual(run_bytecode(src, []), run_eval(src, []))
+
+    def test_neg(self):
+        program = Program(0)
+        exp = expr.Assign(expr.Var("x"), expr.Neg(expr.Const(4)))
+        exp.gen_bytecode(program)
+        slots = program.run()
+        self.assertEqual(slots[program.vars["x"]], -4)
+
+    def test_store_into_variable(self):
+        """x = x + 1 needs only one instruction"""
+        program = Program(0)
+        parse(io.StringIO("x = x + 1 ;")).gen_bytecode(program)
+        self.assertEqual(len(program.listing()), 1)
+
+
+class TestFunctions(unittest.TestCase):
+
+    def test_same_in_all(self):
+        """'total' is assigned in sumsq, so it is local there"""
+        expected = [120, 2 * (25 + 25) - 5, 0]
+        self.assertEqual(run_eval(FUNCS, [5]), expected)
+        self.assertEqual(run_bytecode(FUNCS, [5]), expected)
+        self.assertEqual(run_closure(FUNCS, [5]), expected)
+
+    def test_leaf(self):
+        """A leaf function needs no stack frame"""
+        context = Context()
+        parse(io.StringIO(FUNCS)).gen(context, "r1")
+        context.gen_functions()
+        lines = context.get_lines()
+        square = lines[lines.index("fn_square:  #Function square"):lines.index("fn_fact:  #Function fact")]
+        self.assertFalse(any("r14" in line for line in square))
+        self.assertIn("\tADD r15,r13,r0  # Return", square)
+
+    def test_crowded_leaf(self):
+        """A leaf function whose body needs more registers
+        than its locals leave free gets a stack frame
+        """
+        src = """def f ( a , b , c , d ) do
+            e = a + 1 ; g = b + 2 ; h = c + 3 ; k = d + 4 ;
+            return a * ( b + ( c * ( d + ( e * ( g + ( h * k ) ) ) ) ) ) ;
+        od
+        out = f ( 1 , 2 , 3 , 4 ) ;"""
+        context = Context()
+        parse(io.StringIO(src)).gen(context, "r1")
+        context.gen_functions()
+        self.assertIn("\tSTORE r13,r14,r0", context.get_lines())
+        self.assertEqual(run_eval(src, []), [326])
+
+    def test_nested_calls(self):
+        """The registers saved for a call are reused for its
+        arguments, so calls in arguments nest deeply, even in
+        a loop that holds values in registers.
+        """
+        call = "f ( m , " * 12 + "x" + " )" * 12
+        src = """def f ( a , b ) do return a + b ; od
+        m = 2 ; x = 3 ; s = 0 ;
+        while x do s = s + {} ; x = x - 1 ; od
+        out = s ;""".format(call)
+        for options in [{ }, {"hoist": True}]:
+            context = Context(**options)
+            parse(io.StringIO(src)).gen(context, "r1")
+            context.gen_functions()
+        self.assertEqual(run_eval(src, []), [78])
+
+    def test_no_functions(self):
+        """Without functions, r13 and r14 are free for expressions.
+        Reads of 'in' must stay in order, so each level takes a register.
+        """
+        src = "out = in" + " * ( in + ( in" * 6 + " * in" + " ) )" * 6 + " ;"
+        context = Context()
+        context.hook_var("in", 510)
+        work_register = context.alloc_reg()
+        parse(io.StringIO(src)).gen(context, work_register)
+        self.assertIn("r14", " ".join(context.get_lines()))
+
+    def test_right_nested(self):
+        """The deeper operand goes first, so a right-nested
+        expression needs no register per level.
+        """
+        value = "x" + " - ( x * ( 3" * 15 + " - x" + " ) )" * 15
+        src = "x = 2 ; out = {} ;".format(value)
+        context = Context()
+        work_register = context.alloc_reg()
+        parse(io.StringIO(src)).gen(context, work_register)
+        self.assertNotIn("r3", " ".join(context.get_lines()))
+        self.assertEqual(run_eval(src, []), [eval(value, {"x": 2})])
+
+    def test_nested_compares(self):
+        """A comparison used as a value computes its left
+        operand in its own target register
+        """
+        src = "out = in" + " < ( in" * 12 + " )" * 12 + " ;"
+        context = Context()
+        context.hook_var("in", 510)
+        work_register = context.alloc_reg()
+        parse(io.StringIO(src)).gen(context, work_register)
+        self.assertEqual(run_eval(src, list(range(13))), [0])
+
+    def test_errors(self):
+        for src in ["return 1 ;",
+                    "x = f ( 1 ) ;",
+                    "def f ( a ) do return a ; od x = f ( 1 , 2 ) ;",
+                    "def f ( a , a ) do od",
+                    "def f ( ) do od def f ( ) do od"]:
+            with self.assertRaises(InputError):
+                parse(io.StringIO(src))
+
+
+class TestArrays(unittest.TestCase):
+
+    def test_same_in_all(self):
+        expected = [4, 9 + 25, 25 + 4, 9]
+        self.assertEqual(run_eval(ARRAYS, [4]), expected)
+        self.assertEqual(run_bytecode(ARRAYS, [4]), expected)
+        self.assertEqual(run_closure(ARRAYS, [4]), expected)
+
+    def test_displacement(self):
+        """a [ i + 1 ] costs no addition"""
+        context = Context()
+        parse(io.StringIO("array a [ 4 ] ; out = a [ i + 1 ] ;")).gen(context, "r1")
+        ops = [line.split()[0] for line in context.get_lines() if line.startswith("\t")]
+        self.assertNotIn("ADD", ops)
+
+    def test_out_of_range(self):
+        src = "array a [ 4 ] ; i = in ; out = a [ i ] ;"
+        for run in [run_eval, run_bytecode, run_closure]:
+            for i in [-1, 4]:
+                with self.assertRaises(IndexError):
+                    run(src, [i])
+
+    def test_errors(self):
+        for src in ["x = a [ 0 ] ;",
+                    "array a [ 2 ] ; x = a ;",
+                    "array a [ 2 ] ; a = 1 ;",
+                    "array a [ 2 ] ; a [ 2 ] = 1 ;",
+                    "array a [ 2 ] ; array b [ 1 ] ; copy ( b , a ) ;",
+                    "array a [ 0 ] ;",
+                    "array a [ 1 ] ; array a [ 1 ] ;"]:
+            with self.assertRaises(InputError):
+                parse(io.StringIO(src))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+Tests for cache.py:  stages are reused for unchanged
+source, and back end stages are invalidated separately.
+"""
+
+import unittest
+import os
+import tempfile
+from compiler import expr
+from compiler.cache import Cache
+
+SOURCE = "x = 5 ; out = x * 2 ;"
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ast(self):
+        tree = Cache(self.dir, SOURCE).ast()
+        self.assertIsInstance(tree, expr.Block)
+        cache = Cache(self.dir, SOURCE)
+        self.assertEqual(len(cache.get("tokens")), 10)
+        self.assertEqual(str(cache.get("ast")), str(tree))
+        self.assertIsNone(Cache(self.dir, SOURCE + " y = 1 ;").get("ast"))
+
+    def test_back_end(self):
+        dep = os.path.join(self.dir, "backend.py")
+        with open(dep, "w") as f:
+            f.write("version 1")
+        cache = Cache(self.dir, SOURCE)
+        cache.put("asm", ["HALT"], [dep])
+        cache.ast()
+        self.assertEqual(Cache(self.dir, SOURCE).get("asm", [dep]), ["HALT"])
+        with open(dep, "w") as f:
+            f.write("version 2")
+        cache = Cache(self.dir, SOURCE)
+        self.assertIsNone(cache.get("asm", [dep]))
+        self.assertIsNotNone(cache.get("ast"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests for codegen_context.py:  rendering assembly code
+and resolving labels for direct object code generation.
+"""
+
+import unittest
+from compiler.codegen_context import Context
+
+
+class TestContext(unittest.TestCase):
+
+    def test_lines(self):
+        context = Context()
+        context.hook_var("out", 511)
+        context.add_label("top", "Loop")
+        context.add_var_access("LOAD", "r1", "x")
+        context.add_instr("JUMP", cond="Z", symbol="top")
+        context.add_var_access("STORE", "r1", "out")
+        self.assertEqual(context.get_lines(),
+                         ["top:  #Loop",
+                          "\tLOAD r1,x_1",
+                          "\tJUMP/Z top",
+                          "\tSTORE r1,r0,r0[511]",
+                          "x_1: DATA 0 #x"])
+
+    def test_resolve(self):
+        context = Context()
+        context.add_line("# comments take no space")
+        context.add_label("top")
+        context.add_var_access("LOAD", "r1", "x")
+        context.add_instr("LOAD", "r2", symbol=context.get_const_symbol(7))
+        context.add_instr("JUMP", cond="Z", symbol="top")
+        context.add_instr("HALT")
+        program = context.get_instructions()
+        self.assertEqual(len(program), 6)
+        load_x, load_7, jump, halt, x, seven = program
+        self.assertEqual((load_x.op, load_x.src2, load_x.offset), ("LOAD", "r15", 4))
+        self.assertEqual((load_7.op, load_7.offset), ("LOAD", 4))
+        self.assertEqual((jump.op, jump.cond, jump.target, jump.offset),
+                         ("ADD", "Z", "r15", -2))
+        self.assertEqual(halt.op, "HALT")
+        self.assertEqual((x, seven), (0, 7))
+
+    def test_array(self):
+        """Array elements are addressed by absolute address,
+        filled in by the Context rather than the assembler.
+        """
+        context = Context()
+        context.declare_array("a", 3)
+        context.add_var_access("LOAD", "r2", "x")
+        context.add_element_access("LOAD", "r1", "a", "r2", 1)
+        context.add_instr("HALT")
+        lines = context.get_lines()
+        self.assertEqual(lines[1], "\tLOAD r1,r2,r0[5]  # a[r2+1]")
+        self.assertEqual(lines[-3:], ["a_1: DATA 0 #a[3]", "\tDATA 0", "\tDATA 0"])
+        program = context.get_instructions()
+        self.assertEqual(program[1].offset, 5)
+        self.assertEqual(program[3:], [0, 0, 0, 0])
+
+    def test_memory_full(self):
+        context = Context()
+        context.declare_array("a", 600)
+        context.add_instr("HALT")
+        with self.assertRaises(RuntimeError):
+            context.get_lines()
+
+    def test_stack_size(self):
+        """Frames along the deepest chain of calls, with
+        one frame for a recursive call
+        """
+        context = Context()
+        context.push_regs(["r1", "r2"])
+        context.note_call("f")
+        context.pop_regs(["r1", "r2"])
+        context.begin_frame("f", 3)
+        context.note_call("g")
+        context.note_call("f")
+        context.begin_frame("g", 0)
+        self.assertEqual(context.stack_size("g"), 0)
+        self.assertEqual(context.stack_size(), 2 + 3 + 3)
+
+    def test_undefined_label(self):
+        context = Context()
+        context.add_instr("JUMP", symbol="nowhere")
+        with self.assertRaises(RuntimeError):
+            context.get_instructions()
+
+
+if __name__ == '__main__':
+    unittest.main()
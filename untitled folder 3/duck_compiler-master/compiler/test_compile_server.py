@@ -0,0 +1,51 @@
+"""
+Tests for compile_server.py:  JSON-lines requests are
+answered in order, in this process or by a pool.
+"""
+
+import unittest
+import json
+import threading
+from compile_server import serve
+
+REQUESTS = [json.dumps({"id": 1, "source": "x = 5 ; out = x ;"}),
+            "",
+            json.dumps({"id": 2, "source": "x = = ;"}),
+            json.dumps({"id": 3, "source": "out = 7 ;", "name": "seven.awl"})]
+
+
+class TestServer(unittest.TestCase):
+
+    def check(self, responses):
+        self.assertEqual([r["id"] for r in responses], [1, 2, 3])
+        self.assertIn("\tHALT r0,r0,r0", responses[0]["asm"])
+        self.assertTrue(responses[1]["error"].startswith("Syntax error"))
+        self.assertIn("seven.awl", responses[2]["asm"][1])
+
+    def test_in_process(self):
+        self.check([json.loads(r) for r in serve(REQUESTS, jobs=0)])
+
+    def test_pool(self):
+        self.check([json.loads(r) for r in serve(REQUESTS, jobs=2, chunk=4)])
+
+    def test_interactive(self):
+        """A client that waits for each response before
+        sending the next request is answered
+        """
+        answered = threading.Event()
+        waits = [ ]
+
+        def client():
+            yield REQUESTS[0]
+            waits.append(answered.wait(5))
+            yield REQUESTS[3]
+        responses = serve(client(), jobs=2)
+        first = json.loads(next(responses))
+        answered.set()
+        rest = [json.loads(r) for r in responses]
+        self.assertEqual([first["id"]] + [r["id"] for r in rest], [1, 3])
+        self.assertEqual(waits, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+Tests for difftest.py:  generated programs are reproducible
+and give the same output in every back end.
+"""
+
+import unittest
+import os
+import difftest
+
+
+class TestDifftest(unittest.TestCase):
+
+    def test_reproducible(self):
+        self.assertEqual(difftest.ProgramGenerator(7).program(),
+                         difftest.ProgramGenerator(7).program())
+        self.assertNotEqual(difftest.ProgramGenerator(7).program(),
+                            difftest.ProgramGenerator(8).program())
+
+    def test_interpreters_agree(self):
+        for seed in range(40):
+            result = difftest.check(seed)
+            self.assertEqual(result["status"], "pass", msg=result)
+            for name in difftest.BACKENDS:
+                self.assertIsInstance(result["results"][name], list)
+
+    @unittest.skipUnless(os.path.isdir(difftest.MACHINE_DIR), "Duck Machine not found")
+    def test_machine_agrees(self):
+        results = list(difftest.run_all(range(20), jobs=2, chunk=4, machine=difftest.MACHINE_DIR))
+        self.assertEqual(sorted(result["seed"] for result in results), list(range(20)))
+        for result in results:
+            self.assertEqual(result["status"], "pass", msg=result)
+            self.assertIn("duck", result["results"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,9 @@ Tests for expr.py,
 
 import unittest
 from compiler import expr
-from compiler.env import Env
+from compiler.env import Env, SlotEnv
+from compiler.codegen_context import Context
+from compiler.bytecode import Program
 
 
 class TestExpr(unittest.TestCase):
@@ -85,6 +87,170 @@ class TestExpr(unittest.TestCase):
         result = expr.Plus(x, expr.Const(4)).eval(env)
         self.assertEqual(result, expr.Const(13))
 
+    def test_compare(self):
+        env = Env(expr.Const, expr.NO_VALUE)
+        three = expr.Const(3)
+        four = expr.Const(4)
+        self.assertEqual(expr.Less(three, four).eval(env), expr.Const(1))
+        self.assertEqual(expr.Greater(three, four).eval(env), expr.Const(0))
+        self.assertEqual(expr.Equals(four, four).eval(env), expr.Const(1))
+
+    def test_compare_branch(self):
+        """A comparison as a condition is one subtraction and a jump"""
+        context = Context()
+        loop = expr.While(expr.Less(expr.Var('i'), expr.Const(10)),
+                          expr.Assign(expr.Var('i'), expr.Plus(expr.Var('i'), expr.Const(1))))
+        loop.gen(context, "r1")
+        lines = context.get_lines()
+        self.assertEqual(lines[1:4], ["\tLOAD r1,i_3", "\tSUB r0,r1,r0[9]", "\tJUMP/P endloop_2"])
+
+
+class TestClosure(unittest.TestCase):
+
+    def test_arithmetic(self):
+        env = SlotEnv(int, 0)
+        x = expr.Var('x')
+        exp = expr.Minus(expr.Times(x, expr.Const(3)),
+                         expr.Div(expr.Neg(expr.Const(9)), expr.Const(2)))
+        program = expr.Seq(expr.Assign(x, expr.Const(4)),
+                           expr.Assign(x, exp)).closure(env)
+        program(env.values)
+        self.assertEqual(env.values[env.slot('x')], 17)
+        self.assertEqual(env.get('x'), 17)
+
+    def test_hooks(self):
+        env = SlotEnv(int, 0)
+        outputs = [ ]
+        env.hook_input("in", lambda name: 6)
+        env.hook_output("out", outputs.append)
+        i = expr.Var('i')
+        loop = expr.While(i, expr.Seq(
+            expr.Assign(expr.Var('out'), i),
+            expr.Assign(i, expr.Minus(i, expr.Const(2)))))
+        program = expr.Seq(expr.Assign(i, expr.Var('in')), loop).closure(env)
+        program(env.values)
+        self.assertEqual(outputs, [6, 4, 2])
+        self.assertEqual(env.get('in'), 6)
+        env.put('out', 9)
+        self.assertEqual(outputs, [6, 4, 2, 9])
+        env.clear()
+        self.assertEqual(env.get('i'), 0)
+
+
+class TestDeepProgram(unittest.TestCase):
+    """Long blocks and long chains of operations must not
+    exceed the Python recursion limit in any back end.
+    """
+
+    def setUp(self):
+        x = expr.Var('x')
+        total = x
+        for i in range(5000):
+            total = expr.Plus(total, expr.Const(1))
+        stmts = [expr.Assign(x, expr.Const(0))]
+        stmts += [expr.Assign(x, expr.Plus(x, expr.Const(1))) for i in range(20000)]
+        stmts.append(expr.Assign(expr.Var('y'), total))
+        self.program = expr.Block(stmts)
+
+    def test_eval(self):
+        env = Env(expr.Const, expr.NO_VALUE)
+        self.program.eval(env)
+        self.assertEqual(env.get('y'), expr.Const(25000))
+
+    def test_gen(self):
+        context = Context()
+        self.program.gen(context, "r0")
+        self.assertGreater(len(context.get_lines()), 60000)
+
+    def test_bytecode(self):
+        program = Program(0)
+        self.program.gen_bytecode(program)
+        slots = program.run()
+        self.assertEqual(slots[program.vars['y']], 25000)
+
+    def test_closure(self):
+        env = SlotEnv(int, 0)
+        self.program.closure(env)(env.values)
+        self.assertEqual(env.get('x'), 20000)
+        self.assertEqual(env.get('y'), 25000)
+
+
+class TestLoopOptimizations(unittest.TestCase):
+
+    def counted(self, *stmts) -> expr.While:
+        """while x do <stmts> x = x - 1 ; od"""
+        x = expr.Var('x')
+        decrement = expr.Assign(x, expr.Minus(x, expr.Const(1)))
+        return expr.While(x, expr.Block(list(stmts) + [decrement]))
+
+    def gen(self, loop: expr.Expr, **options) -> list:
+        context = Context(**options)
+        context.alloc_reg()
+        loop.gen(context, "r1")
+        return context.get_lines()
+
+    def test_unroll(self):
+        s = expr.Var('s')
+        loop = self.counted(expr.Assign(s, expr.Plus(s, expr.Var('x'))))
+        lines = self.gen(loop, unroll=3)
+        # Three copies of the body, and the remainder loop
+        self.assertEqual(sum(line.startswith("\tSTORE r1,s_") for line in lines), 4)
+        self.assertIn("\tSUB r0,r2,r0[3]", lines)
+        self.assertIn("\tJUMP/M remainder_2", lines)
+
+    def test_not_counted(self):
+        """x is changed elsewhere in the loop, so it does
+        not count the iterations.
+        """
+        x = expr.Var('x')
+        loop = self.counted(expr.Assign(x, expr.Plus(x, expr.Const(2))))
+        self.assertEqual(self.gen(loop, unroll=3), self.gen(loop))
+
+    def test_hoist(self):
+        s = expr.Var('s')
+        loop = self.counted(expr.Assign(s, expr.Plus(s, expr.Var('m'))))
+        lines = self.gen(loop, hoist=True)
+        head = [i for i, line in enumerate(lines) if line.startswith("loop_")][0]
+        loads = [i for i, line in enumerate(lines) if line.startswith("\tLOAD") and "m_" in line]
+        self.assertEqual(len(loads), 1)
+        self.assertLess(loads[0], head)
+        self.assertIn("\tADD r1,r1,r2", lines[head:])
+
+    def test_hoist_crowded(self):
+        """A loop body that needs most of the registers
+        leaves fewer to hold values
+        """
+        s, m, k = expr.Var('s'), expr.Var('m'), expr.Var('k')
+        value = expr.Plus(expr.Times(m, k), expr.Plus(m, expr.Const(5)))
+        for i in range(9):
+            # Reads of 'in' are kept in order, one register each
+            value = expr.Plus(expr.Var('in'), value)
+        loop = self.counted(expr.Assign(s, expr.Plus(s, value)))
+        context = Context(hoist=True)
+        context.hook_var('in', 510)
+        context.alloc_reg()
+        loop.gen(context, "r1")
+        lines = context.get_lines()
+        head = [i for i, line in enumerate(lines) if line.startswith("loop_")][0]
+        # Only the most used value fits
+        self.assertEqual(lines[:head], ["\tLOAD r2,m_1"])
+
+    def test_hoist_nested(self):
+        """What the outer loop holds is released after it,
+        though the inner loop is measured in between.
+        """
+        s, t, y = expr.Var('s'), expr.Var('t'), expr.Var('y')
+        # t is held by the inner loop only, since the outer one assigns it
+        inner = self.counted(expr.Assign(s, expr.Plus(expr.Plus(s, expr.Var('m')), t)))
+        outer = expr.While(y, expr.Block([inner,
+                                          expr.Assign(t, expr.Plus(t, y)),
+                                          expr.Assign(y, expr.Minus(y, expr.Const(1)))]))
+        context = Context(hoist=True)
+        context.alloc_reg()
+        outer.gen(context, "r1")
+        self.assertIsNone(context.var_register('m'))
+        self.assertEqual(context.held_consts, { })
+
 
 if __name__ == '__main__':
     unittest.main()
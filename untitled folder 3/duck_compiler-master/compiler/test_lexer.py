@@ -0,0 +1,48 @@
+"""
+Tests for lexer.py:  token categories, comments,
+and line and column positions.
+"""
+
+import unittest
+import io
+from compiler import lexer
+from compiler.syntax import TokenCat
+
+
+class TestLexer(unittest.TestCase):
+
+    def test_stream(self):
+        stream = lexer.TokenStream(io.StringIO("x = 5 ; # set x\n\n  while x do od\n"))
+        kinds = [ ]
+        while stream.has_more():
+            kinds.append(stream.take().kind)
+        self.assertEqual(kinds, [TokenCat.IDENT, TokenCat.ASSIGN, TokenCat.CONST,
+                                 TokenCat.SEMI, TokenCat.WHILE, TokenCat.IDENT,
+                                 TokenCat.DO, TokenCat.OD])
+        self.assertIs(stream.peek(), lexer.END)
+        self.assertIs(stream.take(), lexer.END)
+
+    def test_positions(self):
+        tokens = lexer.lex("x = 5 ;\n  # comment\n  out = x ;")
+        self.assertEqual([(t.line, t.column) for t in tokens],
+                         [(1, 1), (1, 3), (1, 5), (1, 7),
+                          (3, 3), (3, 7), (3, 9), (3, 11)])
+
+    def test_keyword_prefix(self):
+        token = lexer.classify("whilex")
+        self.assertEqual(token.kind, TokenCat.IDENT)
+
+    def test_keyword_table(self):
+        """Every literal token is classified by lookup"""
+        for word in ["while", "fi", "=", ";", "(", "*", "-", "~"]:
+            self.assertIn(word, lexer.KEYWORDS)
+        self.assertEqual(lexer.classify("-").kind, TokenCat.ADDOP)
+        self.assertEqual(lexer.classify("42").kind, TokenCat.CONST)
+
+    def test_bad_token(self):
+        with self.assertRaises(lexer.LexicalError):
+            lexer.lex("x = 5x ;")
+
+
+if __name__ == '__main__':
+    unittest.main()
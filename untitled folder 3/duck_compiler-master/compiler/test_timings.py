@@ -0,0 +1,39 @@
+"""
+Tests for timings.py:  phases are measured only when
+enabled, and reported as JSON.
+"""
+
+import unittest
+import io
+import json
+from compiler.timings import Timings, count_nodes
+from compiler.llparse import parse
+
+
+class TestTimings(unittest.TestCase):
+
+    def test_report(self):
+        timings = Timings()
+        with timings.phase("build"):
+            junk = [str(i) for i in range(1000)]
+        timings.count("junk", len(junk))
+        report = json.loads(timings.report(program="test"))
+        self.assertEqual(report["program"], "test")
+        self.assertEqual(report["counts"], {"junk": 1000})
+        self.assertGreater(report["phases"]["build"]["alloc_bytes"], 0)
+        self.assertGreaterEqual(report["phases"]["build"]["seconds"], 0)
+
+    def test_disabled(self):
+        timings = Timings(False)
+        with timings.phase("build"):
+            pass
+        self.assertEqual(timings.phases, { })
+
+    def test_count_nodes(self):
+        exp = parse(io.StringIO("x = 1 ; while x do x = x - 1 ; od"))
+        # Block, Assign, Var, Const, While, Var, Block, Assign, Var, Minus, Var, Const
+        self.assertEqual(count_nodes(exp), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
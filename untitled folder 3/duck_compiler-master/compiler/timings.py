@@ -0,0 +1,74 @@
+"""
+Wall time and memory allocation for each phase of compiling
+or interpreting a program, with counts of tokens, syntax tree
+nodes, instructions and so on, reported as JSON (see the
+--timings option of compile.py and interpret.py).
+
+For each phase we report elapsed seconds, the net change in
+bytes traced by tracemalloc, the peak traced bytes during the
+phase, and the net change in the number of allocated blocks.
+Tracing allocations slows Python down, so times are useful
+for comparing phases and runs, not as absolute figures.
+"""
+
+from compiler import expr
+
+from contextlib import contextmanager
+
+import json
+import sys
+import time
+import tracemalloc
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class Timings(object):
+    """Measurements of named phases.  A Timings that is not
+    enabled measures nothing, so callers need not check.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.phases = { }
+        self.counts = { }
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measure the body of a 'with' statement"""
+        if not self.enabled:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        bytes_before = tracemalloc.get_traced_memory()[0]
+        blocks_before = sys.getallocatedblocks()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        self.phases[name] = {
+            "seconds": seconds,
+            "alloc_bytes": current - bytes_before,
+            "peak_bytes": peak - bytes_before,
+            "alloc_blocks": sys.getallocatedblocks() - blocks_before
+        }
+
+    def count(self, name: str, value: int):
+        """Record a count, like the number of tokens"""
+        self.counts[name] = value
+
+    def report(self, **info) -> str:
+        """The measurements as a JSON object, with
+        additional information from keyword arguments.
+        """
+        return json.dumps(dict(info, phases=self.phases, counts=self.counts))
+
+
+def count_nodes(exp: expr.Expr) -> int:
+    """Number of Expr nodes in a syntax tree"""
+    return sum(1 for node in expr.walk(exp))
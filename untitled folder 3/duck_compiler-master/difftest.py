@@ -0,0 +1,440 @@
+"""
+Differential testing and benchmarking of the back ends.  Random
+Awl programs are run by the tree-walking interpreter (eval), the
+bytecode virtual machine, the closure compiler, and compiled code
+on the Duck Machine simulator:  as compiled by default (both
+encoded directly and through the Duck Machine assembler) and
+with the loop optimizations.  Any difference from the output of
+eval is reported, and the time taken by each back end (including
+its own code generation) is summed over all programs.
+
+Generated programs are well defined in every back end:  every
+variable is assigned before it is read, loops count a variable
+up or down to a small bound, array indices are in range, and
+divisors are never zero.  A program may still need more memory
+than the Duck Machine has; it is then skipped on the machine.
+Any other failure to compile a program counts as a failure.
+
+Each program is generated from its own seed, so a failing
+program can be shown again with --show SEED.  Programs are
+checked by a pool of worker processes (see --jobs).  The summary
+is printed as JSON, and the exit status is 1 if any program
+failed.
+"""
+
+from compile import gen_program
+from compile_run import encode, MACHINE_DIR, MEMORY_SIZE, IN_ADDR, OUT_ADDR
+from compiler.llparse import parse
+from compiler import expr
+from compiler.env import Env, SlotEnv
+from compiler.bytecode import Program
+from compiler.codegen_context import LayoutError
+
+from typing import Callable, Dict, List
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Global variables, and arrays with their sizes.  Loops run
+# at most MAX_TRIPS times, so that a loop counter can index
+# any array.
+GLOBALS = ["v0", "v1", "v2", "v3"]
+ARRAYS = {"a0": 6, "a1": 4}
+MAX_TRIPS = 4
+INPUTS = 2
+
+# Machine steps allowed before a program is taken to be stuck
+STEP_LIMIT = 200000
+
+# Options for Context of each Duck Machine back end, and
+# whether it goes through the assembler
+MACHINE_BACKENDS = {"duck": ({ }, False),
+                    "duck_asm": ({ }, True),
+                    "duck_opt": ({"unroll": 4, "hoist": True}, False)}
+
+
+def cli() -> object:
+    """Get arguments from command line"""
+    parser = argparse.ArgumentParser(description="Differential testing of Awl back ends")
+    parser.add_argument("-n", "--count", type=int, default=1000,
+                        help="Number of random programs")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the first program")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of worker processes (0 to check in this process)")
+    parser.add_argument("--chunk", type=int, default=16,
+                        help="Programs handed to a worker at a time")
+    parser.add_argument("--machine", default=MACHINE_DIR,
+                        help="Directory of the Duck Machine simulator")
+    parser.add_argument("--show", type=int, metavar="SEED",
+                        help="Print the program generated from SEED and its results")
+    args = parser.parse_args()
+    return args
+
+
+class Scope(object):
+    """What generated code may refer to at some point"""
+
+    def __init__(self, readable: List[str], assignable: List[str],
+                 functions: Dict[str, int], in_function: bool):
+        self.readable = readable
+        self.assignable = assignable
+        # Callable functions, with their number of parameters
+        self.functions = functions
+        self.in_function = in_function
+        # Index expressions in range for every array
+        self.indices = [str(i) for i in range(min(ARRAYS.values()))]
+        self.loop_depth = 0
+
+    def inner(self) -> "Scope":
+        """A copy for a nested block"""
+        scope = Scope(list(self.readable), self.assignable, self.functions, self.in_function)
+        scope.indices = list(self.indices)
+        scope.loop_depth = self.loop_depth
+        return scope
+
+
+class ProgramGenerator(object):
+    """Random, well-defined Awl programs"""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.counters = 0
+        self.inputs = [self.rng.randint(-9, 9) for i in range(INPUTS)]
+
+    def program(self) -> str:
+        """Source text of a whole program"""
+        rng = self.rng
+        lines = ["array {} [ {} ] ;".format(name, size) for name, size in ARRAYS.items()]
+        functions = { }
+        for i in range(rng.randint(0, 2)):
+            name = "f{}".format(i)
+            nparams = rng.randint(1, 3)
+            lines += self.function(name, nparams, dict(functions))
+            functions[name] = nparams
+        for i, name in enumerate(GLOBALS):
+            if i < INPUTS:
+                lines.append("{} = in ;".format(name))
+            else:
+                lines.append("{} = {} ;".format(name, rng.randint(0, 9)))
+        scope = Scope(list(GLOBALS), GLOBALS, functions, False)
+        lines += self.block(scope, rng.randint(2, 5))
+        lines += ["out = {} ;".format(name) for name in GLOBALS]
+        lines.append("out = a0 [ {} ] + a1 [ {} ] ;".format(rng.randrange(6), rng.randrange(4)))
+        return "\n".join(lines) + "\n"
+
+    def function(self, name: str, nparams: int, functions: Dict[str, int]) -> List[str]:
+        """A function that may call the functions defined before it"""
+        params = ["p{}".format(i) for i in range(nparams)]
+        local_names = ["l0", "l1"]
+        lines = ["def {} ( {} ) do".format(name, " , ".join(params))]
+        scope = Scope(params + GLOBALS, params + local_names, functions, True)
+        for local_name in local_names:
+            lines.append("{} = {} ;".format(local_name, self.expr(scope, 2)))
+            scope.readable.append(local_name)
+        lines += self.block(scope, self.rng.randint(1, 3))
+        lines.append("return {} ;".format(self.expr(scope, 2)))
+        lines.append("od")
+        return lines
+
+    def block(self, scope: Scope, length: int) -> List[str]:
+        lines = [ ]
+        for i in range(length):
+            lines += self.stmt(scope)
+        return lines
+
+    def stmt(self, scope: Scope) -> List[str]:
+        rng = self.rng
+        kind = rng.choice(["assign", "assign", "element", "out", "if", "loop", "loop", "bulk"])
+        if kind == "loop" and scope.loop_depth < 2:
+            return self.loop(scope)
+        if kind == "if":
+            lines = ["if {} then".format(self.condition(scope))]
+            lines += self.block(scope.inner(), rng.randint(1, 2))
+            if scope.in_function and rng.random() < 0.3:
+                lines.append("return {} ;".format(self.expr(scope, 2)))
+            if rng.random() < 0.5:
+                lines.append("else")
+                lines += self.block(scope.inner(), rng.randint(1, 2))
+            lines.append("fi")
+            return lines
+        if kind == "element":
+            return ["{} [ {} ] = {} ;".format(rng.choice(list(ARRAYS)), rng.choice(scope.indices),
+                                              self.expr(scope, 2))]
+        if kind == "out":
+            return ["out = {} ;".format(self.expr(scope, 2))]
+        if kind == "bulk":
+            if rng.random() < 0.5:
+                return ["copy ( a0 , a1 ) ;"]
+            return ["fill ( {} , {} ) ;".format(rng.choice(list(ARRAYS)), self.expr(scope, 2))]
+        return ["{} = {} ;".format(rng.choice(scope.assignable), self.expr(scope, 2))]
+
+    def loop(self, scope: Scope) -> List[str]:
+        """A loop counting a fresh variable down to zero or
+        up to a bound.  Only the loop assigns its counter.
+        """
+        rng = self.rng
+        counter = "c{}".format(self.counters)
+        self.counters += 1
+        trips = rng.randint(0, MAX_TRIPS)
+        body = scope.inner()
+        body.loop_depth += 1
+        body.readable.append(counter)
+        if rng.random() < 0.6:
+            step = rng.choice([1, 1, 2])
+            test = rng.choice(["{} > 0"] + (["{}", "{} != 0"] if step == 1 else [ ]))
+            body.indices.append("{} - 1".format(counter))
+            lines = ["{} = {} ;".format(counter, trips),
+                     "while {} do".format(test.format(counter))]
+            lines += self.block(body, rng.randint(1, 2))
+            lines.append("{0} = {0} - {1} ;".format(counter, step))
+        else:
+            body.indices.append(counter)
+            lines = ["{} = 0 ;".format(counter),
+                     "while {} < {} do".format(counter, trips)]
+            lines += self.block(body, rng.randint(1, 2))
+            lines.append("{0} = {0} + 1 ;".format(counter))
+        lines.append("od")
+        scope.readable.append(counter)
+        return lines
+
+    def condition(self, scope: Scope) -> str:
+        op = self.rng.choice(["<", "<=", "==", "!=", ">=", ">"])
+        return "{} {} {}".format(self.expr(scope, 2), op, self.expr(scope, 2))
+
+    def expr(self, scope: Scope, depth: int) -> str:
+        """An expression of at most this depth.  Products
+        have a constant factor and quotients a positive
+        divisor, so that values stay small and defined.
+        """
+        rng = self.rng
+        choice = rng.random()
+        if depth <= 0 or choice < 0.25:
+            if rng.random() < 0.4:
+                return str(rng.randint(0, 9))
+            return rng.choice(scope.readable)
+        if choice < 0.55:
+            return "( {} {} {} )".format(self.expr(scope, depth - 1), rng.choice("+-"),
+                                         self.expr(scope, depth - 1))
+        if choice < 0.65:
+            return "( {} * {} )".format(self.expr(scope, depth - 1), rng.randint(0, 5))
+        if choice < 0.72:
+            if rng.random() < 0.5:
+                divisor = str(rng.randint(1, 5))
+            else:
+                leaf = rng.choice(scope.readable)
+                divisor = "( {0} * {0} + 1 )".format(leaf)
+            return "( {} / {} )".format(self.expr(scope, depth - 1), divisor)
+        if choice < 0.82:
+            return "( {} )".format(self.condition(scope))
+        if choice < 0.92 or not scope.functions:
+            return "{} [ {} ]".format(rng.choice(list(ARRAYS)), rng.choice(scope.indices))
+        name = rng.choice(list(scope.functions))
+        args = [self.expr(scope, depth - 1) for i in range(scope.functions[name])]
+        return "{} ( {} )".format(name, " , ".join(args))
+
+
+def run_eval(exp: expr.Expr, inputs: List[int]) -> List[int]:
+    outputs = [ ]
+    feed = iter(inputs)
+    env = Env(expr.Const, expr.NO_VALUE)
+    env.hook_input("in", lambda name: expr.Const(next(feed)))
+    env.hook_output("out", lambda val: outputs.append(val.value()))
+    exp.eval(env)
+    return outputs
+
+
+def run_bytecode(exp: expr.Expr, inputs: List[int]) -> List[int]:
+    outputs = [ ]
+    feed = iter(inputs)
+    program = Program(expr.NO_VALUE.value())
+    program.hook_input("in", lambda name: next(feed))
+    program.hook_output("out", outputs.append)
+    exp.gen_bytecode(program)
+    program.run()
+    return outputs
+
+
+def run_closure(exp: expr.Expr, inputs: List[int]) -> List[int]:
+    outputs = [ ]
+    feed = iter(inputs)
+    env = SlotEnv(int, expr.NO_VALUE.value())
+    env.hook_input("in", lambda name: next(feed))
+    env.hook_output("out", outputs.append)
+    exp.closure(env)(env.values)
+    return outputs
+
+
+class Unsupported(Exception):
+    """The program does not fit in the Duck Machine's memory"""
+    pass
+
+
+def machine_runner(options: dict, assemble: bool = False) -> Callable[[expr.Expr, List[int]], List[int]]:
+    """A back end that compiles with these Context options
+    and runs the object code on the Duck Machine simulator,
+    which must be on the module search path.  The object code
+    is encoded directly, or produced from the assembly source
+    by the Duck Machine's two assembler passes.
+    """
+    def run_machine(exp: expr.Expr, inputs: List[int]) -> List[int]:
+        from memory import MemoryMappedIO
+        from cpu import CPU
+        try:
+            context = gen_program(exp, **options)
+            if assemble:
+                words = assemble_lines(context.get_lines())
+            else:
+                words = encode(context.get_instructions())
+        except LayoutError as e:
+            raise Unsupported(str(e))
+        outputs = [ ]
+        feed = iter(inputs)
+        mem = MemoryMappedIO(MEMORY_SIZE)
+        mem.map_address_in(IN_ADDR, lambda addr: next(feed))
+        mem.map_address_out(OUT_ADDR, lambda addr, value: outputs.append(value))
+        for addr, word in enumerate(words):
+            mem.put(addr, word)
+        cpu = CPU(mem)
+        for step in range(STEP_LIMIT):
+            if cpu.halted:
+                return outputs
+            cpu.step()
+        raise RuntimeError("No HALT after {} steps".format(STEP_LIMIT))
+    return run_machine
+
+
+def assemble_lines(lines: List[str]) -> List[int]:
+    """Object code from assembly source, as the Duck Machine
+    assembler would produce it.  The assembler reports errors
+    on standard output, so that is captured for the exception.
+    """
+    import assembler_pass1
+    import assembler_pass2
+    lines = list(lines)
+    report = io.StringIO()
+    words = [ ]
+    with contextlib.redirect_stdout(report):
+        symbols, errors = assembler_pass1.resolve_labels(lines)
+        if not errors:
+            assembler_pass1.transform_instructions(lines, symbols)
+            words = assembler_pass2.assemble(lines)
+    if errors or report.getvalue():
+        raise ValueError("Assembly failed: {}".format(report.getvalue().strip()))
+    return words
+
+
+BACKENDS = {"eval": run_eval, "bytecode": run_bytecode, "closure": run_closure}
+
+
+def machine_available() -> bool:
+    """Whether the Duck Machine simulator can be imported"""
+    try:
+        import cpu
+        import memory
+    except ImportError:
+        return False
+    return True
+
+
+def skipped(result: object) -> bool:
+    return isinstance(result, str) and result.startswith("skipped")
+
+
+def check(seed: int) -> dict:
+    """Generate the program for a seed and run it in every
+    back end.  The result has the outputs (or error) and
+    time of each back end, and a status:  'pass', 'fail',
+    or 'invalid' if eval itself failed.  Back ends that
+    skipped the program do not count as failing.
+    """
+    generator = ProgramGenerator(seed)
+    source = generator.program()
+    inputs = generator.inputs
+    backends = dict(BACKENDS)
+    if machine_available():
+        for name, (options, assemble) in MACHINE_BACKENDS.items():
+            backends[name] = machine_runner(options, assemble)
+    start = time.perf_counter()
+    exp = parse(io.StringIO(source))
+    seconds = {"parse": time.perf_counter() - start}
+    results = { }
+    for name, run in backends.items():
+        start = time.perf_counter()
+        try:
+            results[name] = run(exp, list(inputs))
+        except Unsupported as e:
+            results[name] = "skipped: {}".format(e)
+        except Exception as e:
+            results[name] = "{}: {}".format(type(e).__name__, e)
+        seconds[name] = time.perf_counter() - start
+    expected = results["eval"]
+    if not isinstance(expected, list):
+        status = "invalid"
+    elif all(result == expected or skipped(result) for result in results.values()):
+        status = "pass"
+    else:
+        status = "fail"
+    return {"seed": seed, "status": status, "inputs": inputs,
+            "results": results, "seconds": seconds}
+
+
+def init_worker(machine: str):
+    """Make the Duck Machine simulator importable"""
+    sys.path.insert(0, machine)
+
+
+def run_all(seeds: List[int], jobs: int, chunk: int, machine: str):
+    """Results of checking each seed, in no particular order"""
+    init_worker(machine)
+    if jobs == 0:
+        yield from map(check, seeds)
+        return
+    with multiprocessing.Pool(jobs, initializer=init_worker, initargs=(machine,)) as pool:
+        yield from pool.imap_unordered(check, seeds, chunk)
+
+
+def main():
+    args = cli()
+    if args.show is not None:
+        init_worker(args.machine)
+        print(ProgramGenerator(args.show).program())
+        print(json.dumps(check(args.show), indent=2))
+        return
+    init_worker(args.machine)
+    if not machine_available():
+        log.warning("Duck Machine not found in %s; testing the interpreters only", args.machine)
+    counts = {"pass": 0, "fail": 0, "invalid": 0}
+    skips = { }
+    seconds = { }
+    start = time.perf_counter()
+    for result in run_all(range(args.seed, args.seed + args.count), args.jobs, args.chunk, args.machine):
+        counts[result["status"]] += 1
+        for name, elapsed in result["seconds"].items():
+            seconds[name] = seconds.get(name, 0) + elapsed
+        for name, outputs in result["results"].items():
+            if skipped(outputs):
+                skips[name] = skips.get(name, 0) + 1
+        if result["status"] != "pass":
+            print(json.dumps(result), flush=True)
+    wall = time.perf_counter() - start
+    print(json.dumps(dict(counts, programs=args.count, skipped=skips,
+                          seconds=seconds, wall_seconds=wall,
+                          programs_per_minute=60 * args.count / wall)))
+    if counts["fail"] or counts["invalid"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,17 @@
 Driver (main program) for intepreter.
 Should process the same language as the
 compiler, but interprets it rather than
-compiling it into assembly code.
+compiling it into assembly code.  With --timings, the
+time and memory used by each phase are reported as JSON
+on standard error.
 """
 
-from compiler.llparse import parse
+from compiler.llparse import parse_tokens
+from compiler.lexer import lex
 from compiler import expr
-from compiler.env import Env
+from compiler.env import Env, SlotEnv
+from compiler.bytecode import Program, INSTR_SIZE
+from compiler.timings import Timings, count_nodes
 
 import argparse
 import sys
@@ -27,6 +32,12 @@ def cli() -> object:
     parser.add_argument("outfile", type=argparse.FileType('w'),
                         nargs="?", default=sys.stdout,
                         help="Output file for assembly code")
+    parser.add_argument("-b", "--bytecode", action="store_true",
+                        help="Compile to bytecode and run in virtual machine")
+    parser.add_argument("-f", "--fast", action="store_true",
+                        help="Compile the syntax tree to closures before running")
+    parser.add_argument("--timings", action="store_true",
+                        help="Report time and memory for each phase as JSON on stderr")
     args = parser.parse_args()
     return args
 
@@ -52,16 +63,62 @@ def duck_out(val: expr.Const):
     print("Program output: {}".format(val.value()))
 
 
+def run_bytecode(exp: expr.Expr, timings: Timings):
+    """Interpret by way of the bytecode virtual machine,
+    which works on plain ints rather than Const nodes.
+    """
+    program = Program(expr.NO_VALUE.value())
+    program.hook_input("in", lambda name: duck_in(name).value())
+    program.hook_output("out", lambda val: duck_out(expr.Const(val)))
+    with timings.phase("compile"):
+        exp.gen_bytecode(program)
+    timings.count("instructions", len(program.code) // INSTR_SIZE)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Bytecode:\n%s", "\n".join(program.listing()))
+    with timings.phase("run"):
+        program.run()
+
+
+def run_closure(exp: expr.Expr, timings: Timings):
+    """Interpret by converting the tree into closures
+    once, then calling the closure for the whole program.
+    Variables are resolved to slots of a SlotEnv holding
+    plain ints rather than Const nodes.
+    """
+    env = SlotEnv(int, expr.NO_VALUE.value())
+    env.hook_input("in", lambda name: duck_in(name).value())
+    env.hook_output("out", lambda val: duck_out(expr.Const(val)))
+    with timings.phase("compile"):
+        program = exp.closure(env)
+    with timings.phase("run"):
+        program(env.values)
+
+
 def main():
     args = cli()
     try:
-        exp = parse(args.sourcefile)
-        log.debug("Parsed to: {}".format(exp))
-        env = Env(expr.Const, expr.NO_VALUE)
-        env.hook_input("in", duck_in)
-        env.hook_output("out", duck_out)
-        exp.eval(env)
+        timings = Timings(args.timings)
+        with timings.phase("lex"):
+            tokens = lex(args.sourcefile.read())
+        with timings.phase("parse"):
+            exp = parse_tokens(tokens)
+        log.debug("Parsed to: %s", exp)
+        if args.bytecode:
+            run_bytecode(exp, timings)
+        elif args.fast:
+            run_closure(exp, timings)
+        else:
+            env = Env(expr.Const, expr.NO_VALUE)
+            env.hook_input("in", duck_in)
+            env.hook_output("out", duck_out)
+            with timings.phase("run"):
+                exp.eval(env)
         print("#Interpretation complete")
+        if args.timings:
+            timings.count("tokens", len(tokens))
+            timings.count("nodes", count_nodes(exp))
+            mode = "bytecode" if args.bytecode else "fast" if args.fast else "eval"
+            print(timings.report(program=args.sourcefile.name, mode=mode), file=sys.stderr)
     except Exception as e:
         print("Failed!")
         print(e)